@@ -0,0 +1,24 @@
+"""Benchmarks for the Ridare rendering and query paths
+
+Run a benchmark as a module from the root of the project. E.g.:
+
+$ python -m benchmarks.bench_xslt
+
+bench_suite runs all the hot paths offline, and can check the results against a
+baseline:
+
+$ python -m benchmarks.bench_suite --baseline benchmarks/baseline.json
+
+eml_generator generates seeded synthetic EML documents of a given size, and
+bench_scale uses them to time parsing, XPath queries and rendering from 10 KB to 50 MB:
+
+$ python -m benchmarks.eml_generator --out /tmp/eml --count 100 --size 1MB
+$ python -m benchmarks.bench_scale
+
+fake_pasta serves EML documents from a directory at the PASTA paths, with configurable
+latency, failures and throttling. bench_load points Ridare at it, and measures the
+throughput and latency percentiles with cold and warm caches:
+
+$ python -m benchmarks.fake_pasta --eml-dir /tmp/eml --latency-ms 100
+$ python -m benchmarks.bench_load --pids 200 --concurrency 16
+"""
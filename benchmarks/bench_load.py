@@ -0,0 +1,213 @@
+"""Load test Ridare against a local fake PASTA server
+
+Starts a fake PASTA server (benchmarks.fake_pasta) and a Ridare server, each in its own
+process. Ridare is pointed at the fake server through its config, with PASTA_D set to
+the URL of the fake server and CACHE_D set to an empty temporary directory, and is
+served by the threaded werkzeug server.
+
+Requests are then sent from --concurrency client threads, in phases:
+
+    cold    Each pid is requested once. Every request fetches the EML document from
+            the fake server, and renders the HTML.
+    warm    The same requests, repeated --warm-passes times. The requests are served
+            from the caches.
+
+For each phase, the throughput, the latency percentiles and the responses by status are
+printed. Without --eml-dir, --pids documents of --size are generated with
+benchmarks.eml_generator.
+
+To load test a Ridare deployment instead, e.g., under gunicorn, run
+benchmarks.fake_pasta on its own and point PASTA_D in webapp/config.py at it.
+
+$ python -m benchmarks.bench_load [--pids N] [--size 100KB] [--eml-dir DIR]
+    [--concurrency N] [--warm-passes N] [--endpoint html|raw|multi]
+    [--xpath //dataset/abstract] [--latency-ms N] [--jitter-ms N] [--error-rate 0.01]
+    [--not-found-rate 0.01] [--max-rps N] [--json results.json]
+"""
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import json
+import logging
+import multiprocessing
+import pathlib
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+import benchmarks.eml_generator as eml_generator
+import benchmarks.fake_pasta as fake_pasta
+
+ENV = 'development'
+PHASE_TUPLE = ('cold', 'warm')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    fake_pasta.add_arguments(parser)
+    parser.add_argument(
+        '--pids', type=int, default=50, help='Number of documents to generate without --eml-dir'
+    )
+    parser.add_argument(
+        '--size', type=eml_generator.parse_size, default='100KB', help='Generated document size'
+    )
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of client threads')
+    parser.add_argument('--warm-passes', type=int, default=3, help='Passes over the warm cache')
+    parser.add_argument('--endpoint', choices=('html', 'raw', 'multi'), default='html')
+    parser.add_argument('--xpath', default='//dataset/abstract', help='XPath to request')
+    parser.add_argument('--json', type=pathlib.Path, help='Write the results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        option_dict = fake_pasta.get_option_dict(args)
+        if args.eml_dir is None:
+            option_dict['eml_dir'] = _generate_corpus(pathlib.Path(temp_dir), args)
+        pid_list = [
+            '.'.join(pid_tuple)
+            for pid_tuple in fake_pasta.get_eml_path_dict(option_dict['eml_dir'])
+        ]
+        if not pid_list:
+            print(f'No EML documents in {option_dict["eml_dir"]}')
+            return 1
+        cache_dir = pathlib.Path(temp_dir, 'cache')
+        cache_dir.mkdir()
+        with (
+            fake_pasta.running(**option_dict) as pasta_url,
+            running_ridare(pasta_url, cache_dir) as ridare_url,
+        ):
+            print(f'{len(pid_list)} pids, {args.concurrency} clients, endpoint {args.endpoint}')
+            request_list = get_request_list(ridare_url, args.endpoint, pid_list, args.xpath)
+            results_dict = {
+                'cold': run_phase(request_list, args.concurrency),
+                'warm': run_phase(request_list * args.warm_passes, args.concurrency),
+                'fake_pasta': requests.get(f'{pasta_url.rsplit("/", 1)[0]}/_stats').json(),
+            }
+
+    print_results(results_dict)
+    if args.json:
+        args.json.write_text(json.dumps(results_dict, indent=2) + '\n')
+    return 0
+
+
+def get_request_list(
+    ridare_url: str, endpoint: str, pid_list: list[str], xpath: str
+) -> list[tuple[str, str, dict | None]]:
+    """Return (method, url, JSON body) for one request per pid"""
+    if endpoint == 'multi':
+        url = f'{ridare_url}/multi?env={ENV}'
+        return [('POST', url, {'pid': [pid], 'query': [xpath]}) for pid in pid_list]
+    prefix = '/raw' if endpoint == 'raw' else ''
+    return [('GET', f'{ridare_url}{prefix}/{pid}/{xpath}?env={ENV}', None) for pid in pid_list]
+
+
+def run_phase(request_list: list[tuple[str, str, dict | None]], concurrency: int) -> dict:
+    """Send the requests from concurrency threads, and return the throughput, the latency
+    percentiles and the number of responses by status"""
+    session_local = threading.local()
+
+    def send(request_tuple):
+        method, url, json_dict = request_tuple
+        if not hasattr(session_local, 'session'):
+            session_local.session = requests.Session()
+        start_ts = time.perf_counter()
+        try:
+            response = session_local.session.request(method, url, json=json_dict)
+            status = str(response.status_code)
+        except requests.exceptions.RequestException:
+            status = 'error'
+        return status, (time.perf_counter() - start_ts) * 1000
+
+    start_ts = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        result_list = list(executor.map(send, request_list))
+    wall_sec = time.perf_counter() - start_ts
+    return {
+        'requests': len(result_list),
+        'wall_sec': wall_sec,
+        'rps': len(result_list) / wall_sec,
+        **get_latency_summary([ms for _, ms in result_list]),
+        'status': dict(collections.Counter(status for status, _ in result_list)),
+    }
+
+
+def get_latency_summary(ms_list: list[float]) -> dict[str, float]:
+    """Return the p50, p95 and p99 latencies"""
+    if len(ms_list) < 2:
+        ms_list = ms_list * 2 or [0.0, 0.0]
+    pct_list = statistics.quantiles(ms_list, n=100, method='inclusive')
+    return {'p50_ms': pct_list[49], 'p95_ms': pct_list[94], 'p99_ms': pct_list[98]}
+
+
+def print_results(results_dict: dict):
+    print(
+        f'{"phase":<8}{"requests":>10}{"wall s":>9}{"req/s":>9}'
+        f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}  status'
+    )
+    for phase in PHASE_TUPLE:
+        r = results_dict[phase]
+        status_str = ' '.join(f'{k}:{v}' for k, v in sorted(r['status'].items()))
+        print(
+            f'{phase:<8}{r["requests"]:>10}{r["wall_sec"]:>9.2f}{r["rps"]:>9.1f}'
+            f'{r["p50_ms"]:>10.1f}{r["p95_ms"]:>10.1f}{r["p99_ms"]:>10.1f}  {status_str}'
+        )
+    status_str = ' '.join(f'{k}:{v}' for k, v in sorted(results_dict['fake_pasta'].items()))
+    print(f'fake PASTA responses: {status_str}')
+
+
+@contextlib.contextmanager
+def running_ridare(pasta_url: str, cache_dir: pathlib.Path):
+    """Run Ridare in a child process, with the development environment pointed at the
+    fake PASTA server and an empty cache, and yield its URL"""
+    port_queue = multiprocessing.Queue()
+    ridare_process = multiprocessing.Process(
+        target=_serve_ridare, args=(pasta_url, cache_dir, port_queue), daemon=True
+    )
+    ridare_process.start()
+    try:
+        yield f'http://127.0.0.1:{port_queue.get()}'
+    finally:
+        ridare_process.terminate()
+        ridare_process.join()
+
+
+def _serve_ridare(pasta_url: str, cache_dir: pathlib.Path, port_queue: multiprocessing.Queue):
+    import werkzeug.serving
+
+    import webapp.config
+
+    config = webapp.config.Config
+    config.PASTA_D = pasta_url
+    config.CACHE_D = cache_dir.as_posix()
+    config.MARKDOWN_RENDERER = 'local'
+    config.METRICS_DIR = None
+
+    # Imported here, as importing the app sets up logging to webapp/run.log
+    import webapp.run
+
+    # Rendering logs the source of each fragment, and failed fetches are logged with a
+    # traceback. The failures are counted in the results instead.
+    logging.disable(logging.ERROR)
+    server = werkzeug.serving.make_server('127.0.0.1', 0, webapp.run.app, threaded=True)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def _generate_corpus(out_dir: pathlib.Path, args: argparse.Namespace) -> pathlib.Path:
+    eml_dir = out_dir / 'eml'
+    eml_dir.mkdir()
+    for i in range(args.pids):
+        pid = f'bench.{i + 1}.1'
+        eml_bytes = eml_generator.generate_eml(pid, seed=args.seed + i, size=args.size)
+        (eml_dir / f'{pid}.xml').write_bytes(eml_bytes)
+    return eml_dir
+
+
+if __name__ == '__main__':
+    sys.exit(main())
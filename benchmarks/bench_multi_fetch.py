@@ -0,0 +1,78 @@
+"""Benchmark fetching of uncached EML documents by /multi
+
+Starts a local fake PASTA server (benchmarks.fake_pasta) that serves the same EML
+document for every pid after a fixed delay, then times build_multi_results() for each
+combination of pid count and concurrency cap. All documents are fetched from the fake server, as each run uses new
+pids and an empty cache.
+
+With parallel fetching, the wall time should grow with pid count / concurrency cap
+rather than with the pid count.
+
+$ python -m benchmarks.bench_multi_fetch [--latency-ms N] [--pids N ...] [--caps N ...]
+"""
+import argparse
+import itertools
+import logging
+import pathlib
+import sys
+import tempfile
+import time
+
+import benchmarks.fake_pasta as fake_pasta
+import webapp.config
+import webapp.eml_store
+import webapp.multi_helpers
+import webapp.utils
+
+PROJ_ROOT = pathlib.Path(__file__).parent.parent.resolve()
+EML_PATH = PROJ_ROOT / 'tests/test_docs/knb-lter-cap.661.2.eml.xml'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--latency-ms', type=float, default=50, help='Delay added to each fake PASTA response'
+    )
+    parser.add_argument('--pids', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--caps', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    config = webapp.config.Config
+    env = config.ENV_D
+    run_counter = itertools.count()
+
+    print(f'latency: {args.latency_ms} ms')
+    print(f'{"pids":>6}{"cap":>6}{"wall s":>10}{"ms/pid":>10}')
+    with (
+        fake_pasta.running(default_eml_path=EML_PATH, latency_ms=args.latency_ms) as pasta_url,
+        tempfile.TemporaryDirectory() as cache_dir,
+    ):
+        config.PASTA_D = pasta_url
+        config.CACHE_D = cache_dir
+        for pid_count in args.pids:
+            for cap in args.caps:
+                config.MULTI_FETCH_CONCURRENCY_D = cap
+                webapp.multi_helpers._executor_dict.pop(env, None)
+                webapp.eml_store.clear()
+                run_idx = next(run_counter)
+                pids = [f'bench.{run_idx}{i:04d}.1' for i in range(pid_count)]
+                start_ts = time.perf_counter()
+                results = webapp.multi_helpers.build_multi_results(
+                    pids, ['//dataset/title'], env
+                )
+                wall_sec = time.perf_counter() - start_ts
+                assert list(results) == pids
+                pid_ms = wall_sec / pid_count * 1000
+                print(f'{pid_count:>6}{cap:>6}{wall_sec:>10.3f}{pid_ms:>10.2f}')
+
+    for server, stats in webapp.utils.get_http_pool_stats().items():
+        print(
+            f'{server}: {stats["requests"]} requests, {stats["connections"]} connections, '
+            f'{stats["reused"]} reused'
+        )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
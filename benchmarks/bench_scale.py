@@ -0,0 +1,99 @@
+"""Benchmark how parsing, XPath queries and rendering scale with the size of the EML
+
+Generates a synthetic EML document for each size with benchmarks.eml_generator, and
+times each stage on it:
+
+    parse   Parse the document, as eml_store.get_eml_tree() does
+    xpath   Run the default TextType XPaths and //attribute, as /multi does
+    render  Render every TextType element in the dataset to HTML
+    raw     Pretty print the document, as the /raw endpoint does
+
+Each stage is timed --repeat times, and the fastest time is printed, along with the time
+per MB of EML. If a stage scales linearly, the time per MB stays the same as the size
+grows. Markdown is rendered locally.
+
+$ python -m benchmarks.bench_scale [--sizes 10KB 1MB 50MB ...] [--repeat N] [--seed N]
+    [--mix text=1,docbook=1,markdown=1,mixed=1]
+"""
+import argparse
+import logging
+import sys
+import time
+
+import lxml.etree
+
+import benchmarks.eml_generator as eml_generator
+import webapp.config
+import webapp.eml_text_type
+import webapp.multi_helpers
+import webapp.prewarm
+import webapp.utils
+
+DEFAULT_SIZE_LIST = [10 * 1024, 100 * 1024, 1024**2, 10 * 1024**2, 50 * 1024**2]
+XPATH_LIST = [*webapp.prewarm.DEFAULT_XPATH_TUPLE, '//dataset/title', '//attribute']
+TEXT_TYPE_XPATH = (
+    '//dataset/abstract | //methodStep/description | //project/abstract | //project/funding'
+)
+STAGE_TUPLE = ('parse', 'xpath', 'render', 'raw')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        '--sizes', type=eml_generator.parse_size, nargs='+', default=DEFAULT_SIZE_LIST
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--mix',
+        type=eml_generator.parse_mix,
+        default=eml_generator.DEFAULT_MIX_DICT,
+        help='Weights of the TextType kinds, e.g., text=1,markdown=3',
+    )
+    args = parser.parse_args()
+
+    # Rendering logs the source of each fragment
+    logging.disable(logging.WARNING)
+    webapp.config.Config.MARKDOWN_RENDERER = 'local'
+
+    header_str = ''.join(f'{stage + " ms":>12}{"ms/MB":>9}' for stage in STAGE_TUPLE)
+    print(f'{"bytes":>12}{"elements":>10}{header_str}')
+    for size in args.sizes:
+        eml_bytes = eml_generator.generate_eml(seed=args.seed, size=size, mix_dict=args.mix)
+        stage_dict = time_stages(eml_bytes, args.repeat)
+        mb = len(eml_bytes) / 1024**2
+        element_count = int(lxml.etree.fromstring(eml_bytes).xpath('count(//*)'))
+        print(
+            f'{len(eml_bytes):>12,}{element_count:>10,}'
+            + ''.join(f'{stage_dict[s]:>12.1f}{stage_dict[s] / mb:>9.1f}' for s in STAGE_TUPLE)
+        )
+    return 0
+
+
+def time_stages(eml_bytes: bytes, repeat: int) -> dict[str, float]:
+    """Return the fastest time, in ms, of each stage on the document"""
+    root_el = lxml.etree.fromstring(eml_bytes)
+    text_type_el_list = root_el.xpath(TEXT_TYPE_XPATH)
+    stage_func_dict = {
+        'parse': lambda: lxml.etree.fromstring(eml_bytes),
+        'xpath': lambda: [
+            webapp.multi_helpers.run_xpath_query(root_el, xpath) for xpath in XPATH_LIST
+        ],
+        'render': lambda: [webapp.eml_text_type.text_to_html(el) for el in text_type_el_list],
+        'raw': lambda: webapp.utils.get_etree_as_pretty_printed_xml(root_el),
+    }
+    stage_dict = {}
+    for stage, func in stage_func_dict.items():
+        ms_list = []
+        for _ in range(repeat):
+            start_ts = time.perf_counter()
+            func()
+            ms_list.append((time.perf_counter() - start_ts) * 1000)
+        stage_dict[stage] = min(ms_list)
+    return stage_dict
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""Benchmark suite for the rendering and query hot paths, with a baseline check
+
+Runs offline, on the documents in tests/test_docs. Markdown is rendered locally, and
+/multi reads the documents from a temporary cache directory, so nothing is requested
+from PASTA or GitHub.
+
+Each case is called once to warm up, and then timed in --rounds rounds of --repeat
+calls. The time per call of the median round is the result for the case.
+
+With --json, the results are also written to a file, along with the versions of Python
+and lxml. With --baseline, the results are compared with an earlier results file, and
+the run fails, with exit status 1, if any case is more than --tolerance times slower
+than in the baseline, or if a case that is timed in the baseline was skipped or not run.
+Only the cases in OPTIONAL_CASE_TUPLE, which need docbook-xsl, may be skipped. Timings depend on the machine, so the baseline should be recorded,
+with --update-baseline, on the machine that runs the check.
+
+$ python -m benchmarks.bench_suite [--repeat N] [--rounds N] [--case SUBSTRING ...]
+    [--json results.json] [--baseline benchmarks/baseline.json] [--tolerance 1.5]
+    [--update-baseline]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import lxml.etree
+
+import webapp.compression
+import webapp.config
+import webapp.eml_store
+import webapp.eml_text_type
+import webapp.multi_helpers
+import webapp.utils
+
+PROJ_ROOT = pathlib.Path(__file__).parent.parent.resolve()
+TEST_DOCS = PROJ_ROOT / 'tests/test_docs'
+DEFAULT_BASELINE_PATH = PROJ_ROOT / 'benchmarks/baseline.json'
+RESULTS_VERSION = 1
+
+MULTI_PID_COUNT = 20
+MULTI_QUERY_LIST = [
+    '//dataset/title',
+    {'creator': '//dataset/creator/individualName/surName'},
+    '//dataset/abstract',
+    {'keywords': '//keywordSet/keyword'},
+]
+# Stand-in PASTA URL that refuses connections, so that a cache miss fails instead of
+# reaching the network
+OFFLINE_PASTA_URL = 'http://127.0.0.1:9/package'
+# Cases that are skipped when docbook-xsl is not installed
+OPTIONAL_CASE_TUPLE = ('docbook_to_html/xslt/complete_eml', 'docbook_to_html/xslt/cap.661.2')
+# Small DocBook stylesheet, rendered through the same path as docbook.xsl, so that the cost
+# of the XSLT path is timed even where docbook-xsl is not installed
+# language=xsl
+DOCBOOK_XSL_STR = '''\
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <xsl:output method="html"/>
+  <xsl:template match="/">
+    <html><body><div><xsl:apply-templates/></div></body></html>
+  </xsl:template>
+  <xsl:template match="section">
+    <div class="section"><xsl:apply-templates/></div>
+  </xsl:template>
+  <xsl:template match="section/title">
+    <h2 class="title"><xsl:apply-templates/></h2>
+  </xsl:template>
+  <xsl:template match="para">
+    <p><xsl:apply-templates/></p>
+  </xsl:template>
+  <xsl:template match="itemizedlist">
+    <ul class="itemizedlist"><xsl:apply-templates/></ul>
+  </xsl:template>
+  <xsl:template match="orderedlist">
+    <ol class="orderedlist"><xsl:apply-templates/></ol>
+  </xsl:template>
+  <xsl:template match="listitem">
+    <li class="listitem"><xsl:apply-templates/></li>
+  </xsl:template>
+  <xsl:template match="emphasis">
+    <em><xsl:apply-templates/></em>
+  </xsl:template>
+  <xsl:template match="ulink">
+    <a href="{@url}"><xsl:apply-templates/></a>
+  </xsl:template>
+  <xsl:template match="literallayout">
+    <pre class="literallayout"><xsl:apply-templates/></pre>
+  </xsl:template>
+  <xsl:template match="superscript">
+    <sup><xsl:apply-templates/></sup>
+  </xsl:template>
+  <xsl:template match="subscript">
+    <sub><xsl:apply-templates/></sub>
+  </xsl:template>
+</xsl:stylesheet>
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--repeat', type=int, default=20, help='Calls per round')
+    parser.add_argument('--rounds', type=int, default=5, help='Timed rounds per case')
+    parser.add_argument(
+        '--case', nargs='+', default=[], help='Only run the cases with one of these in the name'
+    )
+    parser.add_argument('--json', type=pathlib.Path, help='Write the results to this file')
+    parser.add_argument(
+        '--baseline',
+        type=pathlib.Path,
+        help='Compare with this results file, e.g., benchmarks/baseline.json',
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=1.5,
+        help='Fail if a case is more than this many times slower than the baseline',
+    )
+    parser.add_argument(
+        '--update-baseline', action='store_true', help='Write the results to the baseline file'
+    )
+    args = parser.parse_args()
+
+    # Rendering logs the source of each fragment
+    logging.disable(logging.WARNING)
+
+    results_dict = run(args.repeat, args.rounds, args.case)
+    baseline_dict = None
+    if args.baseline and not args.update_baseline:
+        baseline_dict = json.loads(args.baseline.read_text())
+    print_results(results_dict, baseline_dict)
+
+    if args.json:
+        args.json.write_text(json.dumps(results_dict, indent=2) + '\n')
+    if args.update_baseline:
+        baseline_path = args.baseline or DEFAULT_BASELINE_PATH
+        baseline_path.write_text(json.dumps(results_dict, indent=2) + '\n')
+        print(f'Baseline written to {baseline_path}')
+    if baseline_dict is not None:
+        regression_list = compare(results_dict, baseline_dict, args.tolerance, args.case)
+        for name, ratio in regression_list:
+            if ratio is None:
+                print(f'FAIL: {name} is timed in the baseline, but was skipped or not run')
+            else:
+                print(f'FAIL: {name} is {ratio:.2f}x the baseline (tolerance {args.tolerance}x)')
+        if regression_list:
+            return 1
+    return 0
+
+
+def run(repeat: int, rounds: int, name_filter_list: list[str] = None) -> dict:
+    """Run the cases, and return the results in the form written by --json"""
+    case_dict = {}
+    with tempfile.TemporaryDirectory() as cache_dir, _offline_config(cache_dir):
+        for name, setup_func in get_case_list():
+            if name_filter_list and not any(s in name for s in name_filter_list):
+                continue
+            try:
+                func = setup_func()
+                # Warm up, and fill the caches
+                func()
+            except Exception as e:  # pylint: disable=broad-except
+                case_dict[name] = {'skipped': str(e)}
+                continue
+            case_dict[name] = _time_case(func, repeat, rounds)
+    return {
+        'version': RESULTS_VERSION,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'lxml': '.'.join(map(str, lxml.etree.LXML_VERSION)),
+        'libxml2': '.'.join(map(str, lxml.etree.LIBXML_VERSION)),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'rounds': rounds,
+        'cases': case_dict,
+    }
+
+
+def compare(
+    results_dict: dict, baseline_dict: dict, tolerance: float, name_filter_list: list[str] = None
+) -> list[tuple[str, float | None]]:
+    """Return (name, ratio to baseline) for the cases that are slower than the baseline by
+    more than tolerance, and (name, None) for the cases that are timed in the baseline, but
+    were skipped or not run. Cases in OPTIONAL_CASE_TUPLE may be skipped, and cases left
+    out by name_filter_list are not compared."""
+    regression_list = []
+    for name, baseline_case in baseline_dict['cases'].items():
+        if 'median_ms' not in baseline_case or name in OPTIONAL_CASE_TUPLE:
+            continue
+        if name_filter_list and not any(s in name for s in name_filter_list):
+            continue
+        if 'median_ms' not in results_dict['cases'].get(name, {}):
+            regression_list.append((name, None))
+    for name, case in results_dict['cases'].items():
+        ratio = _get_ratio(case, baseline_dict['cases'].get(name))
+        if ratio is not None and ratio > tolerance:
+            regression_list.append((name, ratio))
+    return regression_list
+
+
+def print_results(results_dict: dict, baseline_dict: dict = None):
+    print(f'python {results_dict["python"]}, lxml {results_dict["lxml"]}')
+    print(f'{"case":<52}{"median ms":>12}{"min ms":>12}{"baseline":>10}')
+    for name, case in results_dict['cases'].items():
+        if 'skipped' in case:
+            print(f'{name:<52}  Skipped: {case["skipped"]}')
+            continue
+        ratio_str = ''
+        if baseline_dict is not None:
+            ratio = _get_ratio(case, baseline_dict['cases'].get(name))
+            ratio_str = '-' if ratio is None else f'{ratio:.2f}x'
+        print(f'{name:<52}{case["median_ms"]:>12.3f}{case["min_ms"]:>12.3f}{ratio_str:>10}')
+
+
+def get_case_list() -> list[tuple[str, callable]]:
+    """Return (name, setup function) for each case. The setup function returns the
+    function to time."""
+    text_to_html = webapp.eml_text_type.text_to_html
+    docbook_to_html = webapp.eml_text_type._docbook_to_html
+    markdown_to_html = webapp.eml_text_type._markdown_to_html
+    pretty_print = webapp.utils.get_etree_as_pretty_printed_xml
+    complete = 'complete_eml.xml'
+    cap = 'knb-lter-cap.661.2.eml.xml'
+    mixed = 'docbook_and_markdown.xml'
+    # name, make function to time from element, document, xpath of element
+    element_case_list = [
+        ('text_to_html/complete_eml/funding', text_to_html, complete, './/funding'),
+        ('text_to_html/cap.661.2/abstract', text_to_html, cap, './/dataset/abstract'),
+        ('text_to_html/cap.661.2/methodStep', text_to_html, cap, './/methodStep/description'),
+        ('text_to_html/docbook_and_markdown', text_to_html, mixed, '/sample/texttype'),
+        ('docbook_to_html/subset/complete_eml', docbook_to_html, complete, './/funding/section'),
+        ('docbook_to_html/subset/cap.661.2', docbook_to_html, cap, './/abstract/section'),
+        ('docbook_to_html/xslt/complete_eml', _force_xslt, complete, './/funding/section'),
+        ('docbook_to_html/xslt/cap.661.2', _force_xslt, cap, './/abstract/section'),
+        ('docbook_to_html/xslt_small/complete_eml', _small_xslt, complete, './/funding/section'),
+        ('docbook_to_html/xslt_small/cap.661.2', _small_xslt, cap, './/abstract/section'),
+        ('markdown_to_html/local/complete_eml', _force_local, complete, './/funding/markdown'),
+        ('markdown_to_html/local/docbook_and_markdown', _force_local, mixed, '//markdown'),
+        ('pretty_print/cap.661.2/abstract', pretty_print, cap, './/dataset/abstract'),
+        ('pretty_print/cap.661.2/eml', pretty_print, cap, '/*'),
+        ('pretty_print/complete_eml/eml', pretty_print, complete, '/*'),
+    ]
+    case_list = [
+        (name, _setup(func, file_name, xpath))
+        for name, func, file_name, xpath in element_case_list
+    ]
+    label = f'{MULTI_PID_COUNT}_pids/{len(MULTI_QUERY_LIST)}_queries'
+    case_list.append((f'build_multi_results/{label}', _setup_build_multi_results))
+    case_list.append((f'multi_view/{label}', _setup_multi_view))
+    return case_list
+
+
+def _setup(func, file_name: str, xpath: str):
+    """Return a setup function that parses a test document, and returns a function that
+    calls func with the first element at xpath"""
+
+    def setup_func():
+        el_list = lxml.etree.parse((TEST_DOCS / file_name).as_posix()).xpath(xpath)
+        if not el_list:
+            raise ValueError(f'No element at {xpath} in {file_name}')
+        return lambda: func(el_list[0])
+
+    return setup_func
+
+
+def _force_xslt(el: lxml.etree.Element):
+    if not webapp.eml_text_type.XSL_PATH.is_file():
+        raise FileNotFoundError(f'Stylesheet not found: {webapp.eml_text_type.XSL_PATH}')
+    return webapp.eml_text_type._docbook_to_html(el, force_xslt=True)
+
+
+def _small_xslt(el: lxml.etree.Element):
+    xsl_path = pathlib.Path(webapp.config.Config.CACHE_D, 'bench-docbook.xsl')
+    if not xsl_path.is_file():
+        xsl_path.write_text(DOCBOOK_XSL_STR)
+    return webapp.eml_text_type._docbook_to_html(el, xsl_path=xsl_path)
+
+
+def _force_local(el: lxml.etree.Element):
+    return webapp.eml_text_type._markdown_to_html(el, force_local=True)
+
+
+def _setup_build_multi_results():
+    pid_list = _add_multi_documents()
+    env = webapp.config.Config.ENV_D
+    return lambda: webapp.multi_helpers.build_multi_results(pid_list, MULTI_QUERY_LIST, env)
+
+
+def _setup_multi_view():
+    # Imported here, as importing the app sets up logging to webapp/run.log
+    import webapp.run
+
+    client = webapp.run.app.test_client()
+    payload = {'pid': _add_multi_documents(), 'query': MULTI_QUERY_LIST}
+    url = f'/multi?env={webapp.config.Config.ENV_D}'
+
+    def func():
+        response = client.post(url, json=payload)
+        # Large results are streamed, so read the body to include the work
+        response.get_data()
+        if response.status_code != 200:
+            raise ValueError(f'/multi returned {response.status}')
+
+    return func
+
+
+def _add_multi_documents() -> list[str]:
+    """Write the test EML documents into the cache under MULTI_PID_COUNT pids, alternating
+    between the documents, and return the pids"""
+    cache = webapp.config.Config.CACHE_D
+    eml_bytes_list = [
+        (TEST_DOCS / 'knb-lter-cap.661.2.eml.xml').read_bytes(),
+        (TEST_DOCS / 'complete_eml.xml').read_bytes(),
+    ]
+    pid_list = []
+    for i in range(MULTI_PID_COUNT):
+        pid = f'bench.{i + 1}.1'
+        eml_path = pathlib.Path(webapp.utils.get_cache_path(pid, cache))
+        eml_path.parent.mkdir(parents=True, exist_ok=True)
+        webapp.compression.write(eml_path, eml_bytes_list[i % len(eml_bytes_list)])
+        pid_list.append(pid)
+    return pid_list
+
+
+@contextlib.contextmanager
+def _offline_config(cache_dir: str):
+    """Point the development environment at an empty cache, with PASTA out of reach, and
+    render markdown locally. The configuration is restored on exit."""
+    config = webapp.config.Config
+    override_dict = {
+        'CACHE_D': cache_dir,
+        'PASTA_D': OFFLINE_PASTA_URL,
+        'MARKDOWN_RENDERER': 'local',
+        'METRICS_DIR': None,
+    }
+    saved_dict = {k: getattr(config, k) for k in override_dict}
+    for k, v in override_dict.items():
+        setattr(config, k, v)
+    webapp.eml_store.clear()
+    try:
+        yield
+    finally:
+        for k, v in saved_dict.items():
+            setattr(config, k, v)
+        webapp.eml_store.clear()
+
+
+def _time_case(func, repeat: int, rounds: int) -> dict:
+    round_ms_list = []
+    for _ in range(rounds):
+        start_ts = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        round_ms_list.append((time.perf_counter() - start_ts) / repeat * 1000)
+    return {
+        'median_ms': statistics.median(round_ms_list),
+        'min_ms': min(round_ms_list),
+        'calls': repeat * rounds,
+    }
+
+
+def _get_ratio(case: dict, baseline_case: dict | None) -> float | None:
+    if baseline_case is None or 'median_ms' not in case or 'median_ms' not in baseline_case:
+        return None
+    return case['median_ms'] / baseline_case['median_ms']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Benchmark rendering of the EML TextType elements in the test corpus
+
+Prints the time per call to text_to_html() for each TextType, and the time per
+rendered fragment (immediate child of the TextType).
+
+Markdown is rendered by the configured markdown processor, which may involve a round
+trip to GitHub.
+
+$ python -m benchmarks.bench_text_type [--repeat N]
+"""
+import argparse
+import logging
+import pathlib
+import sys
+import time
+
+import lxml.etree
+
+import webapp.eml_text_type
+
+PROJ_ROOT = pathlib.Path(__file__).parent.parent.resolve()
+TEST_DOCS = PROJ_ROOT / 'tests/test_docs'
+
+CASE_LIST = [
+    ('complete_eml.xml', './/funding'),
+    ('knb-lter-cap.661.2.eml.xml', './/dataset/abstract'),
+    ('knb-lter-cap.661.2.eml.xml', './/methods/methodStep/description'),
+    ('docbook_and_markdown.xml', '/sample/texttype'),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--repeat', type=int, default=20, help='Number of renders to time per TextType'
+    )
+    args = parser.parse_args()
+
+    # Rendering logs the source of each fragment.
+    logging.disable(logging.INFO)
+
+    print(f'{"document":<30}{"xpath":<38}{"fragments":>10}{"ms/call":>10}{"ms/frag":>10}')
+    for file_name, text_xpath in CASE_LIST:
+        text_type_el = lxml.etree.parse((TEST_DOCS / file_name).as_posix()).xpath(text_xpath)[0]
+        fragment_count = max(len(webapp.eml_text_type._find_immediate_children(text_type_el)), 1)
+        try:
+            # Warm up, and compile any stylesheets
+            webapp.eml_text_type.text_to_html(text_type_el)
+        except Exception as e:
+            print(f'{file_name:<30}{text_xpath:<38}  Skipped: {e}')
+            continue
+        start_ts = time.perf_counter()
+        for _ in range(args.repeat):
+            webapp.eml_text_type.text_to_html(text_type_el)
+        call_ms = (time.perf_counter() - start_ts) / args.repeat * 1000
+        print(
+            f'{file_name:<30}{text_xpath:<38}{fragment_count:>10}'
+            f'{call_ms:>10.3f}{call_ms / fragment_count:>10.3f}'
+        )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Benchmark the per-render cost of the DocBook stylesheet, with and without the registry
+
+"before" parses and compiles the stylesheet on every call, as the rendering pipeline
+used to do. "after" gets the compiled transform from webapp.xslt.
+
+Requires docbook-xsl to be installed in the root of the project (see README.md).
+
+$ python -m benchmarks.bench_xslt [--repeat N]
+"""
+import argparse
+import pathlib
+import sys
+import time
+
+import lxml.etree
+
+import webapp.eml_text_type
+import webapp.xslt
+
+PROJ_ROOT = pathlib.Path(__file__).parent.parent.resolve()
+TEST_DOCS = PROJ_ROOT / 'tests/test_docs'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--repeat', type=int, default=20, help='Number of renders to time per fragment'
+    )
+    args = parser.parse_args()
+
+    if not webapp.eml_text_type.XSL_PATH.is_file():
+        print(f'Stylesheet not found: {webapp.eml_text_type.XSL_PATH}', file=sys.stderr)
+        return 1
+
+    funding_el = _parse('complete_eml.xml').xpath('.//funding')[0]
+    abstract_el = _parse('knb-lter-cap.661.2.eml.xml').xpath('.//dataset/abstract')[0]
+    case_list = [
+        ('funding section', funding_el.xpath('section')[0]),
+        ('abstract section', abstract_el.xpath('section')[0]),
+    ]
+
+    xsl_path_str = webapp.eml_text_type.XSL_PATH.as_posix()
+    # The first call compiles the stylesheet. Keep it out of the per-render cost.
+    webapp.xslt.get('docbook')
+
+    print(f'{"fragment":<20}{"before (ms)":>14}{"after (ms)":>14}{"speedup":>10}')
+    for name, input_el in case_list:
+        before_sec = _time_per_call(
+            lambda: lxml.etree.XSLT(lxml.etree.parse(xsl_path_str))(input_el), args.repeat
+        )
+        after_sec = _time_per_call(lambda: webapp.xslt.get('docbook')(input_el), args.repeat)
+        print(
+            f'{name:<20}{before_sec * 1000:>14.3f}{after_sec * 1000:>14.3f}'
+            f'{before_sec / after_sec:>9.1f}x'
+        )
+
+
+def _parse(file_name: str) -> lxml.etree.ElementTree:
+    return lxml.etree.parse((TEST_DOCS / file_name).as_posix())
+
+
+def _time_per_call(func, repeat: int) -> float:
+    start_ts = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start_ts) / repeat
+
+
+if __name__ == '__main__':
+    sys.exit(main())
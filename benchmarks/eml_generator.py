@@ -0,0 +1,469 @@
+"""Generate synthetic EML 2.2.0 documents for scale testing
+
+The documents have the shape of EML 2.2.0 data packages: a dataset with creators,
+an abstract, keywords, coverage, methods with methodSteps, a project with funding, and
+data tables with attributes. The text is made up from a small vocabulary, so it
+compresses and renders like real text without being real.
+
+The size of a document can be set directly, with the number of attributes and
+methodSteps and the size of the abstract, or as a target size. With a target size, the
+abstract takes 5% of the target, and the rest is filled with methodSteps and attributes,
+30% and 70% of the remaining space, unless their number is given. The document comes
+out within a few percent of the target size.
+
+TextType elements (abstract, methodStep descriptions, project abstract and funding) are
+filled with one of these kinds of text, picked at random with weights given by the mix:
+
+    text      Plain text paragraphs
+    docbook   DocBook sections, with paragraphs, lists, emphasis and links
+    markdown  A markdown element, with headings, paragraphs, lists and tables
+    mixed     Plain text, DocBook with literalLayout, and markdown, side by side
+
+The same arguments and seed always generate the same document.
+
+Documents are written as <pid>.xml, e.g., bench.1.1.xml, bench.2.1.xml, ...
+
+$ python -m benchmarks.eml_generator --out DIR [--count N] [--scope bench] [--seed N]
+    [--size 1MB] [--attributes N] [--method-steps N] [--abstract-size 10KB]
+    [--mix text=1,docbook=1,markdown=1,mixed=1]
+"""
+import argparse
+import pathlib
+import random
+import re
+import sys
+
+import lxml.etree
+
+EML_NS = 'https://eml.ecoinformatics.org/eml-2.2.0'
+NSMAP = {
+    'eml': EML_NS,
+    'stmml': 'http://www.xml-cml.org/schema/stmml-1.2',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+}
+SCHEMA_LOCATION = f'{EML_NS} https://eml.ecoinformatics.org/eml-2.2.0/eml.xsd'
+XSI_SCHEMA_LOCATION = f'{{{NSMAP["xsi"]}}}schemaLocation'
+SYSTEM = 'https://pasta.edirepository.org'
+
+TEXT_KIND_TUPLE = ('text', 'docbook', 'markdown', 'mixed')
+DEFAULT_MIX_DICT = {kind: 1.0 for kind in TEXT_KIND_TUPLE}
+
+# Sizes and counts used when no target size is given
+DEFAULT_ATTRIBUTE_COUNT = 20
+DEFAULT_METHOD_STEP_COUNT = 5
+DEFAULT_ABSTRACT_SIZE = 2000
+
+# Shares of a target size
+ABSTRACT_SHARE = 0.05
+METHOD_STEP_SHARE = 0.3
+
+MIN_ABSTRACT_SIZE = 200
+METHOD_STEP_SIZE_RANGE = (300, 4000)
+ATTRIBUTES_PER_TABLE = 250
+
+# Depth of the elements that are measured as they are added
+DATASET_LEVEL = 1
+DATA_TABLE_LEVEL = 2
+METHOD_STEP_LEVEL = 3
+ATTRIBUTE_LEVEL = 4
+
+SIZE_UNIT_DICT = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3}
+
+WORD_TUPLE = tuple(
+    'abundance air analysis annual aquatic area basin biomass canopy carbon channel '
+    'chlorophyll climate coastal collected community concentration core cover data '
+    'density depth discharge diversity drought ecosystem estimate field flux forest '
+    'grassland groundwater growth habitat height index lake land layer leaf litter '
+    'measured method model moisture monitoring nitrogen nutrient observed organic plot '
+    'population precipitation productivity quadrat rate river root sample sampling '
+    'season sediment sensor site soil species station stream survey temperature transect '
+    'tree vegetation water watershed weather wetland year'.split()
+)
+UNIT_TUPLE = ('meter', 'kilogram', 'celsius', 'second', 'gramsPerSquareMeter', 'number')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--out', type=pathlib.Path, required=True, help='Output directory')
+    parser.add_argument('--count', type=int, default=1, help='Number of documents')
+    parser.add_argument('--scope', default='bench', help='Scope of the generated pids')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first document')
+    parser.add_argument('--size', type=parse_size, help='Target size, e.g., 10KB or 50MB')
+    parser.add_argument('--attributes', type=int, help='Number of attributes')
+    parser.add_argument('--method-steps', type=int, help='Number of methodSteps')
+    parser.add_argument('--abstract-size', type=parse_size, help='Size of the abstract')
+    parser.add_argument(
+        '--mix',
+        type=parse_mix,
+        default=DEFAULT_MIX_DICT,
+        help='Weights of the TextType kinds, e.g., text=1,markdown=3',
+    )
+    args = parser.parse_args()
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    for i in range(args.count):
+        pid = f'{args.scope}.{i + 1}.1'
+        eml_bytes = generate_eml(
+            pid,
+            seed=args.seed + i,
+            size=args.size,
+            attribute_count=args.attributes,
+            method_step_count=args.method_steps,
+            abstract_size=args.abstract_size,
+            mix_dict=args.mix,
+        )
+        eml_path = args.out / f'{pid}.xml'
+        eml_path.write_bytes(eml_bytes)
+        print(f'{eml_path}: {len(eml_bytes):,} bytes')
+    return 0
+
+
+def generate_eml(
+    pid: str = 'bench.1.1',
+    seed: int = 0,
+    size: int = None,
+    attribute_count: int = None,
+    method_step_count: int = None,
+    abstract_size: int = None,
+    mix_dict: dict[str, float] = None,
+) -> bytes:
+    """Return a synthetic EML 2.2.0 document. See the module docstring."""
+    return _Generator(seed, mix_dict or DEFAULT_MIX_DICT).generate(
+        pid, size, attribute_count, method_step_count, abstract_size
+    )
+
+
+def parse_size(size_str: str) -> int:
+    """Parse a size such as 500, 10KB or 1.5MB into bytes"""
+    m = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?B?)\s*', size_str.upper())
+    if not m:
+        raise ValueError(f'Invalid size: {size_str}')
+    return int(float(m.group(1)) * SIZE_UNIT_DICT[m.group(2)])
+
+
+def parse_mix(mix_str: str) -> dict[str, float]:
+    """Parse TextType weights such as "text=1,markdown=3". Kinds that are not listed get
+    weight 0."""
+    mix_dict = {}
+    for item_str in mix_str.split(','):
+        kind, _, weight_str = item_str.partition('=')
+        kind = kind.strip()
+        if kind not in TEXT_KIND_TUPLE:
+            raise ValueError(f'Invalid TextType kind: {kind}. Must be one of {TEXT_KIND_TUPLE}')
+        mix_dict[kind] = float(weight_str or 1)
+    if not any(mix_dict.values()):
+        raise ValueError('At least one TextType kind must have a weight above 0')
+    return mix_dict
+
+
+class _Generator:
+    def __init__(self, seed: int, mix_dict: dict[str, float]):
+        self.rng = random.Random(seed)
+        self.kind_list = [k for k in TEXT_KIND_TUPLE if mix_dict.get(k, 0) > 0]
+        self.weight_list = [mix_dict[k] for k in self.kind_list]
+
+    def generate(
+        self,
+        pid: str,
+        size: int | None,
+        attribute_count: int | None,
+        method_step_count: int | None,
+        abstract_size: int | None,
+    ) -> bytes:
+        if abstract_size is None:
+            if size is None:
+                abstract_size = DEFAULT_ABSTRACT_SIZE
+            else:
+                abstract_size = max(int(size * ABSTRACT_SHARE), MIN_ABSTRACT_SIZE)
+        if size is None:
+            if attribute_count is None:
+                attribute_count = DEFAULT_ATTRIBUTE_COUNT
+            if method_step_count is None:
+                method_step_count = DEFAULT_METHOD_STEP_COUNT
+
+        root_el, dataset_el = self.build_skeleton(pid, abstract_size)
+        methods_el = dataset_el.find('methods')
+
+        # With a target size, the parts that are not counted fill the space that is left.
+        # Each part is measured as it is added, so that the document is only serialized
+        # once. The dataset is added to the root element last, as parts of a tree with
+        # namespace declarations are serialized with the declarations.
+        used_size = _get_size(root_el) + _get_size(dataset_el, DATASET_LEVEL)
+        free_size = 0 if size is None else max(size - used_size, 0)
+
+        if method_step_count is not None:
+            for _ in range(method_step_count):
+                used_size += self.add_method_step(methods_el)
+        else:
+            step_size = free_size * METHOD_STEP_SHARE if attribute_count is None else free_size
+            while step_size > 0:
+                added_size = self.add_method_step(methods_el)
+                step_size -= added_size
+                used_size += added_size
+        # The methods element must not be empty
+        if not len(methods_el):
+            self.add_method_step(methods_el)
+
+        attribute_list_el = None
+        i = 0
+        while i < attribute_count if attribute_count is not None else used_size < size:
+            if i % ATTRIBUTES_PER_TABLE == 0:
+                attribute_list_el, added_size = self.add_data_table(
+                    dataset_el, i // ATTRIBUTES_PER_TABLE + 1
+                )
+                used_size += added_size
+            used_size += self.add_attribute(attribute_list_el, i + 1)
+            i += 1
+
+        root_el.append(dataset_el)
+        lxml.etree.indent(root_el)
+        return lxml.etree.tostring(root_el, xml_declaration=True, encoding='UTF-8')
+
+    def build_skeleton(
+        self, pid: str, abstract_size: int
+    ) -> tuple[lxml.etree._Element, lxml.etree._Element]:
+        """Return the root element and the dataset, without methodSteps and data tables.
+        The dataset is not yet added to the root element."""
+        root_el = lxml.etree.Element(f'{{{EML_NS}}}eml', nsmap=NSMAP)
+        root_el.set('packageId', pid)
+        root_el.set('system', SYSTEM)
+        root_el.set('scope', 'system')
+        root_el.set(XSI_SCHEMA_LOCATION, SCHEMA_LOCATION)
+
+        access_el = _sub(root_el, 'access', authSystem=f'{SYSTEM}/authentication')
+        access_el.set('order', 'allowFirst')
+        access_el.set('scope', 'document')
+        for principal, permission in (('uid=bench,o=EDI', 'all'), ('public', 'read')):
+            allow_el = _sub(access_el, 'allow')
+            _sub(allow_el, 'principal', principal)
+            _sub(allow_el, 'permission', permission)
+
+        dataset_el = lxml.etree.Element('dataset')
+        doi = f'doi:10.0000/bench/{pid}'
+        _sub(dataset_el, 'alternateIdentifier', doi, system='https://doi.org')
+        _sub(dataset_el, 'title', self.sentence(8, 20).rstrip('.'))
+        for _ in range(self.rng.randint(1, 5)):
+            self.add_party(dataset_el, 'creator')
+        self.add_party(dataset_el, 'metadataProvider')
+        _sub(dataset_el, 'pubDate', f'{self.rng.randint(1990, 2025)}')
+        _sub(dataset_el, 'language', 'english')
+        self.add_text_type(_sub(dataset_el, 'abstract'), abstract_size)
+        keyword_set_el = _sub(dataset_el, 'keywordSet')
+        for word in self.rng.sample(WORD_TUPLE, 8):
+            _sub(keyword_set_el, 'keyword', word)
+        _sub(keyword_set_el, 'keywordThesaurus', 'LTER Controlled Vocabulary')
+        rights_el = _sub(dataset_el, 'intellectualRights')
+        _sub(rights_el, 'para', 'This data package is released under the CC BY license.')
+        self.add_coverage(dataset_el)
+        self.add_party(dataset_el, 'contact')
+        _sub(dataset_el, 'methods')
+        self.add_project(dataset_el)
+        return root_el, dataset_el
+
+    def add_party(self, parent_el, tag: str):
+        party_el = _sub(parent_el, tag)
+        name_el = _sub(party_el, 'individualName')
+        _sub(name_el, 'givenName', self.word().capitalize())
+        _sub(name_el, 'surName', self.word().capitalize())
+        _sub(party_el, 'organizationName', f'{self.word().capitalize()} University')
+        _sub(party_el, 'electronicMailAddress', f'{self.word()}@example.edu')
+        _sub(party_el, 'userId', f'0000-000{self.rng.randint(1, 9)}', directory='https://orcid.org')
+        return party_el
+
+    def add_coverage(self, parent_el):
+        coverage_el = _sub(parent_el, 'coverage')
+        geo_el = _sub(coverage_el, 'geographicCoverage')
+        _sub(geo_el, 'geographicDescription', self.sentence(5, 15))
+        bounding_el = _sub(geo_el, 'boundingCoordinates')
+        west, south = self.rng.uniform(-180, 170), self.rng.uniform(-90, 80)
+        for tag, value in (
+            ('westBoundingCoordinate', west),
+            ('eastBoundingCoordinate', west + self.rng.uniform(0, 10)),
+            ('northBoundingCoordinate', south + self.rng.uniform(0, 10)),
+            ('southBoundingCoordinate', south),
+        ):
+            _sub(bounding_el, tag, f'{value:.4f}')
+        range_el = _sub(_sub(coverage_el, 'temporalCoverage'), 'rangeOfDates')
+        begin_year = self.rng.randint(1950, 2015)
+        _sub(_sub(range_el, 'beginDate'), 'calendarDate', f'{begin_year}-01-01')
+        _sub(_sub(range_el, 'endDate'), 'calendarDate', f'{begin_year + 10}-12-31')
+        taxon_el = _sub(_sub(coverage_el, 'taxonomicCoverage'), 'taxonomicClassification')
+        _sub(taxon_el, 'taxonRankName', 'Kingdom')
+        _sub(taxon_el, 'taxonRankValue', 'Plantae')
+
+    def add_project(self, parent_el):
+        project_el = _sub(parent_el, 'project')
+        _sub(project_el, 'title', self.sentence(6, 12).rstrip('.'))
+        personnel_el = self.add_party(project_el, 'personnel')
+        _sub(personnel_el, 'role', 'Principal Investigator')
+        self.add_text_type(_sub(project_el, 'abstract'), self.rng.randint(300, 1500))
+        self.add_text_type(_sub(project_el, 'funding'), self.rng.randint(100, 600))
+        award_el = _sub(project_el, 'award')
+        _sub(award_el, 'funderName', 'National Science Foundation')
+        _sub(award_el, 'awardNumber', f'{self.rng.randint(1000000, 9999999)}')
+        _sub(award_el, 'title', self.sentence(5, 10).rstrip('.'))
+
+    def add_method_step(self, methods_el) -> int:
+        """Add a methodStep, and return its size"""
+        step_el = _sub(methods_el, 'methodStep')
+        self.add_text_type(_sub(step_el, 'description'), self.rng.randint(*METHOD_STEP_SIZE_RANGE))
+        return _get_size(step_el, METHOD_STEP_LEVEL)
+
+    def add_data_table(self, dataset_el, table_number: int) -> tuple[lxml.etree._Element, int]:
+        """Add a dataTable with an empty attributeList, and return the attributeList and the
+        size of the dataTable"""
+        table_el = _sub(dataset_el, 'dataTable')
+        entity_name = f'table_{table_number}.csv'
+        _sub(table_el, 'entityName', entity_name)
+        _sub(table_el, 'entityDescription', self.sentence(5, 15))
+        physical_el = _sub(table_el, 'physical')
+        _sub(physical_el, 'objectName', entity_name)
+        _sub(physical_el, 'size', f'{self.rng.randint(1000, 10**9)}', unit='byte')
+        text_format_el = _sub(_sub(physical_el, 'dataFormat'), 'textFormat')
+        _sub(text_format_el, 'numHeaderLines', '1')
+        _sub(text_format_el, 'attributeOrientation', 'column')
+        attribute_list_el = _sub(table_el, 'attributeList')
+        _sub(table_el, 'numberOfRecords', f'{self.rng.randint(1, 10**6)}')
+        return attribute_list_el, _get_size(table_el, DATA_TABLE_LEVEL)
+
+    def add_attribute(self, attribute_list_el, attribute_number: int) -> int:
+        """Add an attribute with a ratio, nominal or dateTime measurement scale, and return
+        its size"""
+        attribute_el = _sub(attribute_list_el, 'attribute')
+        _sub(attribute_el, 'attributeName', f'{self.word()}_{attribute_number}')
+        _sub(attribute_el, 'attributeLabel', self.sentence(2, 4).rstrip('.'))
+        _sub(attribute_el, 'attributeDefinition', self.sentence(8, 30))
+        scale = self.rng.choice(('ratio', 'nominal', 'dateTime'))
+        _sub(attribute_el, 'storageType', {'ratio': 'float'}.get(scale, 'string'))
+        scale_el = _sub(attribute_el, 'measurementScale')
+        if scale == 'ratio':
+            ratio_el = _sub(scale_el, 'ratio')
+            _sub(_sub(ratio_el, 'unit'), 'standardUnit', self.rng.choice(UNIT_TUPLE))
+            _sub(ratio_el, 'precision', '0.01')
+            _sub(_sub(ratio_el, 'numericDomain'), 'numberType', 'real')
+        elif scale == 'nominal':
+            domain_el = _sub(_sub(_sub(scale_el, 'nominal'), 'nonNumericDomain'), 'textDomain')
+            _sub(domain_el, 'definition', self.sentence(4, 10))
+        else:
+            date_time_el = _sub(scale_el, 'dateTime')
+            _sub(date_time_el, 'formatString', 'YYYY-MM-DD')
+            _sub(date_time_el, 'dateTimePrecision', '1')
+            _sub(_sub(date_time_el, 'dateTimeDomain'), 'bounds')
+        missing_el = _sub(attribute_el, 'missingValueCode')
+        _sub(missing_el, 'code', 'NA')
+        _sub(missing_el, 'codeExplanation', 'Value not recorded')
+        return _get_size(attribute_el, ATTRIBUTE_LEVEL)
+
+    def add_text_type(self, text_type_el, size: int):
+        """Fill a TextType element with about size bytes of text of a random kind"""
+        kind = self.rng.choices(self.kind_list, self.weight_list)[0]
+        if kind == 'text':
+            text_type_el.text = self.plain_text(size)
+        elif kind == 'docbook':
+            added_size = 0
+            while added_size < size:
+                added_size += self.add_docbook_section(text_type_el, size - added_size)
+        elif kind == 'markdown':
+            _sub(text_type_el, 'markdown', self.markdown(size))
+        else:
+            part_size = max(size // 4, 50)
+            text_type_el.text = self.plain_text(part_size)
+            self.add_docbook_section(text_type_el, part_size)
+            _sub(text_type_el[-1], 'literalLayout', self.literal_layout(part_size))
+            markdown_el = _sub(text_type_el, 'markdown', self.markdown(part_size))
+            markdown_el.tail = self.plain_text(part_size // 2)
+
+    def add_docbook_section(self, parent_el, size: int) -> int:
+        """Add a section with a title, paragraphs with inline markup, and lists, and return
+        its size"""
+        section_el = _sub(parent_el, 'section')
+        title_el = _sub(section_el, 'title', self.sentence(3, 8).rstrip('.'))
+        added_size = _get_size(title_el)
+        while added_size < size:
+            if self.rng.random() < 0.2:
+                block_el = _sub(section_el, self.rng.choice(('itemizedlist', 'orderedlist')))
+                for _ in range(self.rng.randint(2, 6)):
+                    _sub(_sub(block_el, 'listitem'), 'para', self.sentence(4, 16))
+            else:
+                block_el = _sub(section_el, 'para', self.sentence(8, 25) + ' ')
+                inline_tag = self.rng.choice(('emphasis', 'ulink', 'subscript', 'superscript'))
+                inline_el = _sub(block_el, inline_tag, self.word())
+                if inline_tag == 'ulink':
+                    inline_el.set('url', f'https://example.org/{self.word()}')
+                inline_el.tail = ' ' + self.paragraph(min(size, 600))
+            added_size += _get_size(block_el)
+        return added_size
+
+    def plain_text(self, size: int) -> str:
+        return self._fill(size, lambda: self.paragraph(min(size, 800)), '\n\n')
+
+    def markdown(self, size: int) -> str:
+        """Return markdown with the line breaks and indentation of markdown in EML"""
+
+        def block_str():
+            r = self.rng.random()
+            if r < 0.2:
+                return f'## {self.sentence(3, 7).rstrip(".")}'
+            if r < 0.4:
+                return '\n'.join(f'* {self.sentence(4, 12)}' for _ in range(self.rng.randint(2, 6)))
+            if r < 0.5:
+                row_list = ['| name | value | unit |', '|------|-------|------|']
+                for _ in range(self.rng.randint(2, 8)):
+                    value, unit = self.rng.uniform(0, 1000), self.rng.choice(UNIT_TUPLE)
+                    row_list.append(f'| {self.word()} | {value:.2f} | {unit} |')
+                return '\n'.join(row_list)
+            return f'{self.paragraph(min(size, 600))} **{self.word()}** `{self.word()}`.'
+
+        markdown_str = f'# {self.sentence(3, 7).rstrip(".")}\n\n'
+        markdown_str += self._fill(size - len(markdown_str), block_str, '\n\n')
+        # Markdown in EML is typically indented with the surrounding XML
+        return '\n' + '\n'.join(f'      {s}' if s else s for s in markdown_str.split('\n')) + '\n'
+
+    def literal_layout(self, size: int) -> str:
+        """Return a preformatted table with fixed column widths"""
+
+        def row_str():
+            return f'{self.word():<16}{self.rng.uniform(0, 1000):>12.3f}{self.word():>16}'
+
+        return '\n' + self._fill(size, row_str, '\n') + '\n'
+
+    def paragraph(self, size: int) -> str:
+        return self._fill(size, lambda: self.sentence(6, 24), ' ')
+
+    def sentence(self, min_words: int, max_words: int) -> str:
+        word_list = self.rng.choices(WORD_TUPLE, k=self.rng.randint(min_words, max_words))
+        return ' '.join(word_list).capitalize() + '.'
+
+    def word(self) -> str:
+        return self.rng.choice(WORD_TUPLE)
+
+    @staticmethod
+    def _fill(size: int, part_func, sep: str) -> str:
+        """Join parts from part_func until they fill at least size characters"""
+        part_list = [part_func()]
+        total_len = len(part_list[0])
+        while total_len < size:
+            part_list.append(part_func())
+            total_len += len(part_list[-1]) + len(sep)
+        return sep.join(part_list)
+
+
+def _sub(parent_el, tag: str, text: str = None, **attr_dict) -> lxml.etree._Element:
+    el = lxml.etree.SubElement(parent_el, tag, attr_dict)
+    el.text = text
+    return el
+
+
+def _get_size(el, level: int = None) -> int:
+    """Return the serialized size of an element. With level, the element is first indented
+    as it will be at that depth in the document."""
+    if level is not None:
+        lxml.etree.indent(el, level=level)
+    return len(lxml.etree.tostring(el, with_tail=False))
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""Local fake PASTA server for load testing Ridare without reaching the real PASTA
+
+Serves EML documents from a directory, at the same paths as PASTA:
+
+    /package/metadata/eml/<scope>/<id>/<rev>    The EML document
+    /package/eml                                Scopes, one per line
+    /package/eml/<scope>                        Identifiers in the scope
+    /package/eml/<scope>/<id>[?filter=newest]   Revisions of the identifier
+
+Documents are read from files named <scope>.<id>.<rev>.xml or <scope>.<id>.<rev>.eml.xml,
+as written by benchmarks.eml_generator, and as in tests/test_docs. With --default-eml,
+that document is served for any pid that is not in the directory, so that any number of
+distinct pids can be requested.
+
+Each response is delayed by --latency-ms, plus a random jitter of up to --jitter-ms. A
+share of the requests can be failed with 500 Internal Server Error (--error-rate) or 404
+Not Found (--not-found-rate), picked at random from --seed. With --max-rps, requests
+above that rate are throttled with 429 Too Many Requests, as a rate limiting proxy would.
+
+/_stats returns the number of responses by status as JSON.
+
+To point a running Ridare at the server, set PASTA_D (or PASTA_S, PASTA_P) in
+webapp/config.py to the URL that is printed when the server starts, and restart Ridare.
+
+$ python -m benchmarks.fake_pasta --eml-dir DIR [--default-eml PATH] [--port 8088]
+    [--latency-ms N] [--jitter-ms N] [--error-rate 0.01] [--not-found-rate 0.01]
+    [--max-rps N] [--seed N]
+"""
+import argparse
+import collections
+import contextlib
+import http.server
+import json
+import multiprocessing
+import pathlib
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+METADATA_RX = re.compile(r'/package/metadata/eml/([^/]+)/([^/]+)/([^/]+)')
+LIST_RX = re.compile(r'/package/eml(?:/([^/]+))?(?:/([^/]+))?/?')
+EML_SUFFIX_TUPLE = ('.eml.xml', '.xml')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    add_arguments(parser)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, **get_option_dict(args))
+    print(f'Serving {len(server.eml_path_dict)} EML documents from {args.eml_dir}')
+    print(f'PASTA URL: http://{args.host}:{server.server_address[1]}/package')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Add the server options to a parser. Shared with the load test harness."""
+    parser.add_argument('--eml-dir', type=pathlib.Path, help='Directory of EML documents')
+    parser.add_argument(
+        '--default-eml', type=pathlib.Path, help='Document to serve for pids not in --eml-dir'
+    )
+    parser.add_argument('--latency-ms', type=float, default=0, help='Delay of each response')
+    parser.add_argument(
+        '--jitter-ms', type=float, default=0, help='Random extra delay, up to this value'
+    )
+    parser.add_argument(
+        '--error-rate', type=float, default=0, help='Share of requests that return 500'
+    )
+    parser.add_argument(
+        '--not-found-rate', type=float, default=0, help='Share of requests that return 404'
+    )
+    parser.add_argument(
+        '--max-rps', type=float, default=0, help='Return 429 above this many requests per second'
+    )
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the random failures')
+
+
+def get_option_dict(args: argparse.Namespace) -> dict:
+    """Return the server options from parsed arguments, as keyword arguments for
+    make_server() and running()"""
+    return {
+        'eml_dir': args.eml_dir,
+        'default_eml_path': args.default_eml,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'error_rate': args.error_rate,
+        'not_found_rate': args.not_found_rate,
+        'max_rps': args.max_rps,
+        'seed': args.seed,
+    }
+
+
+def make_server(
+    host: str = '127.0.0.1',
+    port: int = 0,
+    eml_dir: pathlib.Path = None,
+    default_eml_path: pathlib.Path = None,
+    latency_ms: float = 0,
+    jitter_ms: float = 0,
+    error_rate: float = 0,
+    not_found_rate: float = 0,
+    max_rps: float = 0,
+    seed: int = 0,
+) -> 'FakePastaServer':
+    """Return a fake PASTA server that is ready to serve_forever(). With port 0, the
+    server listens on a free port, which is in server.server_address."""
+    return FakePastaServer(
+        (host, port),
+        eml_path_dict=get_eml_path_dict(eml_dir) if eml_dir else {},
+        default_eml_path=default_eml_path,
+        latency_sec=latency_ms / 1000,
+        jitter_sec=jitter_ms / 1000,
+        error_rate=error_rate,
+        not_found_rate=not_found_rate,
+        max_rps=max_rps,
+        seed=seed,
+    )
+
+
+@contextlib.contextmanager
+def running(**option_dict):
+    """Run a fake PASTA server in a child process, and yield its PASTA URL, e.g.,
+    http://127.0.0.1:41234/package. Takes the keyword arguments of make_server().
+
+    The server runs in its own process, so that it does not compete with the code being
+    measured for the GIL.
+    """
+    port_queue = multiprocessing.Queue()
+    server_process = multiprocessing.Process(
+        target=_serve, args=(option_dict, port_queue), daemon=True
+    )
+    server_process.start()
+    try:
+        yield f'http://127.0.0.1:{port_queue.get()}/package'
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+
+def get_eml_path_dict(eml_dir: pathlib.Path) -> dict[tuple[str, str, str], pathlib.Path]:
+    """Return (scope, id, rev) -> path for the EML documents in a directory"""
+    eml_path_dict = {}
+    for eml_path in sorted(eml_dir.iterdir()):
+        for suffix in EML_SUFFIX_TUPLE:
+            if eml_path.name.endswith(suffix):
+                pid_tuple = tuple(eml_path.name[: -len(suffix)].rsplit('.', 2))
+                if len(pid_tuple) == 3:
+                    eml_path_dict[pid_tuple] = eml_path
+                break
+    return eml_path_dict
+
+
+class FakePastaServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        eml_path_dict: dict[tuple[str, str, str], pathlib.Path],
+        default_eml_path: pathlib.Path | None,
+        latency_sec: float,
+        jitter_sec: float,
+        error_rate: float,
+        not_found_rate: float,
+        max_rps: float,
+        seed: int,
+    ):
+        super().__init__(server_address, FakePastaHandler)
+        self.eml_path_dict = eml_path_dict
+        self.default_eml_bytes = default_eml_path.read_bytes() if default_eml_path else None
+        self.latency_sec = latency_sec
+        self.jitter_sec = jitter_sec
+        self.error_rate = error_rate
+        self.not_found_rate = not_found_rate
+        self.max_rps = max_rps
+        self.status_counter = collections.Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # Token bucket for the throttling, holding up to one second of requests
+        self._token_count = max_rps
+        self._token_ts = time.monotonic()
+
+    def draw(self) -> tuple[float, float]:
+        """Return the jitter in seconds, and a number for picking failures"""
+        with self._lock:
+            return self._rng.random() * self.jitter_sec, self._rng.random()
+
+    def is_throttled(self) -> bool:
+        if not self.max_rps:
+            return False
+        with self._lock:
+            now_ts = time.monotonic()
+            self._token_count = min(
+                self.max_rps, self._token_count + (now_ts - self._token_ts) * self.max_rps
+            )
+            self._token_ts = now_ts
+            if self._token_count < 1:
+                return True
+            self._token_count -= 1
+            return False
+
+    def count(self, status: int):
+        with self._lock:
+            self.status_counter[status] += 1
+
+    def get_scope_list(self) -> list[str]:
+        return sorted({s for s, _, _ in self.eml_path_dict})
+
+    def get_id_list(self, scope: str) -> list[str]:
+        return sorted({i for s, i, _ in self.eml_path_dict if s == scope}, key=_numeric_key)
+
+    def get_rev_list(self, scope: str, identifier: str) -> list[str]:
+        return sorted(
+            (r for s, i, r in self.eml_path_dict if (s, i) == (scope, identifier)),
+            key=_numeric_key,
+        )
+
+
+class FakePastaHandler(http.server.BaseHTTPRequestHandler):
+    # Keep connections alive, as PASTA does
+    protocol_version = 'HTTP/1.1'
+    server: FakePastaServer
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/_stats':
+            self._send(200, json.dumps(dict(self.server.status_counter)), 'application/json')
+            return
+        if self.server.is_throttled():
+            self._send(429, 'Too Many Requests', headers={'Retry-After': '1'})
+            return
+        jitter_sec, failure_draw = self.server.draw()
+        time.sleep(self.server.latency_sec + jitter_sec)
+        if failure_draw < self.server.error_rate:
+            self._send(500, 'Internal Server Error')
+        elif failure_draw < self.server.error_rate + self.server.not_found_rate:
+            self._send(404, 'Not Found')
+        elif m := METADATA_RX.fullmatch(url.path):
+            self._send_eml(m.groups())
+        elif m := LIST_RX.fullmatch(url.path):
+            self._send_list(*m.groups(), is_newest=url.query == 'filter=newest')
+        else:
+            self._send(404, 'Not Found')
+
+    def log_message(self, *args):
+        pass
+
+    def _send_eml(self, pid_tuple: tuple[str, str, str]):
+        eml_path = self.server.eml_path_dict.get(pid_tuple)
+        if eml_path is not None:
+            eml_bytes = eml_path.read_bytes()
+        elif self.server.default_eml_bytes is not None:
+            eml_bytes = self.server.default_eml_bytes
+        else:
+            self._send(404, f'Not Found: {".".join(pid_tuple)}')
+            return
+        self._send(200, eml_bytes, 'application/xml')
+
+    def _send_list(self, scope: str | None, identifier: str | None, is_newest: bool):
+        if scope is None:
+            line_list = self.server.get_scope_list()
+        elif identifier is None:
+            line_list = self.server.get_id_list(scope)
+        else:
+            line_list = self.server.get_rev_list(scope, identifier)
+            if is_newest:
+                line_list = line_list[-1:]
+        if not line_list:
+            self._send(404, 'Not Found')
+            return
+        self._send(200, '\n'.join(line_list) + '\n')
+
+    def _send(self, status: int, body: str | bytes, content_type='text/plain', headers=None):
+        body_bytes = body.encode('utf-8') if isinstance(body, str) else body
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body_bytes)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body_bytes)
+
+
+def _serve(option_dict: dict, port_queue: multiprocessing.Queue):
+    server = make_server(**option_dict)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _numeric_key(s: str):
+    return (0, int(s), '') if s.isdigit() else (1, 0, s)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
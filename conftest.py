@@ -7,7 +7,9 @@ import logging
 import os
 import pathlib
 import sys
+import tempfile
 import types
+from unittest.mock import patch
 
 import tests.util.sample
 
@@ -21,6 +23,7 @@ import pytest
 
 import lxml.etree
 
+import webapp.eml_store
 import webapp.run
 
 logging.getLogger('matplotlib').setLevel(logging.ERROR)
@@ -94,6 +97,30 @@ def app():
     return webapp.run.app
 
 
+# PASTA
+
+
+@pytest.fixture
+def upstream():
+    """Point the development environment at an empty cache directory, and serve
+    complete_eml.xml for all pids. Yields the list of URLs that would have been requested
+    from PASTA."""
+    eml_bytes = (TEST_DOCS / 'complete_eml.xml').read_bytes()
+    url_list = []
+
+    def fake_requests_wrapper(url):
+        url_list.append(url)
+        return eml_bytes
+
+    webapp.eml_store.clear()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with patch("webapp.config.Config.CACHE_D", tmpdir), patch(
+            "webapp.config.Config.PASTA_D", "https://fake-pasta-url.org"
+        ), patch("webapp.utils.requests_wrapper", fake_requests_wrapper):
+            yield url_list
+    webapp.eml_store.clear()
+
+
 # Test files
 
 
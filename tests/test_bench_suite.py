@@ -0,0 +1,62 @@
+"""Test the benchmark suite in benchmarks/bench_suite.py
+"""
+from unittest.mock import patch
+
+import benchmarks.bench_suite as bench_suite
+import webapp.config
+
+
+def test_run():
+    cache_d = webapp.config.Config.CACHE_D
+    results_dict = bench_suite.run(1, 1, ['pretty_print/complete_eml', 'multi'])
+    assert sorted(results_dict['cases']) == [
+        'build_multi_results/20_pids/4_queries',
+        'multi_view/20_pids/4_queries',
+        'pretty_print/complete_eml/eml',
+    ]
+    for case in results_dict['cases'].values():
+        assert case['median_ms'] > 0
+        assert case['calls'] == 1
+    # The configuration is restored
+    assert webapp.config.Config.CACHE_D == cache_d
+
+
+def test_all_cases_run():
+    results_dict = bench_suite.run(1, 1)
+    for name, case in results_dict['cases'].items():
+        # Only the cases that need docbook-xsl can be skipped
+        assert 'median_ms' in case or name in bench_suite.OPTIONAL_CASE_TUPLE, case
+
+
+def test_compare():
+    baseline_dict = {'cases': {'a': {'median_ms': 1.0}, 'b': {'median_ms': 1.0}}}
+    results_dict = {
+        'cases': {
+            'a': {'median_ms': 1.4},
+            'b': {'median_ms': 2.0},
+            'c': {'median_ms': 9.0},
+        }
+    }
+    assert bench_suite.compare(results_dict, baseline_dict, 1.5) == [('b', 2.0)]
+    results_dict['cases']['b'] = {'skipped': 'Stylesheet not found'}
+    assert bench_suite.compare(results_dict, baseline_dict, 1.5) == [('b', None)]
+    del results_dict['cases']['b']
+    assert bench_suite.compare(results_dict, baseline_dict, 1.5) == [('b', None)]
+    # Cases left out with --case are not missing
+    assert bench_suite.compare(results_dict, baseline_dict, 1.5, ['a']) == []
+
+
+def test_compare_optional_case():
+    name = bench_suite.OPTIONAL_CASE_TUPLE[0]
+    baseline_dict = {'cases': {name: {'median_ms': 1.0}}}
+    results_dict = {'cases': {name: {'skipped': 'Stylesheet not found'}}}
+    assert bench_suite.compare(results_dict, baseline_dict, 1.5) == []
+
+
+def test_broken_case_fails_baseline_check():
+    baseline_dict = bench_suite.run(1, 1, ['build_multi_results'])
+    with patch('webapp.multi_helpers.build_multi_results', side_effect=RuntimeError('Broken')):
+        results_dict = bench_suite.run(1, 1, ['build_multi_results'])
+    assert bench_suite.compare(results_dict, baseline_dict, 1.5) == [
+        ('build_multi_results/20_pids/4_queries', None)
+    ]
@@ -0,0 +1,105 @@
+"""Test the cache_file.py module
+"""
+import multiprocessing
+import pathlib
+import threading
+import time
+
+import webapp.cache_file as cache_file
+import webapp.cache_key as cache_key
+import webapp.config
+import webapp.eml_store as eml_store
+import webapp.markdown_cache as markdown_cache
+import webapp.utils
+
+WRITER_COUNT = 4
+READER_COUNT = 4
+STRESS_SEC = 1.0
+KEY_COUNT = 3
+
+
+def _get_payload(writer_idx: int, write_idx: int) -> bytes:
+    """Return valid HTML of varying size, so that a partial write would be seen as a
+    different payload"""
+    size = 1 + (writer_idx * 7919 + write_idx * 104729) % 200_000
+    return f'<div>{writer_idx}-{write_idx}-{"x" * size}</div>'.encode('utf-8')
+
+
+def _write_until(dir_path: pathlib.Path, writer_idx: int, stop_ts: float):
+    write_idx = 0
+    while time.time() < stop_ts:
+        path = dir_path / f'{write_idx % KEY_COUNT}.html'
+        cache_file.write(path, _get_payload(writer_idx, write_idx))
+        write_idx += 1
+
+
+def test_parallel_writers_and_readers(tmpdir):
+    stop_ts = time.time() + STRESS_SEC
+    ctx = multiprocessing.get_context('fork')
+    writer_list = [
+        ctx.Process(target=_write_until, args=(tmpdir, i, stop_ts)) for i in range(WRITER_COUNT)
+    ]
+    read_count_list = []
+    error_list = []
+
+    def read_until():
+        read_count = 0
+        while time.time() < stop_ts:
+            for key_idx in range(KEY_COUNT):
+                data = cache_file.read(tmpdir / f'{key_idx}.html', cache_file.is_valid_html)
+                if data is None:
+                    continue
+                writer_idx, write_idx = map(int, data[5:].split(b'-', 2)[:2])
+                if data != _get_payload(writer_idx, write_idx):
+                    error_list.append(data[:50])
+                read_count += 1
+        read_count_list.append(read_count)
+
+    reader_list = [threading.Thread(target=read_until) for _ in range(READER_COUNT)]
+    for worker in writer_list + reader_list:
+        worker.start()
+    for worker in writer_list + reader_list:
+        worker.join()
+
+    assert [p.exitcode for p in writer_list] == [0] * WRITER_COUNT
+    assert not error_list
+    assert sum(read_count_list) > 0
+    # No temporary files are left behind
+    assert sorted(p.name for p in tmpdir.iterdir()) == [f'{i}.html' for i in range(KEY_COUNT)]
+
+
+def test_invalid_files_are_discarded(tmpdir):
+    path = tmpdir / 'a.html'
+    path.write_bytes(b'<div><p>Truncat')
+    assert cache_file.read(path, cache_file.is_valid_html) is None
+    assert not path.exists()
+    assert cache_file.read(path, cache_file.is_valid_html) is None
+
+
+def test_html_checks():
+    html_bytes = b'<div>\n  <div><p>A</p></div>\n</div>\n'
+    assert cache_file.is_valid_html(html_bytes)
+    assert cache_file.is_well_formed_html(html_bytes)
+    for data in (b'', b'\n', b'<div><p>Truncat', b'<div><p>A</p></div>\x00\x00'):
+        assert not cache_file.is_valid_html(data)
+    # Only the full check parses the fragment
+    assert cache_file.is_valid_html(b'<div><p>A</div>')
+    assert not cache_file.is_well_formed_html(b'<div><p>A</div>')
+
+
+def test_truncated_html_is_rendered_again(upstream):
+    html_str = markdown_cache.get_html('edi.1.1', '//funding', 'dev')
+    html_path = cache_key.get_html_path('edi.1.1', '//funding', webapp.config.Config.CACHE_D)
+    html_path.write_text(html_str[: len(html_str) // 2])
+    assert markdown_cache.get_html('edi.1.1', '//funding', 'dev') == html_str
+    assert html_path.read_text() == html_str
+
+
+def test_damaged_eml_is_downloaded_again(upstream):
+    eml_path = pathlib.Path(webapp.utils.get_cache_path('edi.1.1', webapp.config.Config.CACHE_D))
+    eml_path.parent.mkdir(parents=True)
+    eml_path.write_bytes(b'<eml><dataset><title>Cut off</title>')
+    root_el = eml_store.get_eml_tree('edi.1.1', 'dev')
+    assert root_el.xpath('//funding')
+    assert len(upstream) == 1
+    assert eml_path.read_bytes().rstrip().endswith(b'</eml:eml>')
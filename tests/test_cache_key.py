@@ -0,0 +1,99 @@
+"""Test the cache_key.py module
+"""
+import pathlib
+from unittest.mock import patch
+
+import pytest
+
+import webapp.cache_key as cache_key
+import webapp.config
+import webapp.eml_store as eml_store
+import webapp.markdown_cache as markdown_cache
+import webapp.run
+
+FUNDING_XPATH = 'additionalMetadata[1]/metadata/*/funding'
+
+
+@pytest.mark.parametrize(
+    'text_xpath',
+    [
+        ' additionalMetadata[1]/metadata/*/funding ',
+        './additionalMetadata[ 1 ] / child::metadata/*/funding',
+        '/*/additionalMetadata[1]/metadata/self::node()/*/./funding',
+        'additionalMetadata[1]/metadata/*/funding/.',
+    ],
+)
+def test_equivalent_xpaths_are_normalized(text_xpath):
+    assert cache_key.normalize_xpath(text_xpath) == FUNDING_XPATH
+
+
+def test_distinct_xpaths_have_distinct_keys():
+    # Including XPaths that had the same legacy file name, and XPaths that select
+    # different nodes in some documents
+    text_xpath_list = [
+        '//dataset/abstract',
+        '__dataset_abstract',
+        'dataset/abstract',
+        './/dataset/abstract',
+        'dataset/abstract[1]',
+        '//dataset//abstract',
+        '//dataset/@abstract',
+        'dataset/abstract | dataset/title',
+        'dataset[title="a/b"]/abstract',
+    ]
+    key_set = {cache_key.get_xpath_key(text_xpath) for text_xpath in text_xpath_list}
+    assert len(key_set) == len(text_xpath_list)
+
+
+def test_other_xpaths_are_kept_as_written():
+    for text_xpath in ('count(//funding)', 'a[b/c]', '//a/', 'a/@x/text()', '/'):
+        assert cache_key.normalize_xpath(f' {text_xpath}\n') == text_xpath
+
+
+def test_equivalent_requests_share_an_entry(upstream):
+    html_str = markdown_cache.get_html('edi.1.1', FUNDING_XPATH, 'dev')
+    assert html_str == markdown_cache.get_html('edi.1.1', '//funding', 'dev')
+    with patch('webapp.render_cache.text_to_html') as text_to_html_mock:
+        assert markdown_cache.get_html(' edi.1.1 ', f'./{FUNDING_XPATH}', 'dev') == html_str
+    assert not text_to_html_mock.called
+    assert len(upstream) == 1
+    # 2 HTML, one for each distinct XPath
+    assert len(list(pathlib.Path(webapp.config.Config.CACHE_D).glob('*/*/*.html'))) == 2
+
+
+def _write_legacy_entries(cache: str) -> str:
+    """Write EML and HTML entries under the legacy names. Returns the HTML."""
+    eml_path = cache_key.get_legacy_eml_path('edi.1.1', cache)
+    eml_path.parent.mkdir(parents=True)
+    eml_path.write_bytes(pathlib.Path('tests/test_docs/complete_eml.xml').read_bytes())
+    html_str = '<div><p>Legacy</p></div>\n'
+    cache_key.get_legacy_html_path('edi.1.1', '//funding', cache).write_text(html_str)
+    return html_str
+
+
+def test_legacy_entries_are_copied_to_new_names(upstream):
+    cache = webapp.config.Config.CACHE_D
+    html_str = _write_legacy_entries(cache)
+    assert markdown_cache.get_html('edi.1.1', '//funding', 'dev') == html_str
+    assert eml_store.get_eml_tree('edi.1.1', 'dev').xpath('//funding')
+    assert not upstream
+    assert cache_key.get_html_path('edi.1.1', '//funding', cache).read_text() == html_str
+    assert cache_key.get_eml_path('edi.1.1', cache).is_file()
+    assert cache_key.get_legacy_eml_path('edi.1.1', cache).is_file()
+
+
+def test_legacy_entries_are_ignored_when_disabled(upstream):
+    cache = webapp.config.Config.CACHE_D
+    html_str = _write_legacy_entries(cache)
+    with patch('webapp.config.Config.CACHE_READ_LEGACY_KEYS', False):
+        assert markdown_cache.get_html('edi.1.1', '//funding', 'dev') != html_str
+    assert len(upstream) == 1
+
+
+def test_cache_path_command():
+    result = webapp.run.app.test_cli_runner().invoke(
+        args=['cache-path', '--env', 'd', 'edi.1.1', '//funding']
+    )
+    assert result.exit_code == 0
+    html_path = cache_key.get_html_path('edi.1.1', '//funding', webapp.config.Config.CACHE_D)
+    assert result.output == f'development: {html_path}\n'
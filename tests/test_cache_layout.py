@@ -0,0 +1,107 @@
+"""Test the cache_layout.py module
+"""
+import pathlib
+from unittest.mock import patch
+
+import webapp.cache_key as cache_key
+import webapp.cache_layout as cache_layout
+import webapp.config
+import webapp.eml_store as eml_store
+import webapp.markdown_cache as markdown_cache
+import webapp.render_cache as render_cache
+import webapp.run
+import webapp.utils
+
+PID_LIST = ['edi.1.1', 'edi.1.2', 'knb-lter-cap.704.1']
+
+
+def test_path_is_sharded():
+    path = cache_layout.get_path('/cache', 'knb_lter_cap_704_1', 'a-knb_lter_cap_704_1.html')
+    assert len(path.parts) == 5
+    assert [len(part) for part in path.parts[2:4]] == [2, 2]
+    assert path.parts[-1] == 'a-knb_lter_cap_704_1.html'
+    assert cache_layout.get_legacy_path(path) == pathlib.Path('/cache/a-knb_lter_cap_704_1.html')
+
+
+def test_entries_for_a_package_share_a_shard():
+    cache = webapp.config.Config.CACHE_D
+    eml_path = pathlib.Path(webapp.utils.get_cache_path('knb-lter-cap.704.1', cache))
+    html_path = cache_key.get_html_path('knb-lter-cap.704.1', '//dataset/abstract', cache)
+    assert eml_path.parent == html_path.parent
+
+
+def _move_to_legacy_layout(cache: str) -> int:
+    """Move all cache entries into the legacy flat layout. Returns the number moved."""
+    count = 0
+    for path in list(pathlib.Path(cache).rglob('*')):
+        if path.suffix in ('.html', '.xml') and 'lock' not in path.parts:
+            path.rename(cache_layout.get_legacy_path(path))
+            count += 1
+    return count
+
+
+def test_legacy_entries_are_read_and_migrated(upstream):
+    cache = webapp.config.Config.CACHE_D
+    html_list = [markdown_cache.get_html(pid, '//funding', 'dev') for pid in PID_LIST]
+    # 3 EML, 3 HTML and 1 content addressed render
+    assert _move_to_legacy_layout(cache) == 7
+    assert len(list(pathlib.Path(cache).glob('*.eml.xml'))) == 3
+    eml_store.clear()
+
+    # Readers find the legacy entries. The HTML for the first pid is rebuilt from the
+    # legacy content addressed render.
+    html_path = cache_key.get_html_path(PID_LIST[0], '//funding', cache)
+    cache_layout.get_legacy_path(html_path).unlink()
+    with patch('webapp.eml_text_type.text_to_html') as text_to_html_mock:
+        assert [markdown_cache.get_html(pid, '//funding', 'dev') for pid in PID_LIST] == html_list
+    assert not text_to_html_mock.called
+    for pid in PID_LIST:
+        assert eml_store.get_eml_tree(pid, 'dev').xpath('//funding')
+    assert len(upstream) == 3
+
+    # Batches of 2 from the 5 legacy per pid entries in the cache directory
+    assert list(cache_layout.migrate(pathlib.Path(cache), 2)) == [2, 2, 1]
+    assert list(cache_layout.migrate(pathlib.Path(cache, 'render'), 2)) == [1]
+    assert not list(cache_layout.iter_legacy_paths(pathlib.Path(cache)))
+    for pid in PID_LIST:
+        assert pathlib.Path(webapp.utils.get_cache_path(pid, cache)).is_file()
+        assert cache_key.get_html_path(pid, '//funding', cache).is_file()
+    assert render_cache.get_report(cache)['render_count'] == 1
+
+
+def test_migrate_keeps_sharded_entry(tmpdir):
+    sharded_path = cache_layout.get_path(tmpdir, 'edi_1_1', 'edi_1_1.eml.xml')
+    sharded_path.parent.mkdir(parents=True)
+    sharded_path.write_bytes(b'<new/>')
+    legacy_path = tmpdir / 'edi_1_1.eml.xml'
+    legacy_path.write_bytes(b'<old/>')
+    legacy_tmp_path = tmpdir / '.edi_1_1.eml.xml.abc.tmp'
+    legacy_tmp_path.write_bytes(b'<partial')
+    assert list(cache_layout.migrate(tmpdir, 10)) == [0]
+    assert not legacy_path.exists()
+    assert legacy_tmp_path.exists()
+    assert sharded_path.read_bytes() == b'<new/>'
+
+
+def test_migrate_removes_malformed_html(tmpdir):
+    valid_path = tmpdir / 'a-edi_1_1.html'
+    valid_path.write_bytes(b'<div><div>Funding</div></div>')
+    malformed_path = tmpdir / 'b-edi_1_1.html'
+    malformed_path.write_bytes(b'<div><div>A & B</div></div>')
+    assert list(cache_layout.migrate(tmpdir, 10)) == [1]
+    assert not valid_path.exists() and not malformed_path.exists()
+    assert cache_layout.get_path(tmpdir, 'edi_1_1', 'a-edi_1_1.html').exists()
+    assert not cache_layout.get_path(tmpdir, 'edi_1_1', 'b-edi_1_1.html').exists()
+
+
+def test_cache_migrate_command(upstream):
+    cache = webapp.config.Config.CACHE_D
+    for pid in PID_LIST:
+        markdown_cache.get_html(pid, '//funding', 'dev')
+    _move_to_legacy_layout(cache)
+    result = webapp.run.app.test_cli_runner().invoke(
+        args=['cache-migrate', '--env', 'd', '--batch-size', '4', '--pause', '0']
+    )
+    assert result.exit_code == 0
+    assert f'development: {cache}: 6 entries moved' in result.output
+    assert not list(cache_layout.iter_legacy_paths(pathlib.Path(cache)))
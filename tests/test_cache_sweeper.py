@@ -0,0 +1,133 @@
+"""Test the cache_sweeper.py module
+"""
+import multiprocessing
+import os
+import pathlib
+import time
+from unittest.mock import patch
+
+import pytest
+
+import webapp.cache_file as cache_file
+import webapp.cache_layout as cache_layout
+import webapp.cache_sweeper as cache_sweeper
+import webapp.config
+import webapp.run
+import webapp.single_flight as single_flight
+
+DAY_SEC = 24 * 60 * 60
+ENTRY_SIZE = 1000
+
+
+@pytest.fixture(name="cache_path")
+def fixture_cache_path(tmpdir):
+    """Point the development environment at a cache directory holding 10 entries of 1000
+    bytes each, last used 1 to 10 days ago"""
+    now = time.time()
+    for i in range(1, 11):
+        _add_entry(tmpdir, f'edi_{i}_1', now - i * DAY_SEC)
+    with patch('webapp.config.Config.CACHE_D', str(tmpdir)):
+        yield tmpdir
+
+
+def _add_entry(cache_path: pathlib.Path, key: str, use_ts: float) -> pathlib.Path:
+    path = cache_layout.get_path(cache_path, key, f'{key}.eml.xml')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'<eml/>'.ljust(ENTRY_SIZE))
+    os.utime(path, (use_ts, use_ts))
+    return path
+
+
+def _get_keys(cache_path: pathlib.Path) -> list[int]:
+    """Return the numbers of the entries that are left"""
+    return sorted(int(p.name.split('_')[1]) for p in cache_path.rglob('*.eml.xml'))
+
+
+def test_least_recently_used_entries_are_evicted(cache_path):
+    with patch('webapp.config.Config.CACHE_MAX_BYTES_D', 5 * ENTRY_SIZE):
+        result = cache_sweeper.sweep('dev')
+    # Evicted down to 90% of the budget
+    assert result == cache_sweeper.SweepResult(10, 10 * ENTRY_SIZE, 6, 6 * ENTRY_SIZE, 0)
+    assert _get_keys(cache_path) == [1, 2, 3, 4]
+
+
+def test_old_entries_are_evicted(cache_path):
+    with patch('webapp.config.Config.CACHE_MAX_AGE_DAYS_D', 3.5):
+        result = cache_sweeper.sweep('dev')
+    assert result.removed_count == 7
+    assert _get_keys(cache_path) == [1, 2, 3]
+
+
+def test_no_limits_and_dry_run_remove_nothing(cache_path):
+    assert cache_sweeper.sweep('dev').removed_count == 0
+    with patch('webapp.config.Config.CACHE_MAX_BYTES_D', 0):
+        assert cache_sweeper.sweep('dev', dry_run=True).removed_count == 10
+    assert len(_get_keys(cache_path)) == 10
+
+
+def test_recent_entries_and_temp_files_are_kept(cache_path):
+    now = time.time()
+    _add_entry(cache_path, 'edi_11_1', now)
+    fresh_temp_path = cache_path / '.edi_12_1.eml.xml.abc.tmp'
+    fresh_temp_path.write_bytes(b'<eml')
+    stale_temp_path = cache_path / '.edi_13_1.eml.xml.abc.tmp'
+    stale_temp_path.write_bytes(b'<eml')
+    os.utime(stale_temp_path, (now - DAY_SEC, now - DAY_SEC))
+    with patch('webapp.config.Config.CACHE_MAX_BYTES_D', 0):
+        result = cache_sweeper.sweep('dev')
+    assert result.removed_count == 10
+    assert result.temp_count == 1
+    assert _get_keys(cache_path) == [11]
+    assert fresh_temp_path.exists()
+    assert not stale_temp_path.exists()
+
+
+def test_reads_refresh_last_use(cache_path):
+    (path,) = cache_path.rglob('edi_10_1.eml.xml')
+    assert cache_file.read(path, cache_file.is_valid_eml)
+    with patch('webapp.config.Config.CACHE_MAX_BYTES_D', 5 * ENTRY_SIZE):
+        cache_sweeper.sweep('dev')
+    assert _get_keys(cache_path) == [1, 2, 3, 10]
+
+
+def test_concurrent_sweep_is_skipped(cache_path):
+    lock_path = cache_path / 'lock' / cache_sweeper.SWEEP_LOCK_NAME
+    lock_path.parent.mkdir()
+    with single_flight.file_lock(lock_path, 0) as is_locked:
+        assert is_locked
+        with patch('webapp.config.Config.CACHE_MAX_BYTES_D', 0):
+            assert cache_sweeper.sweep('dev') is None
+    assert len(_get_keys(cache_path)) == 10
+
+
+def _sweep_in_child(cache_path, result_queue):
+    with patch('webapp.config.Config.CACHE_D', str(cache_path)), patch(
+        'webapp.config.Config.CACHE_MAX_BYTES_D', 0
+    ):
+        result_queue.put(cache_sweeper.sweep('dev'))
+
+
+def test_overlapping_sweeps_in_processes(cache_path):
+    """A sweep that starts after another one has released the lock must not share it with a
+    sweep that is still running"""
+    lock_path = cache_path / 'lock' / cache_sweeper.SWEEP_LOCK_NAME
+    cache_sweeper.sweep('dev', dry_run=True)
+    inode = lock_path.stat().st_ino
+    ctx = multiprocessing.get_context('fork')
+    result_queue = ctx.Queue()
+    with single_flight.file_lock(lock_path, 0) as is_locked:
+        assert is_locked
+        process = ctx.Process(target=_sweep_in_child, args=(cache_path, result_queue))
+        process.start()
+        process.join()
+        assert result_queue.get() is None
+    assert lock_path.stat().st_ino == inode
+    assert len(_get_keys(cache_path)) == 10
+
+
+def test_cache_sweep_command(cache_path):
+    with patch('webapp.config.Config.CACHE_MAX_AGE_DAYS_D', 5.5):
+        result = webapp.run.app.test_cli_runner().invoke(args=['cache-sweep', '--env', 'd'])
+    assert result.exit_code == 0
+    assert 'development: 10 entries, 10,000 bytes. Removed 5 entries' in result.output
+    assert _get_keys(cache_path) == [1, 2, 3, 4, 5]
@@ -0,0 +1,116 @@
+"""Test the compression.py module
+"""
+import gzip
+import pathlib
+from unittest.mock import patch
+
+import lxml.etree
+import pytest
+
+import webapp.cache_key as cache_key
+import webapp.compression as compression
+import webapp.config
+import webapp.eml_store as eml_store
+import webapp.markdown_cache as markdown_cache
+
+HTML_URL = '/edi.1.1///funding?env=d'
+GZIP_HEADERS = {'Accept-Encoding': 'gzip, deflate'}
+
+
+@pytest.fixture(name="gzip_cache")
+def fixture_gzip_cache(upstream):
+    with patch('webapp.config.Config.CACHE_COMPRESSION', 'gzip'):
+        yield upstream
+
+
+def _get_cache_names() -> list[str]:
+    cache_path = pathlib.Path(webapp.config.Config.CACHE_D)
+    return sorted(p.name.split('.', 1)[-1] for p in cache_path.glob('*/*/*') if p.is_file())
+
+
+def test_cache_files_are_stored_compressed(gzip_cache):
+    html_str = markdown_cache.get_html('edi.1.1', '//funding', 'dev')
+    assert _get_cache_names() == ['eml.xml.gz', 'html.gz']
+    eml_path = cache_key.get_eml_path('edi.1.1', webapp.config.Config.CACHE_D)
+    eml_bytes = gzip.decompress(compression.get_gzip_path(eml_path).read_bytes())
+    assert eml_bytes == pathlib.Path('tests/test_docs/complete_eml.xml').read_bytes()
+    eml_store.clear()
+    with patch('webapp.render_cache.text_to_html') as text_to_html_mock:
+        assert markdown_cache.get_html('edi.1.1', '//funding', 'dev') == html_str
+    assert eml_store.get_eml_tree('edi.1.1', 'dev').xpath('//funding')
+    assert not text_to_html_mock.called
+    assert len(gzip_cache) == 1
+
+
+def test_files_are_read_in_either_form(upstream):
+    html_str = markdown_cache.get_html('edi.1.1', '//funding', 'dev')
+    with patch('webapp.config.Config.CACHE_COMPRESSION', 'gzip'):
+        eml_store.clear()
+        assert markdown_cache.get_html('edi.1.1', '//funding', 'dev') == html_str
+        assert eml_store.get_eml('edi.1.1', 'dev')
+        markdown_cache.get_html('edi.1.2', '//funding', 'dev')
+    eml_store.clear()
+    assert markdown_cache.get_html('edi.1.2', '//funding', 'dev') == html_str
+    assert eml_store.get_eml('edi.1.2', 'dev')
+    assert len(upstream) == 2
+    assert _get_cache_names() == ['eml.xml', 'eml.xml.gz', 'html', 'html.gz']
+
+
+def test_damaged_compressed_eml_is_downloaded_again(gzip_cache):
+    eml_bytes = eml_store.get_eml('edi.1.1', 'dev')
+    eml_path = cache_key.get_eml_path('edi.1.1', webapp.config.Config.CACHE_D)
+    gzip_path = compression.get_gzip_path(eml_path)
+    gzip_path.write_bytes(gzip_path.read_bytes()[:100])
+    eml_store.clear()
+    assert eml_store.get_eml('edi.1.1', 'dev') == eml_bytes
+    assert len(gzip_cache) == 2
+
+
+def test_compressed_html_is_sent_as_stored(client, gzip_cache):
+    html_path = cache_key.get_html_path('edi.1.1', '//funding', webapp.config.Config.CACHE_D)
+    client.get(HTML_URL)
+    with patch('webapp.compression.compress') as compress_mock:
+        response = client.get(HTML_URL, headers=GZIP_HEADERS)
+    assert not compress_mock.called
+    assert response.data == compression.get_gzip_path(html_path).read_bytes()
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    # Clients that do not accept gzip get the content uncompressed
+    identity_response = client.get(HTML_URL)
+    assert 'Content-Encoding' not in identity_response.headers
+    assert identity_response.data == gzip.decompress(response.data)
+    assert response.headers['ETag'] == identity_response.headers['ETag'][:-1] + '-gzip"'
+
+
+def test_responses_are_compressed_on_the_fly(client, upstream):
+    with patch('webapp.config.Config.RESPONSE_COMPRESS_MIN_BYTES', 100_000):
+        response = client.get(HTML_URL, headers=GZIP_HEADERS)
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    with patch('webapp.config.Config.RESPONSE_COMPRESS_MIN_BYTES', 0):
+        gzip_response = client.get(HTML_URL, headers=GZIP_HEADERS)
+        raw_response = client.get(f'/raw{HTML_URL}', headers=GZIP_HEADERS)
+    assert gzip.decompress(gzip_response.data) == response.data
+    assert gzip_response.headers['ETag'].endswith('-gzip"')
+    assert raw_response.headers['Content-Encoding'] == 'gzip'
+    assert lxml.etree.fromstring(gzip.decompress(raw_response.data)).tag == 'funding'
+
+
+def test_not_modified_for_compressed_etag(client, gzip_cache):
+    etag = client.get(HTML_URL, headers=GZIP_HEADERS).headers['ETag']
+    response = client.get(HTML_URL, headers={'If-None-Match': etag, **GZIP_HEADERS})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+@pytest.mark.parametrize('stream_min_pids', [1, 100])
+def test_multi_is_compressed(client, upstream, stream_min_pids):
+    payload = {'pid': ['edi.1.1', 'edi.1.2'], 'query': ['//funding']}
+    with patch('webapp.config.Config.MULTI_STREAM_MIN_PIDS', stream_min_pids), patch(
+        'webapp.config.Config.RESPONSE_COMPRESS_MIN_BYTES', 0
+    ):
+        response = client.post('/multi?env=development', json=payload, headers=GZIP_HEADERS)
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    root_el = lxml.etree.fromstring(gzip.decompress(response.data))
+    assert len(root_el.findall('document')) == 2
@@ -0,0 +1,98 @@
+"""Test the docbook_subset.py module
+"""
+import copy
+import pathlib
+
+import lxml.etree
+import pytest
+
+import webapp.docbook_subset as docbook_subset
+import webapp.eml_text_type as eml_text_type
+
+TEST_DOCS = pathlib.Path(__file__).parent.resolve() / 'test_docs'
+
+DOCBOOK_ROOT_TAG_LIST = ['section', 'para', 'itemizedlist', 'orderedlist', 'literalLayout']
+
+
+def _to_html_str(html_el):
+    return lxml.etree.tostring(eml_text_type.clean_html(html_el), with_tail=False)
+
+
+def _iter_corpus_docbook():
+    for xml_path in sorted(TEST_DOCS.glob('*.xml')):
+        root_el = lxml.etree.parse(xml_path.as_posix()).getroot()
+        for el in root_el.iter(*DOCBOOK_ROOT_TAG_LIST):
+            yield xml_path.name, el
+
+
+@pytest.mark.skipif(
+    not eml_text_type.XSL_PATH.is_file(), reason='docbook-xsl-1.79.2 is not installed'
+)
+def test_subset_matches_docbook_xsl():
+    """The subset renderer must generate the same HTML as docbook.xsl for all DocBook in
+    the test documents"""
+    rendered_count = 0
+    for file_name, docbook_el in _iter_corpus_docbook():
+        native_el = docbook_subset.docbook_to_html(docbook_el)
+        if native_el is None:
+            continue
+        xslt_el = eml_text_type._docbook_to_html(docbook_el, force_xslt=True)
+        assert _to_html_str(native_el) == _to_html_str(copy.deepcopy(xslt_el)), (
+            f'{file_name}: {docbook_el.getroottree().getpath(docbook_el)}'
+        )
+        rendered_count += 1
+    assert rendered_count
+
+
+def test_subset_leaves_source_unchanged():
+    for file_name, docbook_el in _iter_corpus_docbook():
+        before_str = lxml.etree.tostring(docbook_el)
+        docbook_subset.docbook_to_html(docbook_el)
+        assert lxml.etree.tostring(docbook_el) == before_str
+
+
+@pytest.mark.parametrize(
+    'docbook_str',
+    [
+        '<section><title>T</title><para>Text<citetitle>C</citetitle></para></section>',
+        '<para role="bold">Text</para>',
+        '<para>Text<!-- comment --></para>',
+        '<itemizedlist><para>Text</para><listitem>Item</listitem></itemizedlist>',
+        '<ulink>No URL</ulink>',
+        '<title>Text</title>',
+    ],
+)
+def test_unsupported_docbook(docbook_str):
+    assert docbook_subset.docbook_to_html(lxml.etree.fromstring(docbook_str)) is None
+
+
+def test_section_headings():
+    docbook_el = lxml.etree.fromstring(
+        '<section><title>A</title><section><title>B<emphasis>C</emphasis></title>'
+        '<section/></section></section>'
+    )
+    assert _to_html_str(docbook_subset.docbook_to_html(docbook_el)) == (
+        b'<div><div><div><div><h2><a/>A</h2></div></div><hr/></div>'
+        b'<div><div><div><div><h3><a/>B<span><em>C</em></span></h3></div></div></div>'
+        b'<div><div/></div></div></div>'
+    )
+
+
+def test_para_is_unwrapped_around_blocks():
+    docbook_el = lxml.etree.fromstring(
+        '<section><para>A<itemizedlist>x<listitem>B</listitem></itemizedlist> '
+        '<orderedlist><listitem>C</listitem></orderedlist></para></section>'
+    )
+    assert _to_html_str(docbook_subset.docbook_to_html(docbook_el)) == (
+        b'<div><div><hr/></div><p>A</p><div><ul><li>B</li></ul></div><p> </p>'
+        b'<div><ol><li>C</li></ol></div></div>'
+    )
+
+
+def test_literal_layout():
+    docbook_el = lxml.etree.fromstring(
+        '<literalLayout>a b\n  <emphasis>c\nd</emphasis>\n</literalLayout>'
+    )
+    assert _to_html_str(docbook_subset.docbook_to_html(docbook_el)) == (
+        b'<div><p>a&#160;b<br/>\n&#160;&#160;<span><em>c<br/>\nd</em></span><br/>\n</p></div>'
+    )
@@ -0,0 +1,55 @@
+"""Test the synthetic EML generator in benchmarks/eml_generator.py
+"""
+import lxml.etree
+import pytest
+
+import benchmarks.eml_generator as eml_generator
+import webapp.eml_text_type
+
+TEXT_TYPE_XPATH = '//dataset/abstract | //methodStep/description | //project/funding'
+
+
+def test_is_deterministic():
+    eml_bytes = eml_generator.generate_eml('bench.1.1', seed=1, size=50_000)
+    assert eml_generator.generate_eml('bench.1.1', seed=1, size=50_000) == eml_bytes
+    assert eml_generator.generate_eml('bench.1.1', seed=2, size=50_000) != eml_bytes
+
+
+@pytest.mark.parametrize('size', [10_000, 200_000, 2_000_000])
+def test_size(size):
+    eml_bytes = eml_generator.generate_eml(size=size)
+    root_el = lxml.etree.fromstring(eml_bytes)
+    assert abs(len(eml_bytes) - size) < size * 0.15
+    assert root_el.tag == f'{{{eml_generator.EML_NS}}}eml'
+    assert root_el.get('packageId') == 'bench.1.1'
+
+
+def test_counts():
+    root_el = lxml.etree.fromstring(
+        eml_generator.generate_eml(attribute_count=600, method_step_count=7, abstract_size=20_000)
+    )
+    assert len(root_el.xpath('//dataTable')) == 3
+    assert len(root_el.xpath('//dataTable/attributeList/attribute')) == 600
+    assert len(root_el.xpath('//methods/methodStep')) == 7
+    assert len(lxml.etree.tostring(root_el.find('dataset/abstract'))) > 20_000
+
+
+@pytest.mark.parametrize('kind', eml_generator.TEXT_KIND_TUPLE)
+def test_text_types_render(kind):
+    root_el = lxml.etree.fromstring(
+        eml_generator.generate_eml(mix_dict=eml_generator.parse_mix(kind))
+    )
+    for text_type_el in root_el.xpath(TEXT_TYPE_XPATH):
+        assert bool(text_type_el.xpath('markdown')) == (kind in ('markdown', 'mixed'))
+        assert bool(text_type_el.xpath('section')) == (kind in ('docbook', 'mixed'))
+        assert bool(text_type_el.xpath('.//literalLayout')) == (kind == 'mixed')
+        html_str = webapp.eml_text_type.text_to_html(text_type_el)
+        assert len(html_str) > 100
+
+
+def test_parse_args():
+    assert eml_generator.parse_size('10KB') == 10 * 1024
+    assert eml_generator.parse_size('1.5mb') == 1536 * 1024
+    assert eml_generator.parse_mix('text=1,markdown=3') == {'text': 1.0, 'markdown': 3.0}
+    with pytest.raises(ValueError):
+        eml_generator.parse_mix('html=1')
@@ -0,0 +1,105 @@
+"""Test the eml_store.py module
+"""
+import pathlib
+from unittest.mock import patch
+
+import lxml.etree
+import pytest
+
+import webapp.eml_store as eml_store
+import webapp.markdown_cache as markdown_cache
+import webapp.multi_helpers as multi_helpers
+import webapp.utils
+
+TEST_DOCS = pathlib.Path(__file__).parent.resolve() / 'test_docs'
+
+TITLE_XPATH = '//*[local-name()="researchProject"]/title[{}]'
+
+
+def test_size_bounded_lru_evicts_least_recently_used():
+    lru = eml_store.SizeBoundedLru(10)
+    lru.put('a', b'123')
+    lru.put('b', b'456')
+    assert lru.get('a') == b'123'
+    lru.put('c', b'7890')
+    assert lru.size == 10
+    lru.put('d', b'12')
+    assert 'b' not in lru
+    assert lru.get('a') == b'123'
+    assert lru.size <= 10
+
+
+def test_size_bounded_lru_skips_large_values():
+    lru = eml_store.SizeBoundedLru(10)
+    lru.put('a', b'123456')
+    assert 'a' not in lru
+    assert lru.size == 0
+
+
+def test_get_eml_downloads_once(upstream):
+    eml_bytes = eml_store.get_eml('edi.521.1', 'dev')
+    assert upstream == ['https://fake-pasta-url.org/metadata/eml/edi/521/1']
+    assert eml_store.get_eml('edi.521.1', 'development') is eml_bytes
+    assert len(upstream) == 1
+
+
+def test_get_eml_reads_disk_tier(upstream):
+    eml_bytes = eml_store.get_eml('edi.521.1', 'dev')
+    eml_store.clear()
+    assert eml_store.get_eml('edi.521.1', 'dev') == eml_bytes
+    assert len(upstream) == 1
+
+
+def test_endpoints_share_store(upstream):
+    raw_str = markdown_cache.get_raw('edi.521.1', TITLE_XPATH.format(1), 'dev')
+    assert markdown_cache.get_raw('edi.521.1', TITLE_XPATH.format(1), 'dev') == raw_str
+    markdown_cache.get_html('edi.521.1', TITLE_XPATH.format(1), 'dev')
+    markdown_cache.get_html('edi.521.1', TITLE_XPATH.format(2), 'dev')
+    assert len(upstream) == 1
+
+
+def test_get_eml_empty_download(upstream):
+    with patch('webapp.config.Config.CACHE_COMPRESSION', 'gzip'), patch(
+        'webapp.utils.requests_wrapper', lambda url: b''
+    ):
+        with pytest.raises(ValueError):
+            eml_store.get_eml('edi.521.1', 'dev')
+    # Nothing is stored, and the next request downloads the document again
+    assert eml_store.get_eml('edi.521.1', 'dev').startswith(b'<?xml')
+
+
+def test_get_eml_invalid_pid(upstream):
+    with pytest.raises(ValueError):
+        eml_store.get_eml('edi.521', 'dev')
+    assert not upstream
+
+
+def test_get_eml_tree_is_cached(upstream):
+    root_el = eml_store.get_eml_tree('edi.521.1', 'dev')
+    assert eml_store.get_eml_tree('edi.521.1', 'development') is root_el
+    assert eml_store.get_eml_tree('edi.521.1', 'dev', deannotate=True) is not root_el
+    assert eml_store.get_stats()['tree']['count'] == 2
+    assert len(upstream) == 1
+
+
+def test_multi_results_leave_tree_unchanged(upstream):
+    root_el = eml_store.get_eml_tree('edi.521.1', 'dev')
+    before_str = lxml.etree.tostring(root_el)
+    for _ in range(2):
+        results = multi_helpers.build_multi_results(
+            ['edi.521.1'], ['//funding', {'titles': TITLE_XPATH.format(1)}], 'dev'
+        )
+        resultset_el = lxml.etree.Element('resultset')
+        for v in results['edi.521.1']:
+            resultset_el.append(v)
+        assert len(resultset_el) == 2
+    assert lxml.etree.tostring(root_el) == before_str
+
+
+def test_get_raw_matches_fresh_parse(upstream):
+    eml_bytes = (TEST_DOCS / 'complete_eml.xml').read_bytes()
+    for xpath in ['//access', '//funding', TITLE_XPATH.format(2)]:
+        expected_str = webapp.utils.get_etree_as_pretty_printed_xml(
+            lxml.etree.fromstring(eml_bytes).xpath(xpath)[0]
+        )
+        assert markdown_cache.get_raw('edi.521.1', xpath, 'dev') == expected_str
@@ -1,5 +1,6 @@
 """Test the eml_text_type.py module
 """
+import copy
 
 import lxml.etree
 import lxml.html
@@ -57,3 +58,32 @@ def test_text_to_html_2(docbook_and_markdown: lxml.etree.Element):
     text_type_el = docbook_and_markdown.xpath('/sample/texttype')[0]
     docbook_and_markdown_html_str = eml_text_type.text_to_html(text_type_el)
     sample.assert_match(docbook_and_markdown_html_str, 'docbook_and_markdown', '.html')
+
+
+def test_pretty_print_in_place(complete_eml, docbook_and_markdown):
+    """Serializing after _pretty_print_in_place() must give the same result as pretty
+    printing with libxml2"""
+    html_el = lxml.etree.HTML('<div><!-- c --><p>text</p><ul><li/><li><b/></li></ul></div>')
+    for root_el in (complete_eml.getroot(), docbook_and_markdown.getroot(), html_el):
+        for el in root_el.iter(lxml.etree.Element):
+            expected_el = copy.deepcopy(el)
+            expected_el.tail = None
+            actual_el = copy.deepcopy(expected_el)
+            eml_text_type._pretty_print_in_place(actual_el)
+            assert lxml.etree.tostring(actual_el) + b'\n' == lxml.etree.tostring(
+                expected_el, pretty_print=True
+            )
+
+
+def test_fix_literal_layout_leaves_source_unchanged(docbook_and_markdown):
+    section_el = docbook_and_markdown.xpath('/sample/texttype/section')[0]
+    fixed_el = eml_text_type.fix_literal_layout(section_el)
+    assert fixed_el.xpath('.//literallayout')
+    assert not fixed_el.xpath('.//literalLayout')
+    assert section_el.xpath('.//literalLayout')
+
+
+def test_clean_html():
+    html_el = lxml.etree.HTML('<p class="a"><a href="#x" id="y">link</a></p>')
+    eml_text_type.clean_html(html_el)
+    assert lxml.etree.tostring(html_el) == b'<html><body><p><a href="#x">link</a></p></body></html>'
@@ -0,0 +1,82 @@
+"""Test the fake PASTA server in benchmarks/fake_pasta.py, and the load test harness
+"""
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch
+
+import pytest
+import requests
+
+import benchmarks.bench_load as bench_load
+import benchmarks.fake_pasta as fake_pasta
+import webapp.eml_store
+
+
+@pytest.fixture
+def start_pasta(tmpdir, docs_path):
+    """Return a function that starts a fake PASTA server with the given options, serving
+    complete_eml.xml as edi.1.1 and edi.1.2, and returns its PASTA URL"""
+    for pid in ('edi.1.1', 'edi.1.2'):
+        shutil.copy(docs_path / 'complete_eml.xml', tmpdir / f'{pid}.xml')
+    server_list = []
+
+    def start(**option_dict):
+        server = fake_pasta.make_server(eml_dir=tmpdir, **option_dict)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        server_list.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}/package'
+
+    yield start
+    for server in server_list:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve_eml(start_pasta, docs_path):
+    pasta_url = start_pasta()
+    response = requests.get(f'{pasta_url}/metadata/eml/edi/1/2')
+    assert response.status_code == 200
+    assert response.content == (docs_path / 'complete_eml.xml').read_bytes()
+    assert requests.get(f'{pasta_url}/metadata/eml/edi/1/3').status_code == 404
+    assert requests.get(f'{pasta_url}/eml').text == 'edi\n'
+    assert requests.get(f'{pasta_url}/eml/edi').text == '1\n'
+    assert requests.get(f'{pasta_url}/eml/edi/1').text == '1\n2\n'
+    assert requests.get(f'{pasta_url}/eml/edi/1?filter=newest').text == '2\n'
+    assert requests.get(f'{pasta_url.rsplit("/", 1)[0]}/_stats').json() == {
+        '200': 5,
+        '404': 1,
+    }
+
+
+def test_failures(start_pasta):
+    eml_url = f'{start_pasta(error_rate=1)}/metadata/eml/edi/1/1'
+    assert requests.get(eml_url).status_code == 500
+    eml_url = f'{start_pasta(not_found_rate=1)}/metadata/eml/edi/1/1'
+    assert requests.get(eml_url).status_code == 404
+    eml_url = f'{start_pasta(max_rps=1)}/metadata/eml/edi/1/1'
+    assert requests.get(eml_url).status_code == 200
+    response = requests.get(eml_url)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_ridare_uses_fake_pasta(client, start_pasta):
+    pasta_url = start_pasta()
+    webapp.eml_store.clear()
+    with tempfile.TemporaryDirectory() as cache_dir, patch(
+        'webapp.config.Config.CACHE_D', cache_dir
+    ), patch('webapp.config.Config.PASTA_D', pasta_url):
+        assert client.get('/edi.1.1///funding?env=d').status_code == 200
+        assert client.get('/edi.1.3///funding?env=d').status_code == 400
+        stats_dict = requests.get(f'{pasta_url.rsplit("/", 1)[0]}/_stats').json()
+        assert stats_dict == {'200': 1, '404': 1}
+    webapp.eml_store.clear()
+
+
+def test_get_latency_summary():
+    summary_dict = bench_load.get_latency_summary([float(ms) for ms in range(1, 101)])
+    assert summary_dict['p50_ms'] == pytest.approx(50.5)
+    assert 95 < summary_dict['p95_ms'] < 96
+    assert 99 < summary_dict['p99_ms'] < 100
+    assert bench_load.get_latency_summary([5.0]) == {'p50_ms': 5.0, 'p95_ms': 5.0, 'p99_ms': 5.0}
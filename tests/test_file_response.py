@@ -0,0 +1,89 @@
+"""Test the file_response.py module
+"""
+import gzip
+import pathlib
+from unittest.mock import patch
+
+import pytest
+
+import webapp.cache_key as cache_key
+import webapp.compression as compression
+import webapp.config
+
+HTML_URL = '/edi.1.1///funding?env=d'
+GZIP_HEADERS = {'Accept-Encoding': 'gzip'}
+
+
+@pytest.fixture(name="html_path")
+def fixture_html_path(client, upstream) -> pathlib.Path:
+    """Render the HTML into the cache, and return the path of the cache file"""
+    assert client.get(HTML_URL).status_code == 200
+    return cache_key.get_html_path('edi.1.1', '//funding', webapp.config.Config.CACHE_D)
+
+
+def _get_without_reading(client, **kwargs):
+    """GET the HTML, failing if any cache file is read into memory"""
+    with patch('webapp.cache_file.read', side_effect=AssertionError('read')), patch(
+        'webapp.config.Config.RESPONSE_COMPRESS_MIN_BYTES', 0
+    ):
+        response = client.get(HTML_URL, **kwargs)
+    # Buffer the body and close the file, as the WSGI server would
+    response.get_data()
+    response.close()
+    return response
+
+
+def test_sendfile(client, html_path):
+    with patch('webapp.config.Config.CACHE_FILE_RESPONSE', 'sendfile'):
+        response = _get_without_reading(client)
+    assert response.status_code == 200
+    assert response.data == html_path.read_bytes()
+    assert response.headers['Content-Length'] == str(html_path.stat().st_size)
+    assert response.headers['Content-Type'] == 'text/html; charset=utf-8'
+    assert response.headers['ETag']
+    # Uncompressed files are sent uncompressed
+    with patch('webapp.config.Config.CACHE_FILE_RESPONSE', 'sendfile'):
+        response = _get_without_reading(client, headers=GZIP_HEADERS)
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == html_path.read_bytes()
+
+
+def test_sendfile_compressed(client, upstream):
+    with patch('webapp.config.Config.CACHE_COMPRESSION', 'gzip'):
+        identity_data = client.get(HTML_URL).data
+        with patch('webapp.config.Config.CACHE_FILE_RESPONSE', 'sendfile'):
+            response = _get_without_reading(client, headers=GZIP_HEADERS)
+            # Clients that do not accept gzip get the content through the usual path
+            assert client.get(HTML_URL).data == identity_data
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'].endswith('-gzip"')
+    assert gzip.decompress(response.data) == identity_data
+
+
+def test_x_accel(client, html_path):
+    with patch('webapp.config.Config.CACHE_FILE_RESPONSE', 'x-accel'):
+        response = _get_without_reading(client)
+    assert response.status_code == 200
+    assert response.data == b''
+    relative_path = html_path.relative_to(webapp.config.Config.CACHE_D).as_posix()
+    assert response.headers['X-Accel-Redirect'] == f'/_ridare_cache/development/{relative_path}'
+    assert response.headers['Content-Type'] == 'text/html; charset=utf-8'
+    assert response.headers['ETag']
+    assert response.cache_control.immutable
+
+
+def test_x_accel_compressed(client, upstream):
+    with patch('webapp.config.Config.CACHE_COMPRESSION', 'gzip'):
+        client.get(HTML_URL)
+        with patch('webapp.config.Config.CACHE_FILE_RESPONSE', 'x-accel'):
+            response = _get_without_reading(client, headers=GZIP_HEADERS)
+    assert response.headers['X-Accel-Redirect'].endswith(compression.GZIP_SUFFIX)
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_misses_are_rendered(client, upstream):
+    with patch('webapp.config.Config.CACHE_FILE_RESPONSE', 'x-accel'):
+        response = client.get(HTML_URL)
+        assert response.data
+        assert 'X-Accel-Redirect' not in response.headers
+        assert 'X-Accel-Redirect' in client.get(HTML_URL).headers
@@ -0,0 +1,64 @@
+"""Test the gfm.py module
+"""
+from unittest.mock import patch
+
+import lxml.etree
+import pytest
+
+import webapp.eml_text_type as eml_text_type
+import webapp.gfm as gfm
+
+
+def _render(markdown_str: str) -> lxml.etree.Element:
+    return lxml.etree.HTML(gfm.markdown_to_html(markdown_str))
+
+
+def test_headings_are_wrapped_with_anchors():
+    html_el = _render('# Methods & Data\n\n## Methods & Data\n')
+    div_list = html_el.xpath('/html/body/div')
+    assert [div_el.xpath('string(*[1])') for div_el in div_list] == ['Methods & Data'] * 2
+    assert html_el.xpath('/html/body/div/a/@href') == ['#methods--data', '#methods--data-1']
+
+
+def test_soft_line_breaks_and_quotes_are_kept():
+    html_str = gfm.markdown_to_html("Producer's\naccuracy")
+    assert html_str == "<p>Producer's\naccuracy</p>\n"
+
+
+def test_strikethrough():
+    html_el = _render('~~removed~~ and ~also~ but not ~~~this~~~')
+    assert html_el.xpath('//del/text()') == ['removed', 'also']
+
+
+def test_task_list():
+    html_el = _render('- [ ] open\n- [x] closed\n- [not a task]\n')
+    assert html_el.xpath('//li/input/@checked') == ['checked']
+    assert html_el.xpath('count(//li/input)') == 2
+    assert html_el.xpath('string(//li[3])') == '[not a task]'
+
+
+@pytest.mark.parametrize(
+    'markdown_str,href_list',
+    [
+        ('See https://edirepository.org/a_(b).', ['https://edirepository.org/a_(b)']),
+        ('(at www.edirepository.org)', ['http://www.edirepository.org']),
+        ('[https://a.org](https://b.org)', ['https://b.org']),
+        ('`https://a.org`', []),
+        ('no links here', []),
+    ],
+)
+def test_autolinks(markdown_str, href_list):
+    assert _render(markdown_str).xpath('//a/@href') == href_list
+
+
+def test_table_and_fenced_code():
+    html_el = _render('| a | b |\n|---|--:|\n| 1 | 2 |\n\n```python\nx = 1\n```\n')
+    assert html_el.xpath('//td/text()') == ['1', '2']
+    assert html_el.xpath('//pre/code/text()') == ['x = 1\n']
+
+
+def test_local_renderer_does_not_call_github(complete_eml):
+    markdown_el = complete_eml.xpath('.//funding//markdown[1]')[0]
+    with patch('grip.render_content', side_effect=AssertionError):
+        html_el = eml_text_type._markdown_to_html(markdown_el)
+    assert lxml.etree.tostring(html_el) == b'<html><body><p>markdown0</p>\n</body></html>'
@@ -0,0 +1,108 @@
+"""Test the HTTP validators and caching headers added by the http_cache.py module
+"""
+from unittest.mock import patch
+
+import webapp.eml_store as eml_store
+
+HTML_URL = '/edi.1.1///funding?env=d'
+RAW_URL = '/raw/edi.1.1///funding?env=d'
+
+
+def test_html_is_cacheable(client, upstream):
+    response = client.get(HTML_URL)
+    assert response.status_code == 200
+    assert response.headers['ETag'].startswith('"')
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert response.cache_control.immutable
+
+
+def test_matching_if_none_match_returns_304_without_rendering(client, upstream):
+    etag = client.get(HTML_URL).headers['ETag']
+    # The digest of the EML document is read from the cache directory, and neither the EML
+    # nor the HTML is read
+    eml_store.clear()
+    with patch('webapp.markdown_cache.get_html') as get_html_mock, patch(
+        'webapp.eml_store.get_eml'
+    ) as get_eml_mock:
+        response = client.get(HTML_URL, headers={'If-None-Match': etag})
+        weak_response = client.get(HTML_URL, headers={'If-None-Match': f'"x", W/{etag}'})
+    assert response.status_code == 304
+    assert weak_response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert response.cache_control.immutable
+    assert not get_html_mock.called
+    assert not get_eml_mock.called
+    assert len(upstream) == 1
+
+
+def test_other_if_none_match_returns_200(client, upstream):
+    response = client.get(HTML_URL, headers={'If-None-Match': '"0123"'})
+    assert response.status_code == 200
+    assert response.data
+
+
+def test_etag_depends_on_content_and_renderer(client, upstream):
+    etag = client.get(HTML_URL).headers['ETag']
+    # Equivalent requests
+    assert client.get('/ edi.1.1 ///funding?env=d').headers['ETag'] == etag
+    # Same document, other content
+    assert client.get(RAW_URL).headers['ETag'] != etag
+    with patch('webapp.eml_text_type.RENDERER_VERSION', -1):
+        assert client.get(HTML_URL).headers['ETag'] != etag
+    # Other document
+    eml_store.discard('edi.1.1', 'dev')
+    with patch('webapp.utils.requests_wrapper', lambda url: b'<eml><funding/></eml>'):
+        assert client.get(RAW_URL).headers['ETag'] != etag
+
+
+def test_new_renderer_does_not_serve_cached_html(client, upstream):
+    client.get(HTML_URL)
+    with patch('webapp.eml_text_type.RENDERER_VERSION', -1), patch(
+        'webapp.eml_text_type.text_to_html', return_value='<div>New</div>'
+    ) as text_to_html_mock:
+        response = client.get(HTML_URL)
+    assert text_to_html_mock.called
+    assert response.data == b'<div>New</div>'
+
+
+def test_raw_is_cacheable(client, upstream):
+    etag = client.get(RAW_URL).headers['ETag']
+    with patch('webapp.markdown_cache.get_raw') as get_raw_mock:
+        response = client.get(RAW_URL, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert not get_raw_mock.called
+
+
+def test_head(client, upstream):
+    get_response = client.get(HTML_URL)
+    response = client.head(HTML_URL)
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['ETag'] == get_response.headers['ETag']
+    assert response.headers['Content-Length'] == str(len(get_response.data))
+    assert client.head(RAW_URL).status_code == 200
+
+
+def test_no_max_age(client, upstream):
+    with patch('webapp.config.Config.RESPONSE_MAX_AGE', 0):
+        response = client.get(HTML_URL)
+    assert response.cache_control.no_cache
+    assert response.cache_control.max_age is None
+    assert 'ETag' in response.headers
+
+
+def test_errors_are_not_cacheable(client, upstream):
+    response = client.get('/edi.1.1///nonexistent?env=d')
+    assert response.status_code == 400
+    assert 'ETag' not in response.headers
+    assert 'Cache-Control' not in response.headers
+
+
+def test_multi_has_etag(client, upstream):
+    payload = {'pid': ['edi.1.1', 'edi.1.2'], 'query': ['//funding']}
+    response = client.post('/multi?env=development', json=payload)
+    assert response.status_code == 200
+    etag = client.post('/multi?env=development', json=payload).headers['ETag']
+    assert response.headers['ETag'] == etag
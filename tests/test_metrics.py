@@ -0,0 +1,86 @@
+"""Test the metrics.py module
+"""
+from unittest.mock import patch
+
+import lxml.etree
+import pytest
+
+import webapp.eml_text_type as eml_text_type
+import webapp.metrics as metrics
+
+HTML_URL = '/edi.1.1///funding?env=d'
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    metrics.clear()
+    yield
+    metrics.clear()
+
+
+def test_render():
+    metrics.inc(metrics.UPSTREAM_TOTAL, server='https://pasta', status='200')
+    metrics.inc(metrics.UPSTREAM_TOTAL, server='https://pasta', status='200')
+    metrics.inc(metrics.FALLBACK_TOTAL, from_renderer='a"b\\', to_renderer='c')
+    metrics.observe(metrics.STAGE_SECONDS, 0.003, stage='xpath')
+    metrics.observe(metrics.STAGE_SECONDS, 100, stage='xpath')
+    line_list = metrics.render().splitlines()
+    assert '# TYPE ridare_upstream_responses_total counter' in line_list
+    assert 'ridare_upstream_responses_total{server="https://pasta",status="200"} 2' in line_list
+    assert 'ridare_renderer_fallbacks_total{from_renderer="a\\"b\\\\",to_renderer="c"} 1' in (
+        line_list
+    )
+    assert 'ridare_stage_duration_seconds_bucket{stage="xpath",le="0.0025"} 0' in line_list
+    assert 'ridare_stage_duration_seconds_bucket{stage="xpath",le="0.005"} 1' in line_list
+    assert 'ridare_stage_duration_seconds_bucket{stage="xpath",le="30"} 1' in line_list
+    assert 'ridare_stage_duration_seconds_bucket{stage="xpath",le="+Inf"} 2' in line_list
+    assert 'ridare_stage_duration_seconds_sum{stage="xpath"} 100.003' in line_list
+    assert 'ridare_stage_duration_seconds_count{stage="xpath"} 2' in line_list
+
+
+def test_workers_are_summed(tmpdir):
+    with patch('webapp.config.Config.METRICS_DIR', tmpdir.as_posix()):
+        metrics.inc(metrics.CACHE_TOTAL, tier='html', env='development', result='hit')
+        metrics.observe(metrics.STAGE_SECONDS, 0.5, stage='render')
+        metrics.flush()
+        # Another worker, with the same totals
+        (worker_path,) = tmpdir.glob('*.json')
+        (tmpdir / 'other.json').write_bytes(worker_path.read_bytes())
+        metrics.inc(metrics.CACHE_TOTAL, tier='html', env='development', result='hit')
+        text_str = metrics.render()
+    assert 'ridare_cache_requests_total{env="development",result="hit",tier="html"} 3' in text_str
+    assert 'ridare_stage_duration_seconds_count{stage="render"} 2' in text_str
+    assert len(list(tmpdir.glob('*.json'))) == 2
+
+
+def test_endpoint(client, upstream):
+    client.get(HTML_URL)
+    client.get(HTML_URL)
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text_str = response.data.decode('utf-8')
+    for line_str in (
+        'ridare_cache_requests_total{env="development",result="miss",tier="html"} 1',
+        'ridare_cache_requests_total{env="development",result="hit",tier="html"} 1',
+        'ridare_cache_requests_total{env="development",result="miss",tier="eml_disk"} 1',
+        'ridare_stage_duration_seconds_count{stage="parse"} 1',
+        'ridare_stage_duration_seconds_count{stage="render"} 1',
+        'ridare_request_duration_seconds_count{endpoint="markdown",status="200"} 2',
+    ):
+        assert line_str in text_str
+    with patch('webapp.config.Config.METRICS_ENABLED', False):
+        assert client.get('/metrics').status_code == 404
+
+
+def test_renderer_fallback():
+    markdown_el = lxml.etree.fromstring('<markdown># Title</markdown>')
+    with patch('webapp.config.Config.MARKDOWN_RENDERER', 'github'), patch(
+        'grip.render_content', side_effect=ValueError('rate limited')
+    ):
+        html_el = eml_text_type._markdown_to_html(markdown_el)
+    assert html_el.xpath('//h1')
+    assert (
+        'ridare_renderer_fallbacks_total{from_renderer="github",to_renderer="local"} 1'
+        in metrics.render()
+    )
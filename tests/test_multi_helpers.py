@@ -0,0 +1,138 @@
+"""Test the multi_helpers.py module
+"""
+import random
+import threading
+import time
+from unittest.mock import patch
+
+import lxml.etree
+import pytest
+
+import webapp.multi_helpers as multi_helpers
+import webapp.run
+
+
+@pytest.fixture(name="fake_fetch")
+def fixture_fake_fetch():
+    """Replace EML retrieval with a slow fake that records the number of concurrent
+    fetches. PIDs starting with "bad" fail."""
+    state = {'active': 0, 'max_active': 0}
+    lock = threading.Lock()
+
+    def fake_get_eml_tree(pid, env):
+        with lock:
+            state['active'] += 1
+            state['max_active'] = max(state['max_active'], state['active'])
+        try:
+            time.sleep(random.uniform(0.001, 0.01))
+            if pid.startswith('bad'):
+                raise ValueError(f'Cannot fetch {pid}')
+            return lxml.etree.fromstring(f'<eml><pid>{pid}</pid></eml>')
+        finally:
+            with lock:
+                state['active'] -= 1
+
+    with patch.dict(multi_helpers._executor_dict, clear=True), patch(
+        "webapp.config.Config.MULTI_FETCH_CONCURRENCY_D", 3
+    ), patch("webapp.multi_helpers.get_eml_tree", fake_get_eml_tree):
+        yield state
+        for executor in multi_helpers._executor_dict.values():
+            executor.shutdown()
+
+
+def test_results_keep_request_order(fake_fetch):
+    pids = [f'edi.{i}.1' for i in range(20)]
+    results = multi_helpers.build_multi_results(pids, ['//pid/text()'], 'development')
+    assert list(results) == pids
+    assert [v[0] for v in results.values()] == pids
+    assert 1 < fake_fetch['max_active'] <= 3
+
+
+def test_failed_pids_are_isolated(fake_fetch):
+    pids = ['edi.1.1', 'bad.2.1', 'edi.3.1', 'bad.4.1', 'edi.5.1']
+    results = multi_helpers.build_multi_results(pids, ['//pid/text()'], 'development')
+    assert list(results) == ['edi.1.1', 'edi.3.1', 'edi.5.1']
+
+
+def _build_resultset_xml(results: dict) -> bytes:
+    """Serialize results by building the complete <resultset> tree"""
+    resultset_el = lxml.etree.Element("resultset")
+    for pid, pid_results in results.items():
+        resultset_el.append(multi_helpers.build_document_el(pid, pid_results))
+    return lxml.etree.tostring(
+        resultset_el, pretty_print=True, encoding="utf-8", xml_declaration=True
+    )
+
+
+@pytest.mark.parametrize(
+    "queries",
+    [
+        ['//funding', {'titles': '//*[local-name()="researchProject"]/title'}],
+        ['//title/text()', {'access': '//access'}, '//*'],
+        ['//no-such-element'],
+    ],
+)
+def test_streamed_resultset_matches_tree(complete_eml, queries):
+    pids = ['edi.1.1', 'edi.2.1', 'edi.3.1']
+    with patch("webapp.multi_helpers.get_eml_tree", lambda pid, env: complete_eml.getroot()):
+        expected_xml = _build_resultset_xml(
+            multi_helpers.build_multi_results(pids, queries, 'development')
+        )
+        streamed_xml = b"".join(
+            multi_helpers.iter_resultset_xml(
+                multi_helpers.iter_multi_results(pids, queries, 'development')
+            )
+        )
+    assert streamed_xml == expected_xml
+
+
+def test_streamed_resultset_empty():
+    assert b"".join(multi_helpers.iter_resultset_xml([])) == _build_resultset_xml({})
+
+
+def test_multi_streams_large_requests(fake_fetch):
+    client = webapp.run.app.test_client()
+    payload = {'pid': [f'edi.{i}.1' for i in range(5)], 'query': ['//pid']}
+    with patch("webapp.config.Config.MULTI_STREAM_MIN_PIDS", 100):
+        buffered_response = client.post('/multi?env=development', json=payload)
+    with patch("webapp.config.Config.MULTI_STREAM_MIN_PIDS", 5):
+        streamed_response = client.post('/multi?env=development', json=payload)
+    # Streamed responses are sent without a Content-Length
+    assert 'Content-Length' in buffered_response.headers
+    assert 'Content-Length' not in streamed_response.headers
+    assert streamed_response.data == buffered_response.data
+    assert buffered_response.data.count(b'<document>') == 5
+
+
+def test_failed_queries_are_isolated(fake_fetch):
+    build_pid_results = multi_helpers.build_pid_results
+
+    def fake_build_pid_results(root, queries):
+        if root.findtext('pid') == 'edi.2.1':
+            raise TypeError('Query failed')
+        return build_pid_results(root, queries)
+
+    client = webapp.run.app.test_client()
+    payload = {'pid': [f'edi.{i}.1' for i in range(5)], 'query': ['//pid']}
+    with patch("webapp.multi_helpers.build_pid_results", fake_build_pid_results):
+        with patch("webapp.config.Config.MULTI_STREAM_MIN_PIDS", 100):
+            buffered_response = client.post('/multi?env=development', json=payload)
+        with patch("webapp.config.Config.MULTI_STREAM_MIN_PIDS", 5):
+            streamed_response = client.post('/multi?env=development', json=payload)
+            # The streamed body is built as it is read
+            streamed_xml = streamed_response.data
+    assert buffered_response.status_code == streamed_response.status_code == 200
+    assert streamed_xml == buffered_response.data
+    assert streamed_xml.endswith(b'</resultset>\n')
+    assert streamed_xml.count(b'<document>') == 4
+    assert b'edi.2.1' not in streamed_xml
+
+
+def test_streamed_query_returning_number(fake_fetch):
+    # XPath numbers cannot be added to the results, so each pid fails
+    client = webapp.run.app.test_client()
+    payload = {'pid': [f'edi.{i}.1' for i in range(5)], 'query': ['count(//pid)']}
+    with patch("webapp.config.Config.MULTI_STREAM_MIN_PIDS", 5):
+        response = client.post('/multi?env=development', json=payload)
+        assert response.status_code == 200
+        assert response.data.endswith(b'<resultset/>\n')
@@ -0,0 +1,84 @@
+"""Test the prewarm.py module
+"""
+from unittest.mock import patch
+
+import requests
+
+import webapp.config
+import webapp.eml_store as eml_store
+import webapp.markdown_cache as markdown_cache
+import webapp.prewarm as prewarm
+import webapp.run
+
+PID_LIST = ['edi.1.1', 'edi.1.2', ' edi.1.1']
+XPATH_LIST = ['//funding', '//dataset/abstract']
+
+
+def test_prewarm(upstream):
+    done_list = []
+    counter = prewarm.prewarm(
+        PID_LIST, XPATH_LIST, 'd', 2, 2, on_done=lambda pid, c: done_list.append(pid)
+    )
+    assert counter == {prewarm.RENDERED: 2, prewarm.NOT_FOUND: 2}
+    assert sorted(done_list) == ['edi.1.1', 'edi.1.2']
+    assert len(upstream) == 2
+    cache = webapp.config.Config.CACHE_D
+    assert prewarm.is_cached('edi.1.1', '//funding', cache)
+    assert not prewarm.is_cached('edi.1.1', '//dataset/abstract', cache)
+    # The requests read the HTML that was rendered by the worker processes
+    eml_store.clear()
+    with patch('webapp.render_cache.text_to_html') as text_to_html_mock:
+        assert markdown_cache.get_html('edi.1.2', '//funding', 'd')
+    assert not text_to_html_mock.called
+
+
+def test_prewarm_resumes(upstream):
+    prewarm.prewarm(['edi.1.1'], ['//funding'], 'd', 1, 1)
+    counter = prewarm.prewarm(['edi.1.1', 'edi.1.2'], ['//funding'], 'd', 1, 1)
+    assert counter == {prewarm.CACHED: 1, prewarm.RENDERED: 1}
+    counter = prewarm.prewarm(['edi.1.1', 'edi.1.2'], ['//funding'], 'd', 1, 1)
+    assert counter == {prewarm.CACHED: 2}
+    assert len(upstream) == 2
+
+
+def test_prewarm_download_errors(upstream):
+    with patch(
+        'webapp.utils.requests_wrapper', side_effect=requests.exceptions.ConnectionError
+    ):
+        counter = prewarm.prewarm(['edi.1.1'], XPATH_LIST, 'd', 1, 1)
+    assert counter == {prewarm.FETCH_ERROR: 1}
+
+
+def test_resolve_scope(upstream):
+    response_dict = {
+        'https://fake-pasta-url.org/eml': b'edi\nedi-test\nknb-lter-cap\n',
+        'https://fake-pasta-url.org/eml/edi': b'1\n2\n',
+        'https://fake-pasta-url.org/eml/edi-test': b'5\n',
+        'https://fake-pasta-url.org/eml/edi/1?filter=newest': b'3\n',
+        'https://fake-pasta-url.org/eml/edi/2?filter=newest': b'1\n',
+        'https://fake-pasta-url.org/eml/edi-test/5?filter=newest': b'2\n',
+        'https://fake-pasta-url.org/eml/edi/1': b'1\n2\n3\n',
+        'https://fake-pasta-url.org/eml/edi/2': b'1\n',
+        'https://fake-pasta-url.org/eml/edi-test/5': b'1\n2\n',
+    }
+    with patch('webapp.utils.requests_wrapper', response_dict.__getitem__):
+        assert prewarm.resolve_scope('edi', 'd') == ['edi.1.3', 'edi.2.1', 'edi-test.5.2']
+        assert prewarm.resolve_scope('edi', 'd', all_revisions=True) == [
+            'edi.1.1',
+            'edi.1.2',
+            'edi.1.3',
+            'edi.2.1',
+            'edi-test.5.1',
+            'edi-test.5.2',
+        ]
+
+
+def test_cache_prewarm_command(upstream):
+    args = ['cache-prewarm', '--env', 'd', '--processes', '1', '--xpath', '//funding']
+    result = webapp.run.app.test_cli_runner().invoke(args=[*args, 'edi.1.1', 'edi.1.2'])
+    assert result.exit_code == 0
+    assert 'development: 2 data packages in' in result.output
+    assert 'Rendered:                 2' in result.output
+    result = webapp.run.app.test_cli_runner().invoke(args=[*args, 'edi.1.1'])
+    assert 'Already cached:           1' in result.output
+    assert len(upstream) == 2
@@ -0,0 +1,102 @@
+"""Test the profiling.py module
+"""
+import re
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+import webapp.cache_key as cache_key
+import webapp.config
+import webapp.profiling as profiling
+
+HTML_URL = '/edi.1.1///funding?env=d'
+SERVER_TIMING_RX = re.compile(
+    r'fetch;dur=[\d.]+, parse;dur=[\d.]+, xpath;dur=[\d.]+, render;dur=[\d.]+, '
+    r'serialize;dur=[\d.]+, total;dur=[\d.]+'
+)
+
+
+def _get_durations(server_timing: str) -> dict[str, float]:
+    assert SERVER_TIMING_RX.fullmatch(server_timing)
+    return {
+        name: float(dur) for name, dur in re.findall(r'(\w+);dur=([\d.]+)', server_timing)
+    }
+
+
+def test_get_server_timing():
+    assert profiling.get_server_timing({'xpath': 0.0012, 'other': 1}, 0.5) == (
+        'fetch;dur=0.0, parse;dur=0.0, xpath;dur=1.2, render;dur=0.0, serialize;dur=0.0, '
+        'total;dur=500.0'
+    )
+
+
+def test_server_timing(client, upstream):
+    duration_dict = _get_durations(client.get(HTML_URL).headers['Server-Timing'])
+    assert duration_dict['render'] > 0
+    assert duration_dict['total'] >= duration_dict['fetch'] + duration_dict['render']
+    assert 'Server-Timing' in client.get(f'/raw{HTML_URL}').headers
+    response = client.post(
+        '/multi?env=development', json={'pid': ['edi.1.1'], 'query': ['//funding']}
+    )
+    assert _get_durations(response.headers['Server-Timing'])['total'] > 0
+    assert 'Server-Timing' not in client.get('/metrics').headers
+
+
+def test_profile(client, upstream):
+    response = client.get(f'{HTML_URL}&profile=tottime', headers={'X-Real-IP': '127.0.0.1'})
+    assert response.status_code == 200
+    assert response.content_type == 'text/plain; charset=utf-8'
+    text_str = response.data.decode('utf-8')
+    assert 'Status: 200 OK' in text_str
+    assert re.search(r'Peak traced memory: [\d,]+ bytes', text_str)
+    assert 'Ordered by: internal time' in text_str
+    assert 'Server-Timing' in response.headers
+    # The lock is released, and the next request is profiled too
+    response = client.get(f'{HTML_URL}&profile=1', headers={'X-Real-IP': '127.0.0.1'})
+    text_str = response.data.decode('utf-8')
+    assert 'Ordered by: cumulative time' in text_str
+    assert 'get_html_data' in text_str
+
+
+def test_profile_is_restricted(client, upstream):
+    response = client.get(f'{HTML_URL}&profile=1', headers={'X-Real-IP': '10.1.2.3'})
+    assert response.status_code == 403
+    with patch('webapp.config.Config.PROFILE_ENABLED', False):
+        response = client.get(f'{HTML_URL}&profile=1', headers={'X-Real-IP': '127.0.0.1'})
+    assert response.status_code == 403
+    # The address from X-Real-IP is only used for requests from the local host
+    response = client.get(
+        f'{HTML_URL}&profile=1',
+        headers={'X-Real-IP': '127.0.0.1'},
+        environ_base={'REMOTE_ADDR': '10.1.2.3'},
+    )
+    assert response.status_code == 403
+
+
+def test_profile_sendfile_cache_hit(client, upstream):
+    client.get(HTML_URL)
+    html_path = cache_key.get_html_path('edi.1.1', '//funding', webapp.config.Config.CACHE_D)
+    with patch('webapp.config.Config.CACHE_FILE_RESPONSE', 'sendfile'):
+        response = client.get(f'{HTML_URL}&profile=1', headers={'X-Real-IP': '127.0.0.1'})
+    assert response.status_code == 200
+    assert f'Response size: {html_path.stat().st_size:,} bytes' in response.data.decode('utf-8')
+    assert not tracemalloc.is_tracing()
+
+
+def test_profile_is_stopped_on_failure(client, upstream):
+    def failing_iter_multi_results(*_args):
+        raise RuntimeError('Stream failed')
+        yield  # pylint: disable=unreachable
+
+    with patch('webapp.config.Config.MULTI_STREAM_MIN_PIDS', 1), patch(
+        'webapp.run.iter_multi_results', failing_iter_multi_results
+    ), pytest.raises(RuntimeError):
+        client.post(
+            '/multi?env=development&profile=1',
+            json={'pid': ['edi.1.1'], 'query': ['//funding']},
+            headers={'X-Real-IP': '127.0.0.1'},
+        )
+    assert not tracemalloc.is_tracing()
+    response = client.get(f'{HTML_URL}&profile=1', headers={'X-Real-IP': '127.0.0.1'})
+    assert response.status_code == 200
@@ -0,0 +1,61 @@
+"""Test the render_cache.py module
+"""
+from unittest.mock import patch
+
+import lxml.etree
+
+import webapp.cache_key as cache_key
+import webapp.config
+import webapp.eml_text_type
+import webapp.markdown_cache as markdown_cache
+import webapp.render_cache as render_cache
+import webapp.run
+
+
+def test_content_key_ignores_context_and_formatting():
+    a_el = lxml.etree.fromstring(
+        '<eml xmlns:x="urn:x" xmlns:y="urn:y"><abstract><para>Text <x:b/></para></abstract></eml>'
+    )
+    b_el = lxml.etree.fromstring(
+        '<other xmlns:x="urn:x">\n  <abstract  ><para>Text <x:b></x:b></para></abstract>tail'
+        '</other>'
+    )
+    c_el = lxml.etree.fromstring('<abstract><para>Other text</para></abstract>')
+    a_key = render_cache.get_content_key(a_el[0])
+    assert a_key == render_cache.get_content_key(b_el[0])
+    assert a_key != render_cache.get_content_key(c_el)
+    with patch('webapp.eml_text_type.RENDERER_VERSION', -1):
+        assert a_key != render_cache.get_content_key(a_el[0])
+
+
+def test_identical_content_is_rendered_once(upstream):
+    # All pids are served the same EML document
+    with patch(
+        'webapp.eml_text_type.text_to_html', wraps=webapp.eml_text_type.text_to_html
+    ) as text_to_html_mock:
+        html_list = [
+            markdown_cache.get_html(pid, '//funding', 'dev')
+            for pid in ('edi.1.1', 'edi.1.2', 'edi.2.1')
+        ]
+        markdown_cache.get_html('edi.1.1', '//*[local-name()="researchProject"]/title[1]', 'dev')
+    assert text_to_html_mock.call_count == 2
+    assert html_list[0] == html_list[1] == html_list[2]
+
+
+def test_render_cache_report(upstream):
+    for pid in ('edi.1.1', 'edi.1.2', 'edi.2.1'):
+        markdown_cache.get_html(pid, '//funding', 'dev')
+    cache = webapp.config.Config.CACHE_D
+    report_dict = render_cache.get_report(cache)
+    assert report_dict['html_count'] == 3
+    assert report_dict['distinct_count'] == 1
+    assert report_dict['saved_renders'] == 2
+    assert report_dict['render_count'] == 1
+    assert report_dict['render_bytes'] == report_dict['distinct_bytes']
+    assert report_dict['html_bytes'] == 3 * report_dict['distinct_bytes']
+    for pid in ('edi.1.1', 'edi.1.2', 'edi.2.1'):
+        assert cache_key.get_html_path(pid, '//funding', cache).is_file()
+
+    result = webapp.run.app.test_cli_runner().invoke(args=['render-cache-report', '--env', 'd'])
+    assert result.exit_code == 0
+    assert '(3.00 HTML cache files per render)' in result.output
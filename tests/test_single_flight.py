@@ -0,0 +1,96 @@
+"""Test the single_flight.py module
+"""
+import multiprocessing
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+import webapp.config
+import webapp.eml_text_type
+import webapp.markdown_cache as markdown_cache
+import webapp.single_flight as single_flight
+
+THREAD_COUNT = 8
+
+
+def test_concurrent_misses_share_one_fetch_and_render(upstream):
+    def slow_text_to_html(*args, **kwargs):
+        # Give the other threads time to pile up behind the first one
+        time.sleep(0.1)
+        return text_to_html(*args, **kwargs)
+
+    text_to_html = webapp.eml_text_type.text_to_html
+    barrier = threading.Barrier(THREAD_COUNT)
+    html_list = []
+
+    def get_html():
+        barrier.wait()
+        html_list.append(markdown_cache.get_html('edi.1.1', '//funding', 'dev'))
+
+    with patch(
+        'webapp.eml_text_type.text_to_html', side_effect=slow_text_to_html
+    ) as text_to_html_mock:
+        thread_list = [threading.Thread(target=get_html) for _ in range(THREAD_COUNT)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+
+    assert len(upstream) == 1
+    assert text_to_html_mock.call_count == 1
+    assert len(html_list) == THREAD_COUNT
+    assert len(set(html_list)) == 1
+    assert not single_flight._key_lock_dict
+
+
+def _try_file_lock(cache):
+    lock_path = single_flight._get_lock_path(cache, 'html', 'key')
+    with single_flight.file_lock(lock_path, 0.1) as is_locked:
+        sys.exit(0 if is_locked else 1)
+
+
+def test_lock_is_held_between_processes(upstream):
+    cache = webapp.config.Config.CACHE_D
+    ctx = multiprocessing.get_context('fork')
+    with single_flight.lock(cache, 'html', 'key'):
+        process = ctx.Process(target=_try_file_lock, args=(cache,))
+        process.start()
+        process.join()
+        assert process.exitcode == 1
+    process = ctx.Process(target=_try_file_lock, args=(cache,))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+
+def test_lock_times_out(upstream):
+    cache = webapp.config.Config.CACHE_D
+    entered_list = []
+
+    def lock_in_thread():
+        with single_flight.lock(cache, 'html', 'key'):
+            entered_list.append(True)
+
+    with patch('webapp.config.Config.SINGLE_FLIGHT_TIMEOUT', 0.1):
+        with single_flight.lock(cache, 'html', 'key'):
+            thread = threading.Thread(target=lock_in_thread)
+            thread.start()
+            thread.join()
+            assert entered_list == [True]
+
+
+def test_lock_file_is_kept(upstream):
+    cache = webapp.config.Config.CACHE_D
+    lock_path = single_flight._get_lock_path(cache, 'html', 'key')
+    with single_flight.lock(cache, 'html', 'key'):
+        inode = lock_path.stat().st_ino
+    # A process that waited on the file holds the same lock as one that opens it now
+    assert lock_path.stat().st_ino == inode
+
+
+def test_lock_without_cache_directory(tmpdir):
+    cache = str(tmpdir / 'missing')
+    with single_flight.lock(cache, 'html', 'key'):
+        pass
+    assert not (tmpdir / 'missing').exists()
@@ -1,11 +1,16 @@
 """Unit tests for the `webapp.utils` module."""
 
+import http.server
 import tempfile
+import threading
 import pathlib
 from unittest.mock import patch
 import pytest
+import webapp.cache_key
+import webapp.cache_layout
+import webapp.utils
 from webapp.utils import download_eml_to_cache, get_eml
-from webapp.markdown_cache import safe_filename
+from webapp.cache_key import safe_filename
 
 
 class DummyResponse:
@@ -15,6 +20,7 @@ class DummyResponse:
     - stores raw `content` bytes
     - an `ok` flag indicating success
     - a `reason` string for error messages
+    - a `status_code` matching the `ok` flag
 
     The `raise_for_status` method raises an Exception when `ok` is False so
     tests that expect error behavior can exercise the same code paths.
@@ -24,6 +30,7 @@ class DummyResponse:
         self.content = content
         self.ok = ok
         self.reason = reason or "Error"
+        self.status_code = 200 if ok else 500
 
     def raise_for_status(self):
         """Raise an Exception if the response indicates failure.
@@ -56,7 +63,7 @@ def test_temp_cache_dir():
         yield tmpdir
 
 
-@patch("webapp.utils.requests.get")
+@patch("webapp.utils.requests.Session.get")
 def test_download_eml_to_cache_success(mock_get, temp_cache_dir):
     """Verify that a successful download writes the EML to the cache.
 
@@ -69,13 +76,14 @@ def test_download_eml_to_cache_success(mock_get, temp_cache_dir):
     mock_get.return_value = DummyResponse(eml_content, ok=True)
 
     result_path = download_eml_to_cache(pid, pasta_url, cache)
-    expected_path = pathlib.Path(cache, f"{safe_filename(pid)}.eml.xml")
+    pid_key = webapp.cache_key.get_pid_key(pid)
+    expected_path = webapp.cache_layout.get_path(cache, pid_key, f"{pid_key}.eml.xml")
     assert result_path == str(expected_path)
     assert expected_path.is_file()
     assert expected_path.read_bytes() == eml_content
 
 
-@patch("webapp.utils.requests.get")
+@patch("webapp.utils.requests.Session.get")
 def test_download_eml_to_cache_http_error(mock_get, temp_cache_dir):
     """Test that an HTTP error during EML download raises an exception."""
     pid = "edi.521.1"
@@ -86,6 +94,15 @@ def test_download_eml_to_cache_http_error(mock_get, temp_cache_dir):
         download_eml_to_cache(pid, pasta_url, cache)
 
 
+@patch("webapp.utils.requests.Session.get")
+def test_download_eml_rejects_empty_document(mock_get, temp_cache_dir):
+    """Test that an empty EML document is not cached."""
+    mock_get.return_value = DummyResponse(b"", ok=True)
+    with pytest.raises(ValueError):
+        webapp.utils.download_eml("edi.521.1", "https://fake-pasta-url.org", temp_cache_dir)
+    assert not webapp.cache_key.get_eml_path("edi.521.1", temp_cache_dir).exists()
+
+
 @patch("webapp.config.Config.PASTA_D", "https://fake-pasta-url.org")
 @patch("webapp.config.Config.CACHE_D", None)
 def test_get_eml_cache_hit(temp_cache_dir):
@@ -103,7 +120,7 @@ def test_get_eml_cache_hit(temp_cache_dir):
 
 @patch("webapp.config.Config.PASTA_D", "https://fake-pasta-url.org")
 @patch("webapp.config.Config.CACHE_D", None)
-@patch("webapp.utils.download_eml_to_cache")
+@patch("webapp.utils.download_eml")
 def test_get_eml_cache_miss(mock_download, temp_cache_dir):
     """Test that get_eml downloads EML when not cached and returns its content."""
     pid = "edi.521.1"
@@ -138,3 +155,67 @@ def test_eml_url_construction(monkeypatch):
         constructed_urls.clear()
         download_eml_to_cache(pid, pasta_url, cache)
         assert constructed_urls[0] == expected_url
+
+
+class FakePastaHandler(http.server.BaseHTTPRequestHandler):
+    """Serve a fixed body over keep-alive connections. The first `fail_count` requests
+    get a 503 response."""
+
+    protocol_version = "HTTP/1.1"
+    fail_count = 0
+
+    def do_GET(self):
+        """Respond with 503 while there are failures left, else with the body."""
+        server = self.server
+        if server.fail_count > 0:
+            server.fail_count -= 1
+            status, body = 503, b"unavailable"
+        else:
+            status, body = 200, b"<eml/>"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keep the test output quiet."""
+
+
+@pytest.fixture(name="fake_pasta")
+def fixture_fake_pasta():
+    """Run a local HTTP server and yield it. The pooled connections to it are closed
+    when the test completes."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakePastaHandler)
+    server.fail_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with patch("webapp.config.Config.HTTP_RETRY_BACKOFF", 0):
+        yield server
+    webapp.utils.close_http_pools()
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_wrapper_reuses_connections(fake_pasta):
+    """Test that repeated requests to the same server share a keep-alive connection."""
+    server = f"http://127.0.0.1:{fake_pasta.server_address[1]}"
+    for i in range(3):
+        assert webapp.utils.requests_wrapper(f"{server}/package/{i}") == b"<eml/>"
+    assert webapp.utils.get_http_pool_stats()[server] == {
+        "requests": 3,
+        "connections": 1,
+        "reused": 2,
+    }
+
+
+def test_requests_wrapper_retries_server_errors(fake_pasta):
+    """Test that 5xx responses are retried, and that the last one is raised as an error
+    when the retries run out."""
+    server = f"http://127.0.0.1:{fake_pasta.server_address[1]}"
+    fake_pasta.fail_count = 2
+    assert webapp.utils.requests_wrapper(f"{server}/package/1") == b"<eml/>"
+    fake_pasta.fail_count = 3
+    with patch("webapp.config.Config.HTTP_MAX_RETRIES", 1):
+        webapp.utils.close_http_pools()
+        with pytest.raises(Exception):
+            webapp.utils.requests_wrapper(f"{server}/package/2")
+    assert fake_pasta.fail_count == 1
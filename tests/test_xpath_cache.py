@@ -0,0 +1,48 @@
+"""Test the xpath_cache.py module
+"""
+from unittest.mock import patch
+
+import lxml.etree
+import pytest
+
+import webapp.multi_helpers as multi_helpers
+import webapp.xpath_cache
+
+
+def test_compiled_xpath_is_reused():
+    cache = webapp.xpath_cache.XPathCache(10)
+    root_el = lxml.etree.fromstring('<a><b>1</b><b>2</b></a>')
+    assert cache.xpath(root_el, '//b/text()') == root_el.xpath('//b/text()')
+    assert cache.get('//b/text()') is cache.get('//b/text()')
+    assert cache.get_stats() == {'count': 1, 'max_size': 10, 'hits': 2, 'misses': 1}
+
+
+def test_cache_is_bounded():
+    cache = webapp.xpath_cache.XPathCache(2)
+    first_xpath = cache.get('//a')
+    cache.get('//b')
+    cache.get('//a')
+    cache.get('//c')
+    assert cache.get_stats()['count'] == 2
+    # '//b' was least recently used
+    assert cache.get('//a') is first_xpath
+    assert cache.get_stats()['misses'] == 3
+
+
+def test_compile_errors_are_cached():
+    cache = webapp.xpath_cache.XPathCache(10)
+    with patch('lxml.etree.XPath', wraps=lxml.etree.XPath) as xpath_mock:
+        for _ in range(3):
+            with pytest.raises(lxml.etree.XPathSyntaxError):
+                cache.get('//a[')
+            assert cache.get_or_none('//a[') is None
+        assert xpath_mock.call_count == 1
+
+
+def test_invalid_multi_query_fails_once(complete_eml, caplog):
+    pids = [f'edi.{i}.1' for i in range(5)]
+    webapp.xpath_cache.CACHE.clear()
+    with patch("webapp.multi_helpers.get_eml_tree", lambda pid, env: complete_eml.getroot()):
+        results = multi_helpers.build_multi_results(pids, ['//funding', '//[x'], 'development')
+    assert [len(v) for v in results.values()] == [1] * 5
+    assert caplog.text.count('Invalid XPath expression') == 1
@@ -0,0 +1,58 @@
+"""Test the xslt.py module
+"""
+import threading
+
+import lxml.etree
+
+import webapp.xslt
+
+# language=xsl
+STRIP_ATTRIBUTES_XSL = """\
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <xsl:template match="@*|node()">
+    <xsl:copy>
+      <xsl:apply-templates select="@*|node()"/>
+    </xsl:copy>
+  </xsl:template>
+  <xsl:template match="@*[local-name() != 'href']"/>
+</xsl:stylesheet>
+"""
+
+# language=xsl
+IDENTITY_XSL = """\
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <xsl:template match="@*|node()">
+    <xsl:copy>
+      <xsl:apply-templates select="@*|node()"/>
+    </xsl:copy>
+  </xsl:template>
+</xsl:stylesheet>
+"""
+
+
+def test_transform_is_compiled_once_per_thread():
+    registry = webapp.xslt.XsltRegistry()
+    registry.register('strip', xsl_str=STRIP_ATTRIBUTES_XSL)
+    assert registry.get('strip') is registry.get('strip')
+
+    other_list = []
+    thread = threading.Thread(target=lambda: other_list.append(registry.get('strip')))
+    thread.start()
+    thread.join()
+    assert other_list[0] is not registry.get('strip')
+
+
+def test_reregister_replaces_compiled_transform():
+    registry = webapp.xslt.XsltRegistry()
+    registry.register('x', xsl_str=STRIP_ATTRIBUTES_XSL)
+    first_func = registry.get('x')
+    registry.register('x', xsl_str=IDENTITY_XSL)
+    assert registry.get('x') is not first_func
+
+
+def test_registered_transform_output():
+    registry = webapp.xslt.XsltRegistry()
+    registry.register('strip', xsl_str=STRIP_ATTRIBUTES_XSL)
+    html_el = lxml.etree.HTML('<p class="a"><a href="#x" id="y">link</a></p>')
+    clean_el = registry.get('strip')(html_el)
+    assert b'<p><a href="#x">link</a></p>' in lxml.etree.tostring(clean_el)
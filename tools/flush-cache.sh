@@ -1,3 +1,8 @@
 #!/usr/bin/env bash
 
-rm -v cache/**/*
+# Cache file suffixes, as in webapp.cache_layout.CACHE_FILE_SUFFIX_TUPLE
+find cache -type f \( \
+  -name '*.html' -o -name '*.html.gz' \
+  -o -name '*.eml.xml' -o -name '*.eml.xml.gz' \
+  -o -name '*.eml.sha256' \
+  \) -print -delete
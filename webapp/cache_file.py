@@ -0,0 +1,157 @@
+"""Reading and writing of cache files shared between worker processes
+
+Cache files are written to a temporary file in the same directory, which is synced to
+disk and then renamed over the destination. The rename is atomic, so a reader sees
+either the previous file, or the complete new one, never a partial write.
+
+Files written before this was in place, or damaged by a crash or a full disk, are
+checked when read. Invalid files are deleted, so that the entry is fetched or rendered
+again.
+"""
+import os
+import pathlib
+import re
+import tempfile
+import time
+from typing import BinaryIO, Callable
+
+import daiquiri
+import lxml.etree
+
+log = daiquiri.getLogger(__name__)
+
+TEMP_SUFFIX = '.tmp'
+# Access times are refreshed at most this often, in seconds
+ATIME_RESOLUTION_SEC = 60 * 60
+
+# mkstemp() creates files that only the owner can read. Cache files get the same
+# permissions as files created with open().
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+def write(path: pathlib.Path, data: bytes):
+    """Atomically replace the file at path with data"""
+    path = pathlib.Path(path)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix=TEMP_SUFFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            os.fchmod(f.fileno(), FILE_MODE)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        pathlib.Path(temp_path).unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+
+
+def write_text(path: pathlib.Path, text_str: str):
+    write(path, text_str.encode('utf-8'))
+
+
+def read(path: pathlib.Path, is_valid: Callable[[bytes], bool]) -> bytes | None:
+    """Return the contents of a cache file, or None if there is no valid file at path.
+    Invalid files are deleted."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+            atime = os.fstat(f.fileno()).st_atime
+    except FileNotFoundError:
+        return None
+    if is_valid(data):
+        _touch(path, atime)
+        return data
+    log.warning(f'Discarding invalid cache file. path="{path}" size={len(data)}')
+    discard(path)
+    return None
+
+
+def open_file(path: pathlib.Path) -> tuple[BinaryIO, os.stat_result] | None:
+    """Open a cache file to be sent as is, without reading it. Returns the open file and
+    its status, or None if there is no file at path.
+
+    The contents are not checked, so this is only for files that have only ever been
+    written with write().
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    stat_result = os.fstat(f.fileno())
+    _touch(path, stat_result.st_atime)
+    return f, stat_result
+
+
+def stat_file(path: pathlib.Path) -> os.stat_result | None:
+    """Return the status of a cache file that is to be sent as is by another process, or
+    None if there is no file at path. See open_file()."""
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    _touch(path, stat_result.st_atime)
+    return stat_result
+
+
+def read_text(path: pathlib.Path, is_valid: Callable[[bytes], bool]) -> str | None:
+    data = read(path, is_valid)
+    return None if data is None else data.decode('utf-8')
+
+
+def discard(path: pathlib.Path):
+    pathlib.Path(path).unlink(missing_ok=True)
+
+
+def is_valid_html(data: bytes) -> bool:
+    """Quick check for an empty or truncated HTML fragment. Fragments are written as a
+    single div element. This is checked on every cache hit, so the fragment is not parsed.
+    See is_well_formed_html()."""
+    data = data.strip()
+    return data.startswith(b'<div') and data.endswith(b'</div>')
+
+
+def is_well_formed_html(data: bytes) -> bool:
+    """Full check of an HTML fragment, which is written as well-formed XML. For entries that
+    may have been written before writes were atomic, outside of the request path."""
+    if not is_valid_html(data):
+        return False
+    try:
+        lxml.etree.fromstring(data)
+    except lxml.etree.XMLSyntaxError:
+        return False
+    return True
+
+
+def is_valid_eml(data: bytes) -> bool:
+    """Quick check for an empty or truncated EML document. The document is fully checked
+    when it is parsed."""
+    return data.rstrip().endswith(b'>')
+
+
+def is_valid_digest(data: bytes) -> bool:
+    """SHA-256 hex digest"""
+    return re.fullmatch(rb'[0-9a-f]{64}', data) is not None
+
+
+def _touch(path: pathlib.Path, atime: float):
+    """Record that a cache file was used, by refreshing its access time. The access time is
+    what cache eviction goes by, and it is not updated by reads on all file systems."""
+    now = time.time()
+    if atime > now - ATIME_RESOLUTION_SEC:
+        return
+    try:
+        os.utime(path, (now, os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+
+def _fsync_dir(dir_path: pathlib.Path):
+    """Make the rename durable"""
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,177 @@
+"""Cache keys for data packages and XPath expressions
+
+The cache file names for a data package are derived from SHA-256 hashes of the pid and
+the XPath, after normalizing both, so that names never collide, and spellings that are
+equivalent share an entry:
+
+    <cache>/<aa>/<bb>/<pid key>.eml.xml
+    <cache>/<aa>/<bb>/<pid key>.eml.sha256
+    <cache>/<aa>/<bb>/<html key>-<pid key>.html
+
+The HTML key is the hash of the XPath and the renderer version and settings (see
+webapp.eml_text_type.get_renderer_id()), so that HTML from an earlier renderer is not
+served after a change to the rendering, under an ETag that claims the new renderer.
+
+Pids are normalized by stripping surrounding whitespace. XPaths that are simple location
+paths, i.e., steps with element names, "*", "@name", "text()", "node()" or "." and
+numeric predicates, are rewritten to a canonical form:
+
+    - Whitespace between tokens is removed
+    - "child::" is dropped and "attribute::" is written as "@"
+    - "self::node()" and "." steps that are followed by "/" are dropped
+    - A leading "/*", which selects the root element, is dropped, as the XPaths are
+      evaluated with the root element as the context node
+
+So "dataset/abstract", "./dataset / abstract" and "/*/child::dataset/abstract" share an
+entry. Only rewrites that select the same nodes are made, so "//dataset/abstract", which
+also selects dataset elements below the root element, keeps an entry of its own. Other
+XPaths are only stripped of surrounding whitespace.
+
+Before these keys, the file names were the pid and XPath with all characters other than
+letters and digits replaced with "_", which could collide. While
+Config.CACHE_READ_LEGACY_KEYS is set, entries that are not found under the new names are
+looked up under the legacy names, and copied to the new names when found.
+"""
+import hashlib
+import pathlib
+import re
+
+import webapp.cache_layout
+import webapp.eml_text_type
+
+# Simple location path step, without the separators. Predicates must be positive integers.
+STEP_RE = re.compile(
+    r"""
+    (?:
+        (?P<axis>child|attribute) \s* :: \s*
+        | (?P<at>@) \s*
+    )?
+    (?P<test>
+        \* | [^\W\d][\w.\-]* | (?:text|node) \s* \( \s* \)
+    )
+    (?P<predicates>(?:\s* \[ \s* [1-9]\d* \s* \])*)
+    """,
+    re.VERBOSE,
+)
+SELF_STEP_RE = re.compile(r'\.|self\s*::\s*node\s*\(\s*\)')
+SEP_SPLIT_RE = re.compile(r'\s*(//|/)\s*')
+
+
+def normalize_pid(pid: str) -> str:
+    return pid.strip()
+
+
+def normalize_xpath(text_xpath: str) -> str:
+    """Return the canonical form of an XPath. See the module docstring."""
+    text_xpath = text_xpath.strip()
+    step_list = _parse_simple_path(text_xpath)
+    if step_list is None:
+        return text_xpath
+    # A leading "/*" selects the root element, which is the context node
+    if step_list and step_list[0] == ('/', '*'):
+        step_list[0] = ('', '.')
+    # Drop "." steps that are followed by "/", and a trailing "." that follows "/"
+    i = 0
+    while i < len(step_list):
+        sep, step = step_list[i]
+        if step == '.' and i + 1 < len(step_list) and step_list[i + 1][0] == '/':
+            step_list[i + 1] = (sep, step_list[i + 1][1])
+            del step_list[i]
+        elif step == '.' and i == len(step_list) - 1 and i and sep == '/':
+            del step_list[i]
+        else:
+            i += 1
+    return ''.join(sep + step for sep, step in step_list)
+
+
+def get_pid_key(pid: str) -> str:
+    return _get_hash(f'pid\n{normalize_pid(pid)}')
+
+
+def get_xpath_key(text_xpath: str) -> str:
+    return _get_hash(f'xpath\n{normalize_xpath(text_xpath)}')
+
+
+def get_html_key(text_xpath: str) -> str:
+    renderer_id = webapp.eml_text_type.get_renderer_id()
+    return _get_hash(f'html\n{renderer_id}\n{normalize_xpath(text_xpath)}')
+
+
+def get_eml_path(pid: str, cache: str) -> pathlib.Path:
+    """Return the cache file path for the EML document of a data package"""
+    pid_key = get_pid_key(pid)
+    return webapp.cache_layout.get_path(cache, pid_key, f'{pid_key}.eml.xml')
+
+
+def get_eml_digest_path(pid: str, cache: str) -> pathlib.Path:
+    """Return the cache file path for the digest of the EML document of a data package"""
+    pid_key = get_pid_key(pid)
+    return webapp.cache_layout.get_path(cache, pid_key, f'{pid_key}.eml.sha256')
+
+
+def get_html_path(pid: str, text_xpath: str, cache: str) -> pathlib.Path:
+    """Return the cache file path for the HTML of an element in a data package"""
+    pid_key = get_pid_key(pid)
+    return webapp.cache_layout.get_path(
+        cache, pid_key, f'{get_html_key(text_xpath)}-{pid_key}.html'
+    )
+
+
+def get_legacy_eml_path(pid: str, cache: str) -> pathlib.Path:
+    """Return the cache file path that was used for the EML document of a data package
+    before the hashed keys"""
+    safe_pid = safe_filename(normalize_pid(pid))
+    return webapp.cache_layout.get_path(cache, safe_pid, f'{safe_pid}.eml.xml')
+
+
+def get_legacy_html_path(pid: str, text_xpath: str, cache: str) -> pathlib.Path:
+    """Return the cache file path that was used for the HTML of an element in a data
+    package before the hashed keys"""
+    safe_pid = safe_filename(normalize_pid(pid))
+    return webapp.cache_layout.get_path(
+        cache, safe_pid, f'{safe_filename(text_xpath)}-{safe_pid}.html'
+    )
+
+
+def safe_filename(text: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9]', '_', text)
+
+
+def _get_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _parse_simple_path(text_xpath: str) -> list[tuple[str, str]] | None:
+    """Split a simple location path into a list of (separator, canonical step). The
+    separator of the first step is "" for relative paths. Returns None if the XPath is
+    not a simple location path."""
+    token_list = SEP_SPLIT_RE.split(text_xpath)
+    # token_list alternates steps and separators, starting and ending with a step
+    sep_list = [''] + token_list[1::2]
+    step_list = []
+    for i, (sep, step) in enumerate(zip(sep_list, token_list[::2])):
+        if step == '':
+            # Only an absolute path can start with an empty step, before its separator
+            if i == 0 and len(token_list) > 1:
+                continue
+            return None
+        canonical_step = _get_canonical_step(step)
+        if canonical_step is None:
+            return None
+        step_list.append((sep, canonical_step))
+    return step_list
+
+
+def _get_canonical_step(step: str) -> str | None:
+    if SELF_STEP_RE.fullmatch(step):
+        return '.'
+    m = STEP_RE.fullmatch(step)
+    if m is None:
+        return None
+    test = re.sub(r'\s+', '', m.group('test'))
+    predicates = re.sub(r'\s+', '', m.group('predicates'))
+    is_attribute = m.group('axis') == 'attribute' or m.group('at')
+    if is_attribute and test in ('text()', 'node()'):
+        # Valid, but selects nothing. Keep as written.
+        return None
+    return f'{"@" if is_attribute else ""}{test}{predicates}'
@@ -0,0 +1,151 @@
+"""Sharded layout of the cache directory
+
+Cache entries are spread over a two level directory hierarchy, so that no directory
+holds more than a small fraction of the entries:
+
+    <cache>/<aa>/<bb>/<file name>
+
+where aabb are the first hex digits of the SHA-1 of a shard key. The per package entries
+(EML and HTML) use the pid key (see webapp.cache_key) as the shard key, so all the
+entries for a package are in the same directory. Content addressed renders are sharded
+the same way below <cache>/render.
+
+Entries written before the sharded layout are found directly in the <cache> (or
+<cache>/render) directory. Readers fall back to these legacy paths, and migrate() moves
+them into the shards while the service is running.
+"""
+import hashlib
+import os
+import pathlib
+
+import daiquiri
+
+import webapp.cache_file
+
+log = daiquiri.getLogger(__name__)
+
+SHARD_LEVEL_COUNT = 2
+SHARD_WIDTH = 2
+
+CACHE_FILE_SUFFIX_TUPLE = ('.eml.xml', '.eml.xml.gz', '.eml.sha256', '.html', '.html.gz')
+
+
+def get_path(cache: str, shard_key: str, file_name: str) -> pathlib.Path:
+    """Return the sharded path of a cache entry"""
+    hex_str = hashlib.sha1(shard_key.encode('utf-8')).hexdigest()
+    shard_list = [
+        hex_str[i * SHARD_WIDTH : (i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVEL_COUNT)
+    ]
+    return pathlib.Path(cache, *shard_list, file_name)
+
+
+def get_legacy_path(path: pathlib.Path) -> pathlib.Path:
+    """Return the flat layout path of a sharded cache entry"""
+    return path.parents[SHARD_LEVEL_COUNT] / path.name
+
+
+def read(path: pathlib.Path, is_valid) -> bytes | None:
+    """Return the contents of a cache entry, looking first in the sharded layout and
+    then in the legacy layout"""
+    data = webapp.cache_file.read(path, is_valid)
+    if data is None:
+        data = webapp.cache_file.read(get_legacy_path(path), is_valid)
+    return data
+
+
+def read_text(path: pathlib.Path, is_valid) -> str | None:
+    data = read(path, is_valid)
+    return None if data is None else data.decode('utf-8')
+
+
+def discard(path: pathlib.Path):
+    """Remove a cache entry from both layouts"""
+    webapp.cache_file.discard(path)
+    webapp.cache_file.discard(get_legacy_path(path))
+
+
+def adopt(legacy_path: pathlib.Path, path: pathlib.Path, is_valid) -> bytes | None:
+    """Return the contents of a cache entry stored under a name that is no longer used,
+    after copying it to the current name. The entry under the old name is left in place
+    for processes that still use it, and is eventually evicted."""
+    data = read(legacy_path, is_valid)
+    if data is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        webapp.cache_file.write(path, data)
+    return data
+
+
+def get_shard_key(file_name: str) -> str:
+    """Return the shard key of a cache file.
+
+    EML files are named <pid key>.eml.xml, EML digests <pid key>.eml.sha256, HTML files
+    <html key>-<pid key>.html and renders <hash>.html, and compressed files have an
+    additional .gz suffix. The keys are hex digests, or, for
+    entries written before the keys were hashed, the pid and XPath made safe for file
+    names. Neither contains "-".
+    """
+    for suffix in CACHE_FILE_SUFFIX_TUPLE:
+        if file_name.endswith(suffix):
+            return file_name[: -len(suffix)].rsplit('-', 1)[-1]
+    raise ValueError(f'Not a cache file: "{file_name}"')
+
+
+def iter_legacy_paths(dir_path: pathlib.Path):
+    """Yield the cache entries in the legacy layout directly in a directory. Temporary
+    files are skipped."""
+    try:
+        dir_entry_iter = os.scandir(dir_path)
+    except FileNotFoundError:
+        return
+    with dir_entry_iter:
+        for dir_entry in dir_entry_iter:
+            if (
+                not dir_entry.name.startswith('.')
+                and dir_entry.name.endswith(CACHE_FILE_SUFFIX_TUPLE)
+                and dir_entry.is_file(follow_symlinks=False)
+            ):
+                yield pathlib.Path(dir_entry.path)
+
+
+def migrate_path(legacy_path: pathlib.Path) -> bool:
+    """Move a cache entry from the legacy layout into its shard. Returns False if the
+    entry was already in the shard, in which case the legacy copy is removed, as the
+    sharded one is at least as recent. HTML entries that are not well-formed are removed
+    instead of moved, as they may have been written before writes were atomic."""
+    path = get_path(legacy_path.parent, get_shard_key(legacy_path.name), legacy_path.name)
+    if path.exists() or not _is_well_formed_entry(legacy_path):
+        webapp.cache_file.discard(legacy_path)
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.rename(legacy_path, path)
+    except FileNotFoundError:
+        # Removed or moved by another process
+        return False
+    return True
+
+
+def migrate(dir_path: pathlib.Path, batch_size: int):
+    """Move the cache entries in the legacy layout in a directory into the shards.
+
+    Yields the number of entries moved after each batch, so that the caller can pause
+    between batches. Readers that race with a move may see a cache miss, which causes
+    the entry to be rebuilt, but never an invalid entry.
+    """
+    moved_count = 0
+    for i, legacy_path in enumerate(iter_legacy_paths(dir_path), start=1):
+        moved_count += migrate_path(legacy_path)
+        if not i % batch_size:
+            yield moved_count
+            moved_count = 0
+    yield moved_count
+
+
+def _is_well_formed_entry(path: pathlib.Path) -> bool:
+    if not path.name.endswith('.html'):
+        return True
+    try:
+        return webapp.cache_file.is_well_formed_html(path.read_bytes())
+    except FileNotFoundError:
+        # Removed or moved by another process
+        return True
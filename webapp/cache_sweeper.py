@@ -0,0 +1,181 @@
+"""Eviction of cache entries, to keep each cache directory within its limits
+
+A sweep removes the entries that have not been used for CACHE_MAX_AGE_DAYS, and, if the
+directory holds more than CACHE_MAX_BYTES, the least recently used entries until it is
+below 90% of the budget. Sweeps are run by a background thread every
+CACHE_SWEEP_INTERVAL seconds, or with `flask cache-sweep`.
+
+Notes:
+    - The last use of an entry is the later of its access and modification times. Reads
+      through webapp.cache_file refresh the access time, so this works on file systems
+      mounted with noatime as well.
+    - A sweep does not hold any lock used by requests. It walks the directory twice, first
+      to total the sizes by time of last use, then to remove the entries that were last
+      used before the resulting cutoff, pausing between batches. Memory use does not grow
+      with the number of entries.
+    - Entries are written to temporary files and then renamed into place, so an entry
+      that is being written is never seen as an entry. Temporary files are only removed
+      once they are old enough to have been left behind by an interrupted writer.
+    - Entries used within the last MIN_AGE_SEC are never removed, even if the budget is
+      exceeded.
+    - Only one process sweeps a cache directory at a time, holding a lock on a lock file
+      that is never removed. Other processes skip the sweep.
+"""
+import collections
+import os
+import pathlib
+import threading
+import time
+
+import daiquiri
+
+import webapp.cache_file
+import webapp.cache_layout
+import webapp.config
+import webapp.eml_store
+import webapp.single_flight
+
+log = daiquiri.getLogger(__name__)
+
+SWEEP_LOCK_NAME = 'sweep.lock'
+# Fraction of the budget that a sweep evicts down to, so that a full cache is not swept
+# again for every new entry
+LOW_WATER_RATIO = 0.9
+MIN_AGE_SEC = 10 * 60
+STALE_TEMP_SEC = 60 * 60
+# Resolution of the time of last use when finding the cutoff for the budget
+BUCKET_SEC = 10 * 60
+BATCH_SIZE = 1000
+BATCH_PAUSE_SEC = 0.01
+
+SweepResult = collections.namedtuple(
+    'SweepResult', ['entry_count', 'total_bytes', 'removed_count', 'removed_bytes', 'temp_count']
+)
+
+
+def get_limits(env: str) -> tuple[int | None, float | None]:
+    """Return the byte budget and maximum age in seconds of the cache for env"""
+    config = webapp.config.Config
+    max_bytes, max_age_days = {
+        config.ENV_P: (config.CACHE_MAX_BYTES_P, config.CACHE_MAX_AGE_DAYS_P),
+        config.ENV_S: (config.CACHE_MAX_BYTES_S, config.CACHE_MAX_AGE_DAYS_S),
+        config.ENV_D: (config.CACHE_MAX_BYTES_D, config.CACHE_MAX_AGE_DAYS_D),
+    }[webapp.eml_store.get_env_config(env).env]
+    return max_bytes, None if max_age_days is None else max_age_days * 24 * 60 * 60
+
+
+def sweep(env: str, dry_run: bool = False) -> SweepResult | None:
+    """Enforce the limits on the cache directory for env.
+
+    Returns None if the directory does not exist, or is being swept by another process.
+    With dry_run, nothing is removed, and the result shows what would have been removed.
+    """
+    max_bytes, max_age_sec = get_limits(env)
+    cache_path = pathlib.Path(webapp.eml_store.get_env_config(env).cache)
+    if not cache_path.is_dir():
+        return None
+    lock_path = cache_path / webapp.single_flight.LOCK_DIR_NAME / SWEEP_LOCK_NAME
+    with webapp.single_flight.file_lock(lock_path, timeout=0) as is_locked:
+        if not is_locked:
+            log.info(f'Cache is being swept by another process. cache="{cache_path}"')
+            return None
+        result = _sweep(cache_path, max_bytes, max_age_sec, dry_run)
+    log.info(f'Swept cache. cache="{cache_path}" dry_run={dry_run} result={result}')
+    return result
+
+
+def start(interval_sec: float):
+    """Start a background thread that sweeps all cache directories every interval_sec"""
+    thread = threading.Thread(
+        target=_run, args=(interval_sec,), name='cache-sweeper', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def _run(interval_sec: float):
+    config = webapp.config.Config
+    while True:
+        time.sleep(interval_sec)
+        for env in (config.ENV_P, config.ENV_S, config.ENV_D):
+            try:
+                sweep(env)
+            except Exception:
+                log.exception(f'Cache sweep failed. env="{env}"')
+
+
+def _sweep(
+    cache_path: pathlib.Path, max_bytes: int | None, max_age_sec: float | None, dry_run: bool
+) -> SweepResult:
+    now_ts = time.time()
+    entry_count = 0
+    total_bytes = 0
+    temp_count = 0
+    bucket_bytes = collections.Counter()
+    for path_str, size, use_ts, is_temp in _iter_files(cache_path):
+        if is_temp:
+            if use_ts < now_ts - STALE_TEMP_SEC:
+                temp_count += 1
+                if not dry_run:
+                    webapp.cache_file.discard(path_str)
+            continue
+        entry_count += 1
+        total_bytes += size
+        bucket_bytes[int(use_ts // BUCKET_SEC)] += size
+
+    cutoff_ts = 0.0
+    if max_age_sec is not None:
+        cutoff_ts = now_ts - max_age_sec
+    if max_bytes is not None and total_bytes > max_bytes:
+        cutoff_ts = max(cutoff_ts, _get_size_cutoff(bucket_bytes, max_bytes * LOW_WATER_RATIO))
+    cutoff_ts = min(cutoff_ts, now_ts - MIN_AGE_SEC)
+
+    removed_count = 0
+    removed_bytes = 0
+    if cutoff_ts > 0:
+        for path_str, size, use_ts, is_temp in _iter_files(cache_path):
+            if is_temp or use_ts >= cutoff_ts:
+                continue
+            if not dry_run:
+                webapp.cache_file.discard(path_str)
+            removed_count += 1
+            removed_bytes += size
+    return SweepResult(entry_count, total_bytes, removed_count, removed_bytes, temp_count)
+
+
+def _get_size_cutoff(bucket_bytes: collections.Counter, target_bytes: float) -> float:
+    """Return the time of last use before which entries must be removed to bring the total
+    size down to target_bytes"""
+    kept_bytes = 0
+    for bucket_idx in sorted(bucket_bytes, reverse=True):
+        kept_bytes += bucket_bytes[bucket_idx]
+        if kept_bytes > target_bytes:
+            return (bucket_idx + 1) * BUCKET_SEC
+    return 0.0
+
+
+def _iter_files(cache_path: pathlib.Path):
+    """Yield (path, size, time of last use, is temporary file) for the cache entries and
+    temporary files in a cache directory, in both the sharded and legacy layouts"""
+    file_count = 0
+    for root_str, dir_list, file_list in os.walk(cache_path):
+        if root_str == str(cache_path) and webapp.single_flight.LOCK_DIR_NAME in dir_list:
+            dir_list.remove(webapp.single_flight.LOCK_DIR_NAME)
+        for file_name in file_list:
+            is_temp = file_name.startswith('.') and file_name.endswith(
+                webapp.cache_file.TEMP_SUFFIX
+            )
+            if not is_temp and not file_name.endswith(webapp.cache_layout.CACHE_FILE_SUFFIX_TUPLE):
+                continue
+            path_str = os.path.join(root_str, file_name)
+            try:
+                stat_result = os.stat(path_str)
+            except FileNotFoundError:
+                continue
+            yield path_str, stat_result.st_size, max(
+                stat_result.st_atime, stat_result.st_mtime
+            ), is_temp
+            file_count += 1
+            # Leave the CPU and disk to request threads now and then
+            if not file_count % BATCH_SIZE:
+                time.sleep(BATCH_PAUSE_SEC)
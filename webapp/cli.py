@@ -0,0 +1,214 @@
+"""Flask CLI commands for maintaining the cache
+
+$ flask --app webapp.run <command> --help
+"""
+import pathlib
+import time
+
+import click
+
+import webapp.cache_key
+import webapp.cache_layout
+import webapp.cache_sweeper
+import webapp.config
+import webapp.eml_store
+import webapp.prewarm
+import webapp.render_cache
+
+ENV_OPTION = click.option(
+    '--env',
+    'env_list',
+    multiple=True,
+    help='PASTA environment. Can be repeated. Default is all environments.',
+)
+
+
+def init_app(app):
+    app.cli.add_command(render_cache_report)
+    app.cli.add_command(cache_migrate)
+    app.cli.add_command(cache_sweep)
+    app.cli.add_command(cache_path)
+    app.cli.add_command(cache_prewarm)
+
+
+def _get_env_list(env_list: tuple) -> list[str]:
+    config = webapp.config.Config
+    return list(env_list or (config.ENV_P, config.ENV_S, config.ENV_D))
+
+
+@click.command('render-cache-report')
+@ENV_OPTION
+def render_cache_report(env_list):
+    """Show how much the content addressed render cache deduplicates the HTML cache."""
+    for env in _get_env_list(env_list):
+        _, cache, env = webapp.eml_store.get_env_config(env)
+        report_dict = webapp.render_cache.get_report(cache)
+        html_count = report_dict['html_count']
+        distinct_count = report_dict['distinct_count']
+        click.echo(f'{env}: {cache}')
+        click.echo(
+            f'  HTML cache files:  {html_count:>8} {report_dict["html_bytes"]:>14,} bytes'
+        )
+        click.echo(
+            f'  Distinct content:  {distinct_count:>8} {report_dict["distinct_bytes"]:>14,} bytes'
+        )
+        click.echo(
+            f'  Content renders:   {report_dict["render_count"]:>8} '
+            f'{report_dict["render_bytes"]:>14,} bytes'
+        )
+        ratio = html_count / distinct_count if distinct_count else 1
+        click.echo(
+            f'  Renders saved:     {report_dict["saved_renders"]:>8} '
+            f'({ratio:.2f} HTML cache files per render)'
+        )
+
+
+@click.command('cache-migrate')
+@ENV_OPTION
+@click.option('--batch-size', default=1000, show_default=True, help='Entries moved per batch.')
+@click.option(
+    '--pause', default=0.1, show_default=True, help='Seconds to pause between batches.'
+)
+def cache_migrate(env_list, batch_size, pause):
+    """Move cache entries from the legacy flat layout into the sharded layout.
+
+    Safe to run while the service is running, and to interrupt and run again.
+    """
+    for env in _get_env_list(env_list):
+        _, cache, env = webapp.eml_store.get_env_config(env)
+        for dir_path in (
+            pathlib.Path(cache),
+            pathlib.Path(cache, webapp.render_cache.RENDER_DIR_NAME),
+        ):
+            total_count = 0
+            for moved_count in webapp.cache_layout.migrate(dir_path, batch_size):
+                total_count += moved_count
+                click.echo(f'{env}: {dir_path}: {total_count} entries moved')
+                time.sleep(pause)
+
+
+@click.command('cache-sweep')
+@ENV_OPTION
+@click.option('--dry-run', is_flag=True, help='Show what would be removed, without removing.')
+def cache_sweep(env_list, dry_run):
+    """Remove cache entries to bring the cache within CACHE_MAX_BYTES and
+    CACHE_MAX_AGE_DAYS."""
+    for env in _get_env_list(env_list):
+        env = webapp.eml_store.get_env_config(env).env
+        result = webapp.cache_sweeper.sweep(env, dry_run=dry_run)
+        if result is None:
+            click.echo(f'{env}: skipped, cache is missing or being swept by another process')
+            continue
+        click.echo(
+            f'{env}: {result.entry_count} entries, {result.total_bytes:,} bytes. '
+            f'Removed {result.removed_count} entries, {result.removed_bytes:,} bytes, '
+            f'and {result.temp_count} stale temporary files'
+            f'{" (dry run)" if dry_run else ""}'
+        )
+
+
+@click.command('cache-path')
+@ENV_OPTION
+@click.argument('pid')
+@click.argument('text_xpath', required=False)
+def cache_path(env_list, pid, text_xpath):
+    """Show the cache file path of the EML document for PID, or, with TEXT_XPATH, of the
+    HTML for an element in it."""
+    for env in _get_env_list(env_list):
+        _, cache, env = webapp.eml_store.get_env_config(env)
+        if text_xpath is None:
+            path = webapp.cache_key.get_eml_path(pid, cache)
+        else:
+            path = webapp.cache_key.get_html_path(pid, text_xpath, cache)
+        click.echo(f'{env}: {path}')
+
+
+@click.command('cache-prewarm')
+@click.option(
+    '--env',
+    default=lambda: webapp.config.Config.DEFAULT_ENV,
+    show_default='DEFAULT_ENV',
+    help='PASTA environment.',
+)
+@click.argument('pid_list', nargs=-1)
+@click.option(
+    '--pid-file', type=click.File('r'), help='File with one PID per line, or - for stdin.'
+)
+@click.option(
+    '--scope',
+    'scope_prefix',
+    help='Add the data packages in the PASTA scopes that start with this prefix.',
+)
+@click.option(
+    '--all-revisions', is_flag=True, help='With --scope, add all revisions, not just the newest.'
+)
+@click.option(
+    '--xpath',
+    'xpath_list',
+    multiple=True,
+    help='XPath of a TextType element. Can be repeated. Default is the common elements.',
+)
+@click.option(
+    '--fetch-concurrency',
+    type=int,
+    help='Downloads from PASTA at a time. Default is MULTI_FETCH_CONCURRENCY for the env.',
+)
+@click.option('--processes', type=int, help='Rendering processes. Default is one per CPU.')
+def cache_prewarm(
+    env,
+    pid_list,
+    pid_file,
+    scope_prefix,
+    all_revisions,
+    xpath_list,
+    fetch_concurrency,
+    processes,
+):
+    """Download and render the elements of data packages into the cache, before they are
+    requested.
+
+    Elements that are already in the cache are skipped, so an interrupted run can be resumed
+    by running it again.
+    """
+    if not webapp.config.Config.USE_CACHE:
+        raise click.ClickException('USE_CACHE is not set, so there is no cache to prewarm')
+    _, _, env = webapp.eml_store.get_env_config(env)
+    pid_list = list(pid_list)
+    if pid_file is not None:
+        pid_list.extend(line.strip() for line in pid_file if line.strip())
+    if scope_prefix is not None:
+        scope_pid_list = webapp.prewarm.resolve_scope(
+            scope_prefix, env, all_revisions, fetch_concurrency
+        )
+        click.echo(f'{env}: {len(scope_pid_list)} data packages in scopes "{scope_prefix}*"')
+        pid_list.extend(scope_pid_list)
+    if not pid_list:
+        raise click.UsageError('No PIDs. Pass PIDs, --pid-file or --scope.')
+    pid_list = list(dict.fromkeys(webapp.cache_key.normalize_pid(pid) for pid in pid_list))
+    xpath_list = list(xpath_list or webapp.prewarm.DEFAULT_XPATH_TUPLE)
+
+    start_ts = time.monotonic()
+    with click.progressbar(length=len(pid_list), label=f'{env}: prewarming') as bar:
+        counter = webapp.prewarm.prewarm(
+            pid_list,
+            xpath_list,
+            env,
+            fetch_concurrency,
+            processes,
+            on_done=lambda pid, pid_counter: bar.update(1),
+        )
+    elapsed_sec = max(time.monotonic() - start_ts, 1e-6)
+    package_count = len(pid_list)
+    rendered_count = counter[webapp.prewarm.RENDERED]
+    click.echo(
+        f'{env}: {package_count} data packages in {elapsed_sec:.1f} s '
+        f'({package_count / elapsed_sec:.1f} packages/s)'
+    )
+    click.echo(
+        f'  Rendered:          {rendered_count:>8} '
+        f'({rendered_count / elapsed_sec:.1f} elements/s)'
+    )
+    click.echo(f'  Already cached:    {counter[webapp.prewarm.CACHED]:>8}')
+    click.echo(f'  Not found:         {counter[webapp.prewarm.NOT_FOUND]:>8}')
+    click.echo(f'  Render errors:     {counter[webapp.prewarm.ERROR]:>8}')
+    click.echo(f'  Download errors:   {counter[webapp.prewarm.FETCH_ERROR]:>8} data packages')
@@ -0,0 +1,152 @@
+"""Optional gzip storage of cache files, and compression of responses
+
+With CACHE_COMPRESSION = 'gzip', the EML documents and HTML fragments in the cache
+directories are stored gzip compressed, as <name>.gz next to where the uncompressed file
+would be. Files are read in either form, so the setting can be changed at any time, and
+the files written before the change are still used.
+
+Responses are compressed when the client accepts gzip and the body is at least
+RESPONSE_COMPRESS_MIN_BYTES. HTML that is stored compressed is sent as stored, without
+being decompressed and compressed again. Responses that can be compressed carry
+Vary: Accept-Encoding. See webapp.http_cache for the ETags of compressed responses.
+
+Notes:
+    - Files are compressed with mtime 0 in the gzip header, so that the same content
+      always compresses to the same bytes.
+    - Compressed files that are sent as stored are only checked for a gzip header. They
+      are written atomically (see webapp.cache_file), so are not truncated by a crash.
+      Files that fail to decompress when they are read for their content are discarded.
+"""
+import gzip
+import pathlib
+import zlib
+
+import daiquiri
+import flask
+
+import webapp.cache_file
+import webapp.cache_layout
+import webapp.config
+
+log = daiquiri.getLogger(__name__)
+
+GZIP = 'gzip'
+GZIP_SUFFIX = '.gz'
+GZIP_MAGIC = b'\x1f\x8b'
+# Size of an empty gzip member
+GZIP_MIN_SIZE = 20
+
+
+def get_gzip_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(path.name + GZIP_SUFFIX)
+
+
+def compress(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=webapp.config.Config.COMPRESSION_LEVEL, mtime=0)
+
+
+def decode(data: bytes, encoding: str | None) -> bytes:
+    """Return the uncompressed content of data stored with encoding"""
+    return gzip.decompress(data) if encoding == GZIP else data
+
+
+def is_valid_gzip(data: bytes) -> bool:
+    return data[:2] == GZIP_MAGIC and len(data) >= GZIP_MIN_SIZE
+
+
+def read(path: pathlib.Path, is_valid) -> tuple[bytes | None, str | None]:
+    """Return the contents of a cache file as stored, and the encoding, which is "gzip"
+    or None. is_valid checks uncompressed files. The form that is configured is tried
+    first."""
+    if webapp.config.Config.CACHE_COMPRESSION == GZIP:
+        data = webapp.cache_layout.read(get_gzip_path(path), is_valid_gzip)
+        if data is not None:
+            return data, GZIP
+        return webapp.cache_layout.read(path, is_valid), None
+    data = webapp.cache_layout.read(path, is_valid)
+    if data is not None:
+        return data, None
+    data = webapp.cache_layout.read(get_gzip_path(path), is_valid_gzip)
+    return data, None if data is None else GZIP
+
+
+def read_decoded(path: pathlib.Path, is_valid) -> bytes | None:
+    """Return the uncompressed contents of a cache file stored in either form"""
+    data, encoding = read(path, is_valid)
+    if encoding != GZIP:
+        return data
+    try:
+        data = gzip.decompress(data)
+    except (OSError, EOFError, zlib.error) as e:
+        data = None
+        log.warning(f'Cannot decompress cache file. path="{path}" error="{e}"')
+    if data is None or not is_valid(data):
+        webapp.cache_layout.discard(get_gzip_path(path))
+        return webapp.cache_layout.read(path, is_valid)
+    return data
+
+
+def write(path: pathlib.Path, data: bytes) -> tuple[bytes, str | None]:
+    """Store data in a cache file, in the configured form. Returns the data as stored,
+    and the encoding."""
+    if webapp.config.Config.CACHE_COMPRESSION == GZIP:
+        stored_data = compress(data)
+        webapp.cache_file.write(get_gzip_path(path), stored_data)
+        return stored_data, GZIP
+    webapp.cache_file.write(path, data)
+    return data, None
+
+
+def discard(path: pathlib.Path):
+    """Remove a cache file in both forms and both layouts"""
+    webapp.cache_layout.discard(path)
+    webapp.cache_layout.discard(get_gzip_path(path))
+
+
+def get_accepted_encoding() -> str | None:
+    """Return "gzip" if the client of the current request accepts it"""
+    return GZIP if flask.request.accept_encodings[GZIP] else None
+
+
+def make_response(data: bytes, encoding: str | None = None) -> flask.Response:
+    """Return a response for data stored with encoding, in the encoding that the client
+    accepts"""
+    accepted_encoding = get_accepted_encoding()
+    if encoding == GZIP and accepted_encoding != GZIP:
+        data = gzip.decompress(data)
+        encoding = None
+    elif (
+        encoding is None
+        and accepted_encoding == GZIP
+        and len(data) >= webapp.config.Config.RESPONSE_COMPRESS_MIN_BYTES
+    ):
+        data = compress(data)
+        encoding = GZIP
+    response = flask.make_response(data)
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def make_streamed_response(chunk_iter) -> flask.Response:
+    """Return a streamed response, compressed if the client accepts it. Each chunk is
+    flushed through the compressor, so that it reaches the client without waiting for
+    the next one."""
+    if get_accepted_encoding() != GZIP:
+        response = flask.Response(chunk_iter)
+    else:
+        response = flask.Response(_iter_compressed(chunk_iter))
+        response.content_encoding = GZIP
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _iter_compressed(chunk_iter):
+    # wbits 31 selects the gzip format
+    compress_obj = zlib.compressobj(webapp.config.Config.COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunk_iter:
+        data = compress_obj.compress(chunk) + compress_obj.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compress_obj.flush()
@@ -0,0 +1,151 @@
+class Config(object):
+    # Flask app configuration
+
+    # Generate the secret key with ./tools/generate-secret-key.py
+    SECRET_KEY = 'SECRET KEY'
+    DEBUG = False
+
+    # Webapp configuration
+
+    # Set to False to disable using the cache for easier debugging.
+    USE_CACHE = True
+
+    # Set to True to compile the XSLT stylesheets when the app is loaded, instead of on
+    # the first request that needs them. Combine with gunicorn --preload to compile once
+    # in the master process and share the result with all the workers.
+    XSLT_WARM_AT_BOOT = False
+
+    # Maximum total size, in bytes, of the EML documents that are kept in memory by each
+    # worker. Documents that are evicted are read back from the cache directory.
+    EML_MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+
+    # Maximum total approximate size, in bytes, of the parsed EML documents that are kept
+    # in memory by each worker. A parsed document takes several times the size of the EML.
+    EML_TREE_CACHE_BYTES = 256 * 1024 * 1024
+
+    # Maximum number of compiled XPath expressions to keep in each worker
+    XPATH_CACHE_SIZE = 1024
+
+    # Markdown renderer. 'local' renders GitHub Flavored Markdown in process. 'github'
+    # sends the markdown to the GitHub API, and falls back to 'local' if the request fails.
+    MARKDOWN_RENDERER = 'local'
+
+    # Maximum time, in seconds, that a request waits for another request, in this or
+    # another worker, that is already fetching and rendering the same cache entry. After
+    # that, the request does the work itself.
+    SINGLE_FLIGHT_TIMEOUT = 120
+
+    CACHE_P = 'cache location for production'
+    CACHE_S = 'cache location for staging'
+    CACHE_D = 'cache location for development'
+
+    # Disk budget, in bytes, for each cache directory. When a directory holds more, the
+    # least recently used entries are removed until it is below 90% of the budget.
+    # Entries that have not been used for CACHE_MAX_AGE_DAYS are removed regardless of
+    # size. None disables the limit.
+    CACHE_MAX_BYTES_P = None
+    CACHE_MAX_BYTES_S = None
+    CACHE_MAX_BYTES_D = None
+    CACHE_MAX_AGE_DAYS_P = None
+    CACHE_MAX_AGE_DAYS_S = None
+    CACHE_MAX_AGE_DAYS_D = None
+
+    # Seconds between sweeps of the cache directories by a background thread, which
+    # enforces the limits above. 0 disables the thread. Sweeps can also be run with
+    # `flask cache-sweep`.
+    CACHE_SWEEP_INTERVAL = 0
+
+    # Look up cache entries that are not found under their hashed names under the names
+    # used by earlier versions, and copy them to the hashed names. Can be set to False once
+    # the cache directories have been repopulated, or the old entries have been evicted.
+    CACHE_READ_LEGACY_KEYS = True
+
+    # Set to 'gzip' to store the EML documents and HTML fragments in the cache directories
+    # compressed. Files are read in either form, so this can be changed at any time.
+    CACHE_COMPRESSION = None
+
+    # How cached HTML is sent. None reads it into memory. 'sendfile' passes the open cache
+    # file to the WSGI server, which sends it with sendfile(). 'x-accel' returns an
+    # X-Accel-Redirect to the path of the file below CACHE_X_ACCEL_*, for nginx to send.
+    # See webapp/file_response.py and deployment/ridare.nginx.
+    CACHE_FILE_RESPONSE = None
+    CACHE_X_ACCEL_P = '/_ridare_cache/production/'
+    CACHE_X_ACCEL_S = '/_ridare_cache/staging/'
+    CACHE_X_ACCEL_D = '/_ridare_cache/development/'
+
+    PASTA_P = 'https://pasta.lternet.edu/package'
+    PASTA_S = 'https://pasta-s.lternet.edu/package'
+    PASTA_D = 'https://pasta-d.lternet.edu/package'
+
+    # Maximum number of EML documents that a /multi request fetches from each PASTA
+    # environment in parallel. The cap is shared by all the requests handled by a worker.
+    MULTI_FETCH_CONCURRENCY_P = 8
+    MULTI_FETCH_CONCURRENCY_S = 4
+    MULTI_FETCH_CONCURRENCY_D = 4
+
+    # /multi requests for at least this many pids are streamed, one <document> at a time,
+    # instead of being built in memory and sent as a whole.
+    MULTI_STREAM_MIN_PIDS = 20
+
+    # HTTP connections to PASTA. Connections are kept alive and reused, in a pool per PASTA
+    # environment. The pool size should be at least the MULTI_FETCH_CONCURRENCY for the
+    # environment. Requests that fail with a connection error, or with a 5xx status, are
+    # retried up to HTTP_MAX_RETRIES times, with an exponential backoff starting at
+    # HTTP_RETRY_BACKOFF seconds. Timeouts are in seconds.
+    HTTP_POOL_SIZE = 16
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_READ_TIMEOUT = 60
+    HTTP_MAX_RETRIES = 3
+    HTTP_RETRY_BACKOFF = 0.5
+
+    # Cache-Control max-age, in seconds, for the HTML and raw XML responses. A data package
+    # revision never changes, so the responses are also marked immutable. With 0, the
+    # responses are sent with "Cache-Control: no-cache" instead, so that clients revalidate
+    # them with the ETag on each use.
+    RESPONSE_MAX_AGE = 365 * 24 * 60 * 60
+
+    # Responses are gzip compressed for clients that accept it, if the body is at least
+    # this many bytes. HTML that is stored compressed is sent as stored, regardless of size.
+    RESPONSE_COMPRESS_MIN_BYTES = 1024
+
+    # zlib compression level, 1 (fastest) to 9 (smallest), for cache files and responses
+    COMPRESSION_LEVEL = 6
+
+    # Record per stage latencies, cache hits and upstream status codes, and serve them on
+    # /metrics in the Prometheus text format. /metrics should only be reachable by the
+    # Prometheus server. See deployment/ridare.nginx.
+    METRICS_ENABLED = True
+    # Directory in which each worker process writes its metrics, so that /metrics reports
+    # the totals for all workers. Empty it when the service is started. With None, /metrics
+    # only reports the worker that handles the scrape.
+    METRICS_DIR = None
+    # Seconds between writes of the metrics of each worker to METRICS_DIR
+    METRICS_FLUSH_INTERVAL = 5
+
+    # Allow requests from the WHITE_LIST addresses to add ?profile=1 to get a cProfile
+    # summary and the peak memory use of the request, instead of the response
+    PROFILE_ENABLED = True
+    # Number of functions listed in a profile
+    PROFILE_TOP_N = 40
+
+    PORTAL_P = 'https://portal.edirepository.org/nis'
+    PORTAL_S = 'https://portal-s.edirepository.org/nis'
+    PORTAL_D = 'https://portal-d.edirepository.org/nis'
+
+    ENV_P = "production"
+    ENV_S = "staging"
+    ENV_D = "development"
+
+    # PASTA Data Package Manager Server Addresses
+    WHITE_LIST = {
+        '129.24.124.76': PASTA_D,
+        '129.24.240.153': PASTA_S,
+        '129.24.240.146': PASTA_P,
+        '127.0.0.1': PASTA_P,
+    }
+
+    PUBLISHER = "Environmental Data Initiative"
+    DEFAULT_ENV = "production"
+    DEFAULT_STYLE = "ESIP"
+    DEFAULT_ACCEPT = "text/plain"
+    HELP_URL = "https://github.com/PASTAplus/ridare"
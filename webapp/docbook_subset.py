@@ -0,0 +1,248 @@
+"""Render the DocBook subset that is allowed in EML TextType elements to HTML
+
+EML only allows a small subset of DocBook in TextType elements. Running the complete
+docbook.xsl stylesheet tree for each fragment is expensive, so fragments that stay
+within the subset are rendered directly with lxml here.
+
+The output mirrors what docbook-xsl-1.79.2 html/docbook.xsl generates for the subset:
+the same elements and the same text, including the "unwrapping" of paragraphs that
+contain block level elements, and the verbatim layout of literalLayout. Attributes are
+limited to the class names, and to href on links. All other attributes are removed by
+eml_text_type.clean_html() in any case.
+
+Anything outside of the subset, including attributes that change how DocBook renders an
+element, such as id or role, is left for docbook.xsl. docbook_to_html() returns None for
+those fragments.
+"""
+import itertools
+
+import lxml.etree
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+INLINE_TAG_SET = {'emphasis', 'subscript', 'superscript', 'ulink'}
+LIST_TAG_SET = {'itemizedlist', 'orderedlist'}
+LITERAL_LAYOUT_TAG_SET = {'literalLayout', 'literallayout'}
+
+# Elements that may appear as the root of a fragment
+ROOT_TAG_SET = {'section', 'para'} | LIST_TAG_SET | LITERAL_LAYOUT_TAG_SET | INLINE_TAG_SET
+
+# Elements that may appear as children of each element in the subset
+CHILD_TAG_DICT = {
+    'section': {'title', 'section', 'para'} | LIST_TAG_SET | LITERAL_LAYOUT_TAG_SET,
+    'title': INLINE_TAG_SET,
+    'para': LIST_TAG_SET | LITERAL_LAYOUT_TAG_SET | INLINE_TAG_SET,
+    'itemizedlist': {'listitem'},
+    'orderedlist': {'listitem'},
+    'listitem': {'para'} | LIST_TAG_SET | LITERAL_LAYOUT_TAG_SET | INLINE_TAG_SET,
+    'literalLayout': INLINE_TAG_SET,
+    'literallayout': INLINE_TAG_SET,
+    'emphasis': INLINE_TAG_SET,
+    'subscript': INLINE_TAG_SET,
+    'superscript': INLINE_TAG_SET,
+    'ulink': INLINE_TAG_SET - {'ulink'},
+}
+
+# HTML elements that docbook.xsl moves out of paragraphs (see "unwrap.p" in
+# html/html-rtf.xsl)
+BLOCK_TAG_SET = {
+    'address',
+    'blockquote',
+    'div',
+    'hr',
+    'h1',
+    'h2',
+    'h3',
+    'h4',
+    'h5',
+    'h6',
+    'layer',
+    'p',
+    'pre',
+    'table',
+    'dl',
+    'menu',
+    'ol',
+    'ul',
+    'form',
+}
+
+
+def docbook_to_html(docbook_el: lxml.etree.Element) -> lxml.etree.Element | None:
+    """Return the HTML for a DocBook fragment, or None if the fragment uses DocBook
+    outside of the subset handled here.
+
+    As with docbook.xsl, the returned element is the first element that the fragment
+    renders to.
+    """
+    if docbook_el.tag not in ROOT_TAG_SET or not _is_supported(docbook_el):
+        return None
+    body_el = lxml.etree.Element('body')
+    _Renderer().render(docbook_el, body_el, section_level=0)
+    return body_el[0]
+
+
+def _is_supported(el: lxml.etree.Element) -> bool:
+    for attr_name in el.attrib.keys():
+        if attr_name != XML_LANG and not (el.tag == 'ulink' and attr_name == 'url'):
+            return False
+    if el.tag == 'ulink' and el.get('url') is None:
+        return False
+    child_tag_set = CHILD_TAG_DICT[el.tag]
+    for child_el in el:
+        # Comments and processing instructions have non-str tags
+        if not isinstance(child_el.tag, str) or child_el.tag not in child_tag_set:
+            return False
+        if not _is_supported(child_el):
+            return False
+    return True
+
+
+class _Renderer(object):
+    def __init__(self):
+        self._id_counter = itertools.count(1)
+
+    def render(self, src_el, dst_el, section_level):
+        """Render src_el and append the result to dst_el"""
+        tag = src_el.tag
+        if tag == 'section':
+            self._render_section(src_el, dst_el, section_level + 1)
+        elif tag == 'para':
+            self._render_para(src_el, dst_el, section_level)
+        elif tag in LIST_TAG_SET:
+            self._render_list(src_el, dst_el, section_level)
+        elif tag == 'listitem':
+            li_el = lxml.etree.SubElement(dst_el, 'li', {'class': 'listitem'})
+            self._render_content(src_el, li_el, section_level)
+        elif tag in LITERAL_LAYOUT_TAG_SET:
+            self._render_literal_layout(src_el, dst_el, section_level)
+        elif tag == 'emphasis':
+            span_el = lxml.etree.SubElement(dst_el, 'span', {'class': 'emphasis'})
+            self._render_content(src_el, lxml.etree.SubElement(span_el, 'em'), section_level)
+        elif tag == 'subscript':
+            self._render_content(src_el, lxml.etree.SubElement(dst_el, 'sub'), section_level)
+        elif tag == 'superscript':
+            self._render_content(src_el, lxml.etree.SubElement(dst_el, 'sup'), section_level)
+        elif tag == 'ulink':
+            a_el = lxml.etree.SubElement(
+                dst_el, 'a', {'class': 'ulink', 'href': src_el.get('url'), 'target': '_top'}
+            )
+            if src_el.text is None and not len(src_el):
+                a_el.text = src_el.get('url')
+            else:
+                self._render_content(src_el, a_el, section_level)
+        # Section titles are rendered by _render_section(), and are otherwise skipped.
+
+    def _render_content(self, src_el, dst_el, section_level):
+        """Render the text and child elements of src_el, in document order"""
+        _append_text(dst_el, src_el.text)
+        for child_el in src_el:
+            self.render(child_el, dst_el, section_level)
+            _append_text(dst_el, child_el.tail)
+
+    def _render_section(self, src_el, dst_el, section_level):
+        section_el = lxml.etree.SubElement(dst_el, 'div', {'class': 'section'})
+        titlepage_el = lxml.etree.SubElement(section_el, 'div', {'class': 'titlepage'})
+        title_el = src_el.find('title')
+        if title_el is not None:
+            h_level = 6 if section_level > 5 else section_level + 1
+            h_attr_dict = {'class': 'title'}
+            if h_level < 3:
+                h_attr_dict['style'] = 'clear: both'
+            h_el = lxml.etree.SubElement(
+                lxml.etree.SubElement(lxml.etree.SubElement(titlepage_el, 'div'), 'div'),
+                f'h{h_level}',
+                h_attr_dict,
+            )
+            lxml.etree.SubElement(h_el, 'a', {'name': f'idm{next(self._id_counter)}'})
+            self._render_content(title_el, h_el, section_level)
+        # The separator is only added below the title of the outermost section
+        if section_level == 1:
+            lxml.etree.SubElement(titlepage_el, 'hr')
+        self._render_content(src_el, section_el, section_level)
+
+    def _render_para(self, src_el, dst_el, section_level):
+        p_el = lxml.etree.Element('p')
+        self._render_content(src_el, p_el, section_level)
+        for el in _unwrap_p(p_el):
+            dst_el.append(el)
+
+    def _render_list(self, src_el, dst_el, section_level):
+        list_el = lxml.etree.SubElement(dst_el, 'div', {'class': src_el.tag})
+        if src_el.tag == 'itemizedlist':
+            list_el = lxml.etree.SubElement(list_el, 'ul', {'class': 'itemizedlist'})
+        else:
+            list_el = lxml.etree.SubElement(list_el, 'ol', {'class': 'orderedlist', 'type': '1'})
+        # Only the list items are rendered. Text between them is dropped.
+        for child_el in src_el:
+            self.render(child_el, list_el, section_level)
+
+    def _render_literal_layout(self, src_el, dst_el, section_level):
+        div_el = lxml.etree.SubElement(dst_el, 'div', {'class': 'literallayout'})
+        p_el = lxml.etree.SubElement(div_el, 'p')
+        self._render_content(src_el, p_el, section_level)
+        _make_verbatim(p_el)
+
+
+def _append_text(dst_el, text_str):
+    if not text_str:
+        return
+    if len(dst_el):
+        dst_el[-1].tail = (dst_el[-1].tail or '') + text_str
+    else:
+        dst_el.text = (dst_el.text or '') + text_str
+
+
+def _unwrap_p(p_el):
+    """Move block level elements out of a paragraph.
+
+    The paragraph is split at each block level child. The runs of text and inline
+    elements between the blocks are wrapped in new paragraphs. Runs that are empty are
+    dropped, while runs that only hold whitespace are kept.
+    """
+    if not any(el.tag in BLOCK_TAG_SET for el in p_el):
+        return [p_el]
+    el_list = []
+    run_el = lxml.etree.Element('p')
+    run_el.text = p_el.text
+    for child_el in list(p_el):
+        tail_str = child_el.tail
+        child_el.tail = None
+        if child_el.tag in BLOCK_TAG_SET:
+            if run_el.text is not None or len(run_el):
+                el_list.append(run_el)
+            el_list.append(child_el)
+            run_el = lxml.etree.Element('p')
+            run_el.text = tail_str
+        else:
+            run_el.append(child_el)
+            child_el.tail = tail_str
+    if run_el.text is not None or len(run_el):
+        el_list.append(run_el)
+    return el_list
+
+
+def _make_verbatim(el):
+    """Lay out the text in el and its descendants verbatim. Spaces become non-breaking,
+    and each newline is preceded by a line break element.
+    """
+    for child_el in list(el):
+        _make_verbatim(child_el)
+        child_el.tail = _insert_line_breaks(el, child_el, child_el.tail)
+    el.text = _insert_line_breaks(el, None, el.text)
+
+
+def _insert_line_breaks(parent_el, after_el, text_str):
+    """Insert the verbatim version of a text node into parent_el, after after_el, or at
+    the start of parent_el if after_el is None. Return the text that goes before the
+    first inserted line break.
+    """
+    if not text_str:
+        return text_str
+    line_list = text_str.replace(' ', '\u00a0').split('\n')
+    index = 0 if after_el is None else parent_el.index(after_el) + 1
+    for i, line_str in enumerate(line_list[1:]):
+        br_el = lxml.etree.Element('br')
+        br_el.tail = '\n' + line_str
+        parent_el.insert(index + i, br_el)
+    return line_list[0] or None
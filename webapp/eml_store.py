@@ -0,0 +1,284 @@
+"""Two-tier store for EML documents downloaded from PASTA
+
+All endpoints get their EML documents from here. The store has two tiers:
+
+    - An in-process LRU of EML bytes, bounded by the total size of the documents
+    - The EML files in the cache directory of each PASTA environment
+
+In front of those, parsed documents are kept in a separate in-process LRU, so that hot
+documents are not parsed again for each request. Parsed trees are shared between
+requests and must be treated as read only. Elements that are added to another tree must
+be copied first, as appending an element moves it out of the tree it belongs to.
+
+A PASTA data package ID includes the revision, and a revision is immutable. So a
+document that has been downloaded once never needs to be downloaded again, and no
+expiry is needed in either tier.
+
+The in-memory tier is keyed by the path of the document in the disk tier, so the two
+tiers always agree on the identity of a document.
+
+The SHA-256 digests of the documents, which identify the content in HTTP validators, are
+kept in memory and in a file next to each document, so that the document does not have
+to be read to get its digest.
+"""
+import collections
+import hashlib
+import pathlib
+import threading
+
+import daiquiri
+import lxml.etree
+import lxml.objectify
+
+import webapp.cache_file
+import webapp.cache_key
+import webapp.cache_layout
+import webapp.compression
+import webapp.config
+import webapp.exceptions
+import webapp.metrics
+import webapp.single_flight
+import webapp.utils
+
+log = daiquiri.getLogger(__name__)
+
+# Maximum total size of the digests kept in memory. A digest takes 64 bytes.
+DIGEST_MEMORY_CACHE_BYTES = 16 * 1024 * 1024
+# Approximate size of a node in a libxml2 tree, not including its text
+TREE_NODE_SIZE = 120
+COUNT_NODES_XPATH = lxml.etree.XPath('count(//node() | //@*)')
+
+EnvConfig = collections.namedtuple('EnvConfig', ['pasta', 'cache', 'env'])
+
+
+class SizeBoundedLru(object):
+    """Thread safe LRU cache that is bounded by the total size of the cached values,
+    as returned by size_func, instead of by the number of values.
+    """
+
+    def __init__(self, max_size: int, size_func=len):
+        self.max_size = max_size
+        self._size_func = size_func
+        self._cache_dict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                size, value = self._cache_dict[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._cache_dict.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size: int = None):
+        if size is None:
+            size = self._size_func(value)
+        with self._lock:
+            if key in self._cache_dict:
+                self.size -= self._cache_dict.pop(key)[0]
+            # Values that would fill most of the cache on their own are not cached
+            if size > self.max_size // 2:
+                return
+            self._cache_dict[key] = (size, value)
+            self.size += size
+            while self.size > self.max_size:
+                evicted_size, _ = self._cache_dict.popitem(last=False)[1]
+                self.size -= evicted_size
+
+    def pop(self, key):
+        """Remove a value, if present"""
+        with self._lock:
+            if key in self._cache_dict:
+                self.size -= self._cache_dict.pop(key)[0]
+
+    def clear(self):
+        with self._lock:
+            self._cache_dict.clear()
+            self.size = 0
+
+    def get_stats(self) -> dict:
+        return {
+            'count': len(self._cache_dict),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def __len__(self):
+        return len(self._cache_dict)
+
+    def __contains__(self, key):
+        return key in self._cache_dict
+
+
+_memory_tier = SizeBoundedLru(webapp.config.Config.EML_MEMORY_CACHE_BYTES)
+_tree_tier = SizeBoundedLru(webapp.config.Config.EML_TREE_CACHE_BYTES)
+_digest_tier = SizeBoundedLru(DIGEST_MEMORY_CACHE_BYTES)
+
+
+def get_env_config(env: str) -> EnvConfig:
+    """Return the PASTA base URL, cache directory and canonical name for an environment"""
+    config = webapp.config.Config
+    if env.lower() in ("d", "dev", "development"):
+        return EnvConfig(config.PASTA_D, config.CACHE_D, config.ENV_D)
+    elif env.lower() in ("s", "stage", "staging"):
+        return EnvConfig(config.PASTA_S, config.CACHE_S, config.ENV_S)
+    elif env.lower() in ("p", "prod", "production"):
+        return EnvConfig(config.PASTA_P, config.CACHE_P, config.ENV_P)
+    else:
+        msg = f"Requested PASTA environment not supported: {env}"
+        raise webapp.exceptions.PastaEnvironmentError(msg)
+
+
+@webapp.metrics.timer('fetch')
+def get_eml(pid: str, env: str) -> bytes:
+    """Return the EML document for a data package.
+
+    The document is taken from memory if possible, then from the disk cache, and is only
+    downloaded from PASTA if it is in neither.
+    """
+    pid = webapp.cache_key.normalize_pid(pid)
+    if len(pid.split('.')) != 3:
+        raise ValueError(f'Invalid data package ID: "{pid}"')
+    pasta, cache, env = get_env_config(env)
+    eml_path = pathlib.Path(webapp.utils.get_cache_path(pid, cache))
+    key = eml_path.as_posix()
+
+    eml_bytes = _memory_tier.get(key)
+    webapp.metrics.count_cache('eml_memory', env, eml_bytes is not None)
+    if eml_bytes is not None:
+        return eml_bytes
+
+    eml_bytes = webapp.compression.read_decoded(eml_path, webapp.cache_file.is_valid_eml)
+    webapp.metrics.count_cache('eml_disk', env, eml_bytes is not None)
+    if eml_bytes is None:
+        # Concurrent requests for the same document wait here for the first one to
+        # download it
+        with webapp.single_flight.lock(cache, 'eml', eml_path.name):
+            eml_bytes = _read_or_download(pid, pasta, cache, env, eml_path)
+
+    _memory_tier.put(key, eml_bytes)
+    return eml_bytes
+
+
+def _read_or_download(
+    pid: str, pasta: str, cache: str, env: str, eml_path: pathlib.Path
+) -> bytes:
+    eml_bytes = webapp.compression.read_decoded(eml_path, webapp.cache_file.is_valid_eml)
+    if eml_bytes is not None:
+        return eml_bytes
+    if webapp.config.Config.CACHE_READ_LEGACY_KEYS:
+        eml_bytes = webapp.cache_layout.adopt(
+            webapp.cache_key.get_legacy_eml_path(pid, cache),
+            eml_path,
+            webapp.cache_file.is_valid_eml,
+        )
+        if eml_bytes is not None:
+            return eml_bytes
+    log.info(f'Downloading EML. pid="{pid}" env="{env}"')
+    _discard_digest(pid, cache)
+    return webapp.utils.download_eml(pid, pasta, cache)
+
+
+def get_digest(pid: str, env: str) -> str:
+    """Return the SHA-256 hex digest of the EML document for a data package.
+
+    The document is only read, or downloaded, if the digest is not already known.
+    """
+    pid = webapp.cache_key.normalize_pid(pid)
+    _, cache, env = get_env_config(env)
+    digest_path = webapp.cache_key.get_eml_digest_path(pid, cache)
+    key = digest_path.as_posix()
+
+    digest = _digest_tier.get(key)
+    webapp.metrics.count_cache('digest_memory', env, digest is not None)
+    if digest is not None:
+        return digest
+
+    digest = webapp.cache_layout.read_text(digest_path, webapp.cache_file.is_valid_digest)
+    webapp.metrics.count_cache('digest_disk', env, digest is not None)
+    if digest is None:
+        digest = hashlib.sha256(get_eml(pid, env)).hexdigest()
+        digest_path.parent.mkdir(parents=True, exist_ok=True)
+        webapp.cache_file.write_text(digest_path, digest)
+
+    _digest_tier.put(key, digest)
+    return digest
+
+
+def get_eml_tree(pid: str, env: str, deannotate: bool = False) -> lxml.etree._Element:
+    """Return the root element of the parsed EML document for a data package.
+
+    The tree is shared, and must not be modified. See the module docstring.
+
+    Args:
+        deannotate: Return a tree with lxml.objectify annotations, xsi:type attributes
+            and unused namespace declarations removed. Both variants of a document may
+            be held at the same time.
+    """
+    env = get_env_config(env).env
+    pid = webapp.cache_key.normalize_pid(pid)
+    key = (env, pid, deannotate)
+    root_el = _tree_tier.get(key)
+    webapp.metrics.count_cache('eml_tree', env, root_el is not None)
+    if root_el is not None:
+        return root_el
+    eml_bytes = get_eml(pid, env)
+    try:
+        with webapp.metrics.timer('parse'):
+            root_el = lxml.etree.fromstring(eml_bytes)
+    except lxml.etree.XMLSyntaxError as e:
+        # The cached document may be damaged. Discard it and fetch it again, once.
+        log.warning(f'Discarding EML that cannot be parsed. pid="{pid}" env="{env}" error="{e}"')
+        discard(pid, env)
+        eml_bytes = get_eml(pid, env)
+        root_el = lxml.etree.fromstring(eml_bytes)
+    if deannotate:
+        with webapp.metrics.timer('deannotate'):
+            lxml.objectify.deannotate(
+                root_el.getroottree(), cleanup_namespaces=True, xsi_nil=True
+            )
+    node_count = int(COUNT_NODES_XPATH(root_el))
+    _tree_tier.put(key, root_el, len(eml_bytes) + node_count * TREE_NODE_SIZE)
+    return root_el
+
+
+def discard(pid: str, env: str):
+    """Drop a document from the in-memory caches and the cache directory"""
+    _, cache, env = get_env_config(env)
+    pid = webapp.cache_key.normalize_pid(pid)
+    eml_path = pathlib.Path(webapp.utils.get_cache_path(pid, cache))
+    _memory_tier.pop(eml_path.as_posix())
+    for deannotate in (False, True):
+        _tree_tier.pop((env, pid, deannotate))
+    webapp.compression.discard(eml_path)
+    _discard_digest(pid, cache)
+
+
+def _discard_digest(pid: str, cache: str):
+    digest_path = webapp.cache_key.get_eml_digest_path(pid, cache)
+    _digest_tier.pop(digest_path.as_posix())
+    webapp.cache_layout.discard(digest_path)
+
+
+def get_stats() -> dict:
+    """Return counters for the in-memory caches"""
+    return {
+        'eml': _memory_tier.get_stats(),
+        'tree': _tree_tier.get_stats(),
+        'digest': _digest_tier.get_stats(),
+    }
+
+
+def clear():
+    """Drop all documents from the in-memory caches"""
+    _memory_tier.clear()
+    _tree_tier.clear()
+    _digest_tier.clear()
@@ -1,16 +1,20 @@
 """Functions for handling EML TextType elements
 """
-import io
+import copy
+import logging
 import pathlib
 import textwrap
 
 import daiquiri
 import lxml.etree
 import lxml.objectify
-import markdown
 import grip
 
-import webapp.utils
+import webapp.config
+import webapp.docbook_subset
+import webapp.gfm
+import webapp.metrics
+import webapp.xslt
 
 log = daiquiri.getLogger(__name__)
 
@@ -34,6 +38,22 @@ DEFAULT_MARKDOWN_EXTENSIONS = [
     'wikilinks',
 ]
 
+# Increment when a change causes text_to_html() to return different HTML for the same
+# input. This invalidates the cached HTML, both per pid and in the content addressed
+# cache, and changes the ETags of the HTML responses. See get_renderer_id().
+RENDERER_VERSION = 1
+
+# libxml2 stops indenting at this depth when pretty printing
+MAX_INDENT_LEVEL = 30
+
+webapp.xslt.register('docbook', path=XSL_PATH)
+
+
+def get_renderer_id() -> str:
+    """Return an identifier for the renderer version and the settings that the HTML
+    depends on. Cache keys and ETags for rendered HTML include it."""
+    return f'{RENDERER_VERSION}:{webapp.config.Config.MARKDOWN_RENDERER}'
+
 
 def text_to_html(text_type_el: lxml.etree.Element) -> [str]:
     """Return the contents of an EML TextType element or subtree as an HTML fragment
@@ -44,31 +64,68 @@ def text_to_html(text_type_el: lxml.etree.Element) -> [str]:
         <div>Section of HTML formatted markdown, DocBook, plain text, etc</div>
         <div>...</div>
     </div>
+
+    Each section is rendered into a single output tree, which is then serialized once.
+    Sections that are rendered as HTML documents (markdown and DocBook) are laid out the
+    same as if they had been pretty printed separately, so the output is unchanged from
+    when each section was serialized on its own and the results joined.
     """
-    html_list = []
-    if text_type_el.text.strip():
-        html_list.append(_text_to_html(text_type_el.text))
+    root_el = lxml.etree.Element('div')
 
-    text_type_el = fix_literal_layout(text_type_el)
+    if text_type_el.text and text_type_el.text.strip():
+        _add_section(root_el).append(_text_to_html(text_type_el.text))
 
     for text_el in _find_immediate_children(text_type_el):
         if text_el.tag == 'markdown':
             html_el = _markdown_to_html(text_el)
         else:
             html_el = _docbook_to_html(text_el)
-        clean_html_el = clean_html(html_el)
-        clean_html_str = webapp.utils.get_etree_as_pretty_printed_xml(clean_html_el)
-        html_list.append(clean_html_str)
-        if text_el.tail.strip():
-            html_list.append(text_el.tail)
+        clean_html(html_el)
+        _pretty_print_in_place(html_el)
+        # Separator written after the root element when a document is serialized
+        html_el.tail = '\n'
+        _add_section(root_el).append(html_el)
+        if text_el.tail and text_el.tail.strip():
+            _add_section(root_el).text = text_el.tail
+
+    if not len(root_el):
+        _add_section(root_el).text = ''
+
+    with webapp.metrics.timer('serialize'):
+        return lxml.etree.tostring(root_el, with_tail=False).decode('utf-8')
+
 
-    return f'<div><div>{"</div><div>".join(html_list)}</div></div>'
+def _add_section(root_el: lxml.etree.Element) -> lxml.etree.Element:
+    return lxml.etree.SubElement(root_el, 'div')
 
 
-def _text_to_html(text_str: str):
+def _text_to_html(text_str: str) -> lxml.etree.Element:
     """Plain text to HTML"""
     log.info(f'Processing as text:\n----\n{text_str}\n----\n')
-    return f'<p>{text_str.strip()}</p>'
+    p_el = lxml.etree.Element('p')
+    p_el.text = text_str.strip()
+    return p_el
+
+
+def _pretty_print_in_place(el: lxml.etree.Element, level: int = 0):
+    """Add the whitespace that libxml2 adds when pretty printing a tree, so that the tree
+    can be serialized as part of a larger document without pretty printing, and still
+    come out the same as if it had been pretty printed on its own.
+
+    libxml2 only indents the children of an element if none of the children are text.
+    Once it finds an element with text children, nothing below that element is indented.
+    """
+    if el.text is not None or not len(el):
+        return
+    for child_el in el:
+        if child_el.tail is not None or isinstance(child_el, lxml.etree._Entity):
+            return
+    indent_str = '\n' + '  ' * min(level + 1, MAX_INDENT_LEVEL)
+    el.text = indent_str
+    for child_el in el:
+        _pretty_print_in_place(child_el, level + 1)
+        child_el.tail = indent_str
+    child_el.tail = '\n' + '  ' * min(level, MAX_INDENT_LEVEL)
 
 
 def _find_immediate_children(text_type_el: lxml.etree.Element) -> [lxml.etree.Element]:
@@ -79,45 +136,77 @@ def _find_immediate_children(text_type_el: lxml.etree.Element) -> [lxml.etree.El
 def _markdown_to_html(markdown_el: lxml.etree.Element, force_local: bool = False):
     """Return the contents of a markdown element as HTML.
 
-    The EML spec specifies GitHub Flavored Markdown (gfm), and there are no local
-    gfm processors for Python. So we send the markdown to GitHub for processing.
+    The EML spec specifies GitHub Flavored Markdown (gfm). By default, this is rendered
+    locally by webapp.gfm, which lays out the HTML the same as GitHub does. Set
+    MARKDOWN_RENDERER to 'github' in the config to send the markdown to GitHub instead.
 
     Notes:
-        - The markdown processor in the Python standard library can handle ALMOST all
-          markdown that occurs in EML documents, so we might want to look into trying to
-          detect if we need to send the markdown to GitHub.
         - GitHub has rate limiting on the markdown requests. The limit can be increased
           by connecting with an account instead of anonymously. We currently connect
           anonymously.
         - If GitHub markdown processing fails due to rate limiting or other issues, we
-          fall back to processing the markdown locally with the standard Python markdown
-          processor.
-        - The standard Python markdown processor comes with many extensions, and we
-          enable all of these in order to ensure support for as many markdown constructs
-          as possible.
+          fall back to processing the markdown locally.
     """
     markdown_str = markdown_el.xpath('text()')[0]
     dedent_markdown_str = textwrap.dedent(markdown_str)
     log.info(f'Processing as Markdown:\n----\n{dedent_markdown_str}\n----\n')
-    log.info(f'Connecting to GitHub for markdown rendering...')
-    try:
-        html_str = grip.render_content(dedent_markdown_str)
-    except Exception as e:
-        log.warn(f'GitHub markdown rendering failed with exception: {str(e)}')
-        log.info(f'Using local markdown processor')
-        html_str = markdown.markdown(dedent_markdown_str, extensions=DEFAULT_MARKDOWN_EXTENSIONS)
-    return lxml.etree.HTML(html_str)
-
-def _docbook_to_html(docbook_el: lxml.etree.Element, xsl_path: pathlib.Path = XSL_PATH) -> str:
-    xml_str = webapp.utils.get_etree_as_pretty_printed_xml(docbook_el)
-    log.info(f'Processing as DocBook hierarchy:\n----\n{xml_str}\n----\n')
-    xslt_el = lxml.etree.parse(xsl_path.as_posix())
-    transform_func = lxml.etree.XSLT(xslt_el)
-    html_el = transform_func(docbook_el)
+    if force_local or webapp.config.Config.MARKDOWN_RENDERER == 'local':
+        with webapp.metrics.timer('markdown_local'):
+            html_str = webapp.gfm.markdown_to_html(dedent_markdown_str)
+    else:
+        log.info(f'Connecting to GitHub for markdown rendering...')
+        try:
+            with webapp.metrics.timer('markdown_github'):
+                html_str = grip.render_content(dedent_markdown_str)
+        except Exception as e:
+            log.warn(f'GitHub markdown rendering failed with exception: {str(e)}')
+            log.info(f'Using local markdown processor')
+            webapp.metrics.inc(
+                webapp.metrics.FALLBACK_TOTAL, from_renderer='github', to_renderer='local'
+            )
+            with webapp.metrics.timer('markdown_local'):
+                html_str = webapp.gfm.markdown_to_html(dedent_markdown_str)
+    with webapp.metrics.timer('parse_html'):
+        return lxml.etree.HTML(html_str)
+
+
+def _docbook_to_html(
+    docbook_el: lxml.etree.Element, xsl_path: pathlib.Path = XSL_PATH, force_xslt: bool = False
+) -> lxml.etree.Element:
+    """Return the contents of a DocBook element as HTML.
+
+    DocBook that stays within the subset that EML allows is rendered by
+    webapp.docbook_subset. Anything else is rendered by the complete docbook.xsl
+    stylesheet, which generates the same HTML for the subset, but is much slower.
+    """
+    if log.isEnabledFor(logging.DEBUG):
+        xml_str = lxml.etree.tostring(docbook_el, pretty_print=True, encoding='unicode')
+        log.debug(f'Processing as DocBook hierarchy:\n----\n{xml_str}\n----\n')
+    if xsl_path == XSL_PATH:
+        if not force_xslt:
+            with webapp.metrics.timer('docbook_subset'):
+                html_el = webapp.docbook_subset.docbook_to_html(docbook_el)
+            if html_el is not None:
+                return html_el
+            log.info(f'DocBook is outside of the EML subset. Using docbook.xsl')
+            webapp.metrics.inc(
+                webapp.metrics.FALLBACK_TOTAL,
+                from_renderer='docbook_subset',
+                to_renderer='docbook_xslt',
+            )
+        transform_func = webapp.xslt.get('docbook')
+    else:
+        transform_func = webapp.xslt.get_path(xsl_path)
+    # The transform temporarily makes the element the root of its tree, so apply it to a
+    # copy, as the element may belong to a shared EML tree
+    docbook_el = fix_literal_layout(copy.deepcopy(docbook_el))
+    with webapp.metrics.timer('docbook_xslt'):
+        html_el = transform_func(docbook_el)
     return html_el.xpath('/html/body/*')[0]
 
 
-def fix_literal_layout(xml_el):
+@webapp.metrics.timer('fix_literal_layout')
+def fix_literal_layout(xml_el: lxml.etree.Element) -> lxml.etree.Element:
     """Workaround 'literalLayout' bug in the EML spec.
 
     This renames any `literalLayout` elements to `literallayout` before processing with
@@ -125,50 +214,26 @@ def fix_literal_layout(xml_el):
 
     EML specifies 'literalLayout' as a valid DocBook element, but the name is actually
     literallayout (all lower case).
-    """
-    # language=xsl
-    xsl_str = """\
-    <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
-      <xsl:template match="@*|node()">
-        <xsl:copy>
-          <xsl:apply-templates select="@*|node()"/>
-        </xsl:copy>
-      </xsl:template>
-      <xsl:template match="literalLayout">
-        <literallayout>
-          <xsl:apply-templates select="@*|node()"/>
-        </literallayout>
-      </xsl:template>
-    </xsl:stylesheet>
-    """
-    # xml_str = get_etree_as_pretty_printed_xml(xml_el)
-    # log.info(f'LiteralLayout:\n----\n{xml_str}\n----\n')
-    xslt_el = lxml.etree.parse(io.StringIO(xsl_str))
-    transform_func = lxml.etree.XSLT(xslt_el)
-    transformed_xml_el = transform_func(xml_el)
-    return transformed_xml_el
 
+    The element is returned as is if there is nothing to rename. Otherwise, the renaming
+    is done on a copy, so that the source EML document is left unchanged.
+    """
+    if next(xml_el.iter('literalLayout'), None) is None:
+        return xml_el
+    xml_el = copy.deepcopy(xml_el)
+    for literal_layout_el in xml_el.iter('literalLayout'):
+        literal_layout_el.tag = 'literallayout'
+    return xml_el
 
-def clean_html(html_el):
-    """A transform to clean up HTML. This removes:
 
-    - All attributes (including "class")
+@webapp.metrics.timer('clean_html')
+def clean_html(html_el: lxml.etree.Element) -> lxml.etree.Element:
+    """Clean up HTML in place. This removes:
 
-    To remove other elements, add them in the final template match. E.g., to remove "a"
-    anchors: <xsl:template match="@*|a"/>
-    """
-    # language=xsl
-    xsl_str = """\
-    <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
-      <xsl:template match="@*|node()">
-        <xsl:copy>
-          <xsl:apply-templates select="@*|node()"/>
-        </xsl:copy>
-      </xsl:template>
-      <xsl:template match="@*[local-name() != 'href']"/>
-    </xsl:stylesheet>
+    - All attributes except "href" (including "class")
     """
-    xslt_el = lxml.etree.parse(io.StringIO(xsl_str))
-    transform_func = lxml.etree.XSLT(xslt_el)
-    transformed_xml_el = transform_func(html_el)
-    return transformed_xml_el
+    for el in html_el.iter(lxml.etree.Element):
+        for attr_name in el.attrib.keys():
+            if lxml.etree.QName(attr_name).localname != 'href':
+                del el.attrib[attr_name]
+    return html_el
@@ -0,0 +1,98 @@
+"""Sending cached HTML without reading it into memory
+
+By default, cached HTML is read into memory and returned as the response body. With
+CACHE_FILE_RESPONSE set, a cache hit is sent straight from the cache file instead:
+
+    - 'sendfile': The open file is passed to the WSGI server as a wsgi.file_wrapper, which
+      uWSGI sends with sendfile(). The body is never copied into Python.
+    - 'x-accel': The response has an empty body and an X-Accel-Redirect header with the
+      path of the file below CACHE_X_ACCEL_*, and nginx sends the file. See
+      deployment/ridare.nginx for the matching internal location.
+
+The file is sent in the form that it is stored, so compressed files (see
+webapp.compression) are only sent this way to clients that accept gzip, and uncompressed
+files are sent uncompressed. Entries that are not in a form that can be sent as is, and
+cache misses, go through webapp.markdown_cache as usual.
+
+Only files under the hashed names of webapp.cache_key, in the sharded layout, are sent
+this way. These have always been written atomically, so their contents are not checked
+before they are sent.
+"""
+import pathlib
+
+import flask
+import werkzeug.wsgi
+
+import webapp.cache_file
+import webapp.cache_key
+import webapp.compression
+import webapp.config
+import webapp.eml_store
+
+SENDFILE = 'sendfile'
+X_ACCEL = 'x-accel'
+
+
+def make_html_response(pid: str, text_xpath: str, env: str) -> flask.Response | None:
+    """Return a response that sends the cached HTML for an element as is, or None if it
+    cannot be sent that way"""
+    config = webapp.config.Config
+    mode = config.CACHE_FILE_RESPONSE
+    if mode not in (SENDFILE, X_ACCEL) or not config.USE_CACHE:
+        return None
+    _, cache, env = webapp.eml_store.get_env_config(env)
+    html_path = webapp.cache_key.get_html_path(pid, text_xpath, cache)
+    for path, encoding in _get_sendable_paths(html_path):
+        if mode == SENDFILE:
+            response = _make_sendfile_response(path)
+        else:
+            response = _make_x_accel_response(path, cache, env)
+        if response is not None:
+            if encoding is not None:
+                response.content_encoding = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+    return None
+
+
+def get_x_accel_prefix(env: str) -> str:
+    config = webapp.config.Config
+    return {
+        config.ENV_P: config.CACHE_X_ACCEL_P,
+        config.ENV_S: config.CACHE_X_ACCEL_S,
+        config.ENV_D: config.CACHE_X_ACCEL_D,
+    }[webapp.eml_store.get_env_config(env).env]
+
+
+def _get_sendable_paths(html_path: pathlib.Path) -> list[tuple[pathlib.Path, str | None]]:
+    """Return the cache files that the client accepts as is, and their encoding, in order
+    of preference"""
+    path_list = [(html_path, None)]
+    if webapp.compression.get_accepted_encoding() == webapp.compression.GZIP:
+        path_list.insert(
+            0, (webapp.compression.get_gzip_path(html_path), webapp.compression.GZIP)
+        )
+    return path_list
+
+
+def _make_sendfile_response(path: pathlib.Path) -> flask.Response | None:
+    file_info = webapp.cache_file.open_file(path)
+    if file_info is None:
+        return None
+    f, stat_result = file_info
+    # The size is taken from the open file, as the path may be replaced at any time
+    response = flask.Response(
+        werkzeug.wsgi.wrap_file(flask.request.environ, f), direct_passthrough=True
+    )
+    response.content_length = stat_result.st_size
+    return response
+
+
+def _make_x_accel_response(path: pathlib.Path, cache: str, env: str) -> flask.Response | None:
+    if webapp.cache_file.stat_file(path) is None:
+        return None
+    response = flask.Response()
+    response.headers['X-Accel-Redirect'] = (
+        get_x_accel_prefix(env) + path.relative_to(cache).as_posix()
+    )
+    return response
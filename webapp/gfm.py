@@ -0,0 +1,202 @@
+"""Render GitHub Flavored Markdown (GFM) locally
+
+The EML spec specifies GFM for the markdown element. This renders the GFM constructs that
+occur in EML documents (tables, fenced code, task lists, autolinks and strikethrough) with
+the Python markdown processor and a few small extensions, and lays out the result the way
+the GitHub markdown API does, so that it can be used instead of sending the markdown to
+GitHub.
+
+Notes:
+    - Soft line breaks are kept as newlines, and quotes are not converted to typographic
+      quotes, as on GitHub.
+    - Headings are wrapped in a div together with a permalink anchor, as on GitHub. The
+      anchor names are generated the same way as on GitHub, including the numbering of
+      repeated headings.
+    - Markdown instances are not thread safe, so each thread gets its own.
+"""
+import re
+import threading
+import xml.etree.ElementTree as etree
+
+import markdown
+import markdown.extensions
+import markdown.inlinepatterns
+import markdown.treeprocessors
+import markdown.util
+
+GFM_MARKDOWN_EXTENSIONS = [
+    'fenced_code',
+    'sane_lists',
+    'tables',
+]
+
+HEADING_TAG_SET = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# Autolinks are not created inside these elements
+NO_AUTOLINK_TAG_SET = {'a', 'code', 'pre'}
+
+# ~~text~~ and ~text~
+STRIKETHROUGH_RE = r'(?<!~)(~{1,2})(?!~)(.+?)(?<!~)\1(?!~)'
+TASK_RE = re.compile(r'\[([ xX])\]\s+')
+AUTOLINK_RE = re.compile(r'(?<![\w/@.:])(?:https?://|www\.)[^\s<>\x02\x03]+', re.IGNORECASE)
+# Trailing punctuation that is not considered part of an autolink
+AUTOLINK_TRAILING_STR = '?!.,:;*_~\'"'
+PLACEHOLDER_RE = re.compile(f'{markdown.util.STX}.*?{markdown.util.ETX}')
+
+_thread_local = threading.local()
+
+
+def markdown_to_html(markdown_str: str) -> str:
+    """Return markdown rendered as an HTML fragment"""
+    html_str = _get_markdown().reset().convert(markdown_str)
+    # GitHub ends the fragment with a newline
+    return f'{html_str}\n' if html_str else ''
+
+
+def _get_markdown() -> markdown.Markdown:
+    try:
+        return _thread_local.md
+    except AttributeError:
+        _thread_local.md = markdown.Markdown(
+            extensions=[*GFM_MARKDOWN_EXTENSIONS, GfmExtension()]
+        )
+        return _thread_local.md
+
+
+def github_slug(text_str: str) -> str:
+    """Return the anchor name that GitHub generates for a heading"""
+    return re.sub(r'[^\w\- ]', '', text_str.strip().lower()).replace(' ', '-')
+
+
+class GfmExtension(markdown.extensions.Extension):
+    """The GFM constructs that are not covered by the standard extensions"""
+
+    def extendMarkdown(self, md):
+        md.inlinePatterns.register(
+            markdown.inlinepatterns.SimpleTagInlineProcessor(STRIKETHROUGH_RE, 'del'),
+            'gfm_strikethrough',
+            55,
+        )
+        # Run after the inline processor, which has priority 20
+        md.treeprocessors.register(TaskListTreeprocessor(md), 'gfm_task_list', 15)
+        md.treeprocessors.register(AutolinkTreeprocessor(md), 'gfm_autolink', 14)
+        # Run after the prettify processor, which has priority 10, so that the heading
+        # wrappers are laid out the same as on GitHub
+        md.treeprocessors.register(HeadingTreeprocessor(md), 'gfm_heading', 5)
+
+
+class TaskListTreeprocessor(markdown.treeprocessors.Treeprocessor):
+    """Render list items starting with "[ ]" or "[x]" as checkboxes"""
+
+    def run(self, root):
+        for li_el in root.iter('li'):
+            text_el = li_el
+            if len(li_el) and li_el[0].tag == 'p' and not (li_el.text or '').strip():
+                text_el = li_el[0]
+            m = TASK_RE.match(text_el.text or '')
+            if not m:
+                continue
+            input_el = etree.Element('input', type='checkbox', disabled='disabled')
+            input_el.set('class', 'task-list-item-checkbox')
+            if m.group(1) != ' ':
+                input_el.set('checked', 'checked')
+            input_el.tail = ' ' + text_el.text[m.end() :]
+            text_el.text = None
+            text_el.insert(0, input_el)
+            li_el.set('class', 'task-list-item')
+
+
+class AutolinkTreeprocessor(markdown.treeprocessors.Treeprocessor):
+    """Turn bare URLs and www. addresses into links"""
+
+    def run(self, root):
+        self._linkify(root)
+
+    def _linkify(self, el):
+        if el.tag in NO_AUTOLINK_TAG_SET:
+            return
+        child_list = list(el)
+        # Process in reverse, so that inserting links does not move the children that
+        # are left to process
+        for i, child_el in reversed(list(enumerate(child_list))):
+            self._linkify(child_el)
+            child_el.tail, link_list = self._split_links(child_el.tail)
+            for j, a_el in enumerate(link_list):
+                el.insert(i + 1 + j, a_el)
+        el.text, link_list = self._split_links(el.text)
+        for j, a_el in enumerate(link_list):
+            el.insert(j, a_el)
+
+    def _split_links(self, text_str):
+        """Split text into the text before the first link, and a list of link elements
+        that hold the text after them in their tails"""
+        if not text_str:
+            return text_str, []
+        head_str = None
+        link_list = []
+        pos = 0
+        for m in AUTOLINK_RE.finditer(text_str):
+            url_str = self._trim_url(m.group(0))
+            if '.' not in url_str.split('//')[-1].rstrip('.'):
+                continue
+            prev_str = text_str[pos : m.start()]
+            if link_list:
+                link_list[-1].tail = prev_str
+            else:
+                head_str = prev_str
+            a_el = etree.Element('a')
+            href_str = url_str if '://' in url_str else f'http://{url_str}'
+            a_el.set('href', href_str)
+            a_el.text = url_str
+            link_list.append(a_el)
+            pos = m.start() + len(url_str)
+        if not link_list:
+            return text_str, []
+        link_list[-1].tail = text_str[pos:]
+        return head_str, link_list
+
+    def _trim_url(self, url_str):
+        while True:
+            if url_str[-1] in AUTOLINK_TRAILING_STR:
+                url_str = url_str[:-1]
+            elif url_str.endswith(')') and url_str.count(')') > url_str.count('('):
+                url_str = url_str[:-1]
+            else:
+                return url_str
+
+
+class HeadingTreeprocessor(markdown.treeprocessors.Treeprocessor):
+    """Wrap headings in a div with a permalink anchor, as GitHub does"""
+
+    def run(self, root):
+        slug_count_dict = {}
+        for i, el in enumerate(root):
+            if el.tag not in HEADING_TAG_SET:
+                continue
+            text_str = self._get_text(el)
+            slug_str = github_slug(text_str)
+            slug_count = slug_count_dict.get(slug_str, 0)
+            slug_count_dict[slug_str] = slug_count + 1
+            if slug_count:
+                slug_str = f'{slug_str}-{slug_count}'
+            div_el = etree.Element('div', **{'class': 'markdown-heading'})
+            div_el.tail = el.tail
+            el.tail = None
+            el.set('class', 'heading-element')
+            a_el = etree.Element(
+                'a',
+                id=f'user-content-{slug_str}',
+                href=f'#{slug_str}',
+                **{'class': 'anchor', 'aria-label': f'Permalink: {text_str}'},
+            )
+            etree.SubElement(
+                a_el, 'span', **{'aria-hidden': 'true', 'class': 'octicon octicon-link'}
+            )
+            root[i] = div_el
+            div_el.append(el)
+            div_el.append(a_el)
+
+    def _get_text(self, el):
+        """Return the text of a heading, with escaped characters restored and inline
+        HTML removed"""
+        text_str = self.md.treeprocessors['unescape'].unescape(''.join(el.itertext()))
+        return PLACEHOLDER_RE.sub('', text_str).strip()
@@ -0,0 +1,88 @@
+"""HTTP validators and caching headers for the responses
+
+A data package revision never changes, so the HTML and raw XML for an element can be
+kept by browsers and CDNs for as long as the code that produces them stays the same.
+These responses carry:
+
+    - A strong ETag, derived from the SHA-256 of the EML document, the normalized XPath
+      and the version of the code that produces the response
+    - Cache-Control: public, max-age=RESPONSE_MAX_AGE, immutable
+
+The ETag is found from the digest of the EML document alone, which webapp.eml_store
+keeps in memory and in the cache directory. So a request with a matching If-None-Match
+gets a 304 without the cached HTML being read, or the element being rendered.
+
+A strong ETag identifies the bytes of the response, so gzip compressed responses (see
+webapp.compression) have the ETag of the uncompressed response with a "-gzip" suffix.
+
+/multi is a POST endpoint, so its responses are not stored by HTTP caches, and it does
+not take conditional requests. Responses that are not streamed get an ETag from the
+body, so that clients can tell if a result has changed.
+"""
+import hashlib
+
+import flask
+
+import webapp.cache_key
+import webapp.compression
+import webapp.config
+import webapp.eml_store
+import webapp.eml_text_type
+
+# Bump to change the ETags of the raw XML responses when their content changes
+RAW_VERSION = 1
+GZIP_ETAG_SUFFIX = '-gzip'
+
+
+def get_html_etag(pid: str, text_xpath: str, env: str) -> str:
+    return _get_etag('html', webapp.eml_text_type.get_renderer_id(), pid, text_xpath, env)
+
+
+def get_raw_etag(pid: str, text_xpath: str, env: str) -> str:
+    return _get_etag('raw', RAW_VERSION, pid, text_xpath, env)
+
+
+def get_matching_etag(etag: str) -> str | None:
+    """Return the ETag of the uncompressed or compressed response that is matched by the
+    If-None-Match of the current request, or None if neither is matched"""
+    for representation_etag in (etag, etag + GZIP_ETAG_SUFFIX):
+        if flask.request.if_none_match.contains_weak(representation_etag):
+            return representation_etag
+    return None
+
+
+def make_not_modified_response(representation_etag: str) -> flask.Response:
+    response = flask.Response(status=304)
+    response.set_etag(representation_etag)
+    response.vary.add('Accept-Encoding')
+    _set_cache_control(response)
+    return response
+
+
+def set_headers(response: flask.Response, etag: str):
+    """Add the ETag and Cache-Control headers for a data package revision"""
+    set_etag(response, etag)
+    _set_cache_control(response)
+
+
+def set_etag(response: flask.Response, etag: str):
+    """Add the ETag for the uncompressed response, adjusted for the content encoding"""
+    if response.content_encoding == webapp.compression.GZIP:
+        etag += GZIP_ETAG_SUFFIX
+    response.set_etag(etag)
+
+
+def _set_cache_control(response: flask.Response):
+    max_age = webapp.config.Config.RESPONSE_MAX_AGE
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+
+def _get_etag(kind: str, version, pid: str, text_xpath: str, env: str) -> str:
+    digest = webapp.eml_store.get_digest(pid, env)
+    text = f'{kind}:{version}\n{webapp.cache_key.normalize_xpath(text_xpath)}\n{digest}'
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
@@ -1,13 +1,20 @@
 import pathlib
-import re
 
 import daiquiri
 import lxml.etree
 
+import webapp.cache_file
+import webapp.cache_key
+import webapp.cache_layout
+import webapp.compression
 import webapp.config
-import webapp.eml_text_type
+import webapp.eml_store
 import webapp.exceptions
+import webapp.metrics
+import webapp.render_cache
+import webapp.single_flight
 import webapp.utils
+import webapp.xpath_cache
 
 log = daiquiri.getLogger(__name__)
 
@@ -18,47 +25,62 @@ def get_html(
     env: str,
 ):
     """Get HTML fragment for markdown element in EML"""
-    if env.lower() in ("d", "dev", "development"):
-        pasta = webapp.config.Config.PASTA_D
-        cache = webapp.config.Config.CACHE_D
-        env = webapp.config.Config.ENV_D
-    elif env.lower() in ("s", "stage", "staging"):
-        pasta = webapp.config.Config.PASTA_S
-        cache = webapp.config.Config.CACHE_S
-        env = webapp.config.Config.ENV_S
-    elif env.lower() in ("p", "prod", "production"):
-        pasta = webapp.config.Config.PASTA_P
-        cache = webapp.config.Config.CACHE_P
-        env = webapp.config.Config.ENV_P
-    else:
-        msg = f"Requested PASTA environment not supported: {env}"
-        raise webapp.exceptions.PastaEnvironmentError(msg)
-
-    file_path = pathlib.Path(cache, f'{safe_filename(text_xpath)}-{safe_filename(pid)}.html')
-    file_path.parent.mkdir(parents=False, exist_ok=True)
-
-    if webapp.config.Config.USE_CACHE and file_path.is_file():
-        return file_path.read_text(encoding='utf-8')
-
-    scope, identifier, revision = pid.strip().split(".")
-    eml_url = f"{pasta}/metadata/eml/{scope}/{identifier}/{revision}"
-
-    try:
-        eml_bytes = webapp.utils.requests_wrapper(eml_url)
-    except ValueError as e:
-        log.error(e)
-        raise
-    except Exception as e:
-        log.error(e)
-        msg = f'Error accessing data package "{pid}" in the "' f'{env}" environment'
-        raise webapp.exceptions.DataPackageError(msg)
-
-    eml_path = pathlib.Path(cache, f'{safe_filename(pid)}.eml.xml')
-    eml_path.write_bytes(eml_bytes)
-
-    root_el = lxml.etree.fromstring(eml_bytes)
-
-    text_el_list = root_el.xpath(text_xpath)
+    html_bytes, encoding = get_html_data(pid, text_xpath, env)
+    return webapp.compression.decode(html_bytes, encoding).decode('utf-8')
+
+
+def get_html_data(pid: str, text_xpath: str, env: str) -> tuple[bytes, str | None]:
+    """Get HTML fragment for markdown element in EML, as stored in the cache. Returns
+    the fragment and its encoding, which is "gzip" if it is stored compressed, else None.
+    """
+    _, cache, env = webapp.eml_store.get_env_config(env)
+
+    file_path = webapp.cache_key.get_html_path(pid, text_xpath, cache)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    html_data = _read_cached_html(file_path)
+    if html_data is not None:
+        webapp.metrics.count_cache('html', env, True)
+        return html_data
+
+    # Concurrent requests for the same entry wait here for the first one to render it
+    with webapp.single_flight.lock(cache, 'html', file_path.name):
+        html_data = _read_cached_html(file_path)
+        if html_data is None:
+            html_data = _read_legacy_html(pid, text_xpath, cache, file_path)
+        if html_data is not None:
+            webapp.metrics.count_cache('html', env, True)
+            return html_data
+        webapp.metrics.count_cache('html', env, False)
+        return _render_html(pid, text_xpath, env, cache, file_path)
+
+
+def _read_cached_html(file_path: pathlib.Path) -> tuple[bytes, str | None] | None:
+    if not webapp.config.Config.USE_CACHE:
+        return None
+    html_bytes, encoding = webapp.compression.read(file_path, webapp.cache_file.is_valid_html)
+    return None if html_bytes is None else (html_bytes, encoding)
+
+
+def _read_legacy_html(
+    pid: str, text_xpath: str, cache: str, file_path: pathlib.Path
+) -> tuple[bytes, None] | None:
+    config = webapp.config.Config
+    if not (config.USE_CACHE and config.CACHE_READ_LEGACY_KEYS):
+        return None
+    html_bytes = webapp.cache_layout.adopt(
+        webapp.cache_key.get_legacy_html_path(pid, text_xpath, cache),
+        file_path,
+        webapp.cache_file.is_valid_html,
+    )
+    return None if html_bytes is None else (html_bytes, None)
+
+
+def _render_html(pid: str, text_xpath: str, env: str, cache: str, file_path: pathlib.Path):
+    root_el = _get_eml_tree(pid, env)
+
+    with webapp.metrics.timer('xpath'):
+        text_el_list = webapp.xpath_cache.xpath(root_el, text_xpath)
     if not text_el_list:
         raise webapp.exceptions.DataPackageError(f'Element not found. text_xpath="{text_xpath}"')
 
@@ -67,11 +89,9 @@ def get_html(
             f'There is more than one matching element. text_xpath="{text_xpath}" len="{len(text_el_list)}"'
         )
 
-    html_str = webapp.eml_text_type.text_to_html(text_el_list[0])
-
-    file_path.write_text(html_str, encoding='utf-8')
+    html_str = webapp.render_cache.text_to_html(text_el_list[0], cache, env)
 
-    return html_str
+    return webapp.compression.write(file_path, html_str.encode('utf-8'))
 
 def get_raw(
     pid: str,
@@ -79,41 +99,12 @@ def get_raw(
     env: str,
 ):
     """Get HTML fragment for markdown element in EML"""
-    if env.lower() in ("d", "dev", "development"):
-        pasta = webapp.config.Config.PASTA_D
-        cache = webapp.config.Config.CACHE_D
-        env = webapp.config.Config.ENV_D
-    elif env.lower() in ("s", "stage", "staging"):
-        pasta = webapp.config.Config.PASTA_S
-        cache = webapp.config.Config.CACHE_S
-        env = webapp.config.Config.ENV_S
-    elif env.lower() in ("p", "prod", "production"):
-        pasta = webapp.config.Config.PASTA_P
-        cache = webapp.config.Config.CACHE_P
-        env = webapp.config.Config.ENV_P
-    else:
-        msg = f"Requested PASTA environment not supported: {env}"
-        raise webapp.exceptions.PastaEnvironmentError(msg)
-
-    scope, identifier, revision = pid.strip().split(".")
-    eml_url = f"{pasta}/metadata/eml/{scope}/{identifier}/{revision}"
+    env = webapp.eml_store.get_env_config(env).env
 
-    try:
-        eml_bytes = webapp.utils.requests_wrapper(eml_url)
-    except ValueError as e:
-        log.error(e)
-        raise
-    except Exception as e:
-        log.error(e)
-        msg = f'Error accessing data package "{pid}" in the "' f'{env}" environment'
-        raise webapp.exceptions.DataPackageError(msg)
+    root_el = _get_eml_tree(pid, env, deannotate=True)
 
-    eml_path = pathlib.Path(cache, f'{safe_filename(pid)}.eml.xml')
-    eml_path.write_bytes(eml_bytes)
-
-    root_el = lxml.etree.fromstring(eml_bytes)
-
-    text_el_list = root_el.xpath(text_xpath)
+    with webapp.metrics.timer('xpath'):
+        text_el_list = webapp.xpath_cache.xpath(root_el, text_xpath)
     if not text_el_list:
         raise webapp.exceptions.DataPackageError(f'Element not found. text_xpath="{text_xpath}"')
 
@@ -122,8 +113,19 @@ def get_raw(
             f'There is more than one matching element. text_xpath="{text_xpath}" len="{len(text_el_list)}"'
         )
 
-    return webapp.utils.get_etree_as_pretty_printed_xml(text_el_list[0])
+    # The tree is shared, and has already been deannotated
+    with webapp.metrics.timer('serialize'):
+        return webapp.utils.get_etree_as_pretty_printed_xml(text_el_list[0], deannotate=False)
+
 
+def _get_eml_tree(pid: str, env: str, deannotate: bool = False) -> lxml.etree._Element:
+    try:
+        return webapp.eml_store.get_eml_tree(pid, env, deannotate)
+    except (ValueError, lxml.etree.XMLSyntaxError) as e:
+        log.error(e)
+        raise
+    except Exception as e:
+        log.error(e)
+        msg = f'Error accessing data package "{pid}" in the "' f'{env}" environment'
+        raise webapp.exceptions.DataPackageError(msg)
 
-def safe_filename(text_xpath):
-    return re.sub(r'[^a-zA-Z0-9]', '_', text_xpath)
@@ -0,0 +1,316 @@
+"""Request metrics, in the Prometheus text format
+
+Each worker process records:
+
+    - The time spent in each stage of handling a request, such as downloading the EML
+      document, parsing it, evaluating the XPath and the steps of rendering the HTML
+    - The duration of each request, by endpoint and status
+    - Hits and misses for each cache tier, by PASTA environment
+    - The status codes of the responses from PASTA
+    - Renderer fallbacks, such as from GitHub to the local markdown renderer
+
+With METRICS_DIR set, each process writes its totals to its own file in that directory
+every METRICS_FLUSH_INTERVAL seconds, and /metrics returns the sum over all the files.
+So the totals cover every worker, whichever worker handles the scrape. The files of
+workers that have exited are kept, so that the totals never go down while the service
+runs. The directory should be emptied when the service is started. Without
+METRICS_DIR, /metrics only reports the worker that handles the scrape.
+
+Recording takes a lock and updates a dict, and the files are written by a background
+thread, so requests do not wait for any I/O.
+
+The stage durations are also totalled for the request that is being handled in the
+current thread, if any, for the Server-Timing header (see webapp.profiling).
+"""
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import pathlib
+import threading
+import time
+
+import daiquiri
+import flask
+
+import webapp.cache_file
+import webapp.config
+
+log = daiquiri.getLogger(__name__)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+STAGE_SECONDS = 'ridare_stage_duration_seconds'
+REQUEST_SECONDS = 'ridare_request_duration_seconds'
+CACHE_TOTAL = 'ridare_cache_requests_total'
+UPSTREAM_TOTAL = 'ridare_upstream_responses_total'
+FALLBACK_TOTAL = 'ridare_renderer_fallbacks_total'
+
+METRIC_DICT = {
+    STAGE_SECONDS: (HISTOGRAM, 'Time spent in each stage of handling a request.'),
+    REQUEST_SECONDS: (HISTOGRAM, 'Time to handle a request, by endpoint and status.'),
+    CACHE_TOTAL: (COUNTER, 'Cache lookups, by tier, PASTA environment and result.'),
+    UPSTREAM_TOTAL: (COUNTER, 'Responses from PASTA, by server and status code.'),
+    FALLBACK_TOTAL: (COUNTER, 'Renders that fell back to another renderer.'),
+}
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKET_TUPLE = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+FILE_SUFFIX = '.json'
+
+_lock = threading.Lock()
+# (name, labels) -> value
+_counter_dict = {}
+# (name, labels) -> [count per bucket, with +Inf last, sum]
+_histogram_dict = {}
+_is_dirty = False
+_file_name = None
+_flusher_thread = None
+# Stage -> total seconds, for the request being handled in this context
+_request_stage_var = contextvars.ContextVar('request_stage_dict', default=None)
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Add value to a counter"""
+    global _is_dirty
+    if not webapp.config.Config.METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counter_dict[key] = _counter_dict.get(key, 0) + value
+        _is_dirty = True
+    _start_flusher()
+
+
+def observe(name: str, value: float, **labels):
+    """Add an observation to a histogram"""
+    global _is_dirty
+    if not webapp.config.Config.METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    i = bisect.bisect_left(BUCKET_TUPLE, value)
+    with _lock:
+        bucket_list = _histogram_dict.get(key)
+        if bucket_list is None:
+            bucket_list = _histogram_dict[key] = [0] * (len(BUCKET_TUPLE) + 2)
+        bucket_list[i] += 1
+        bucket_list[-1] += value
+        _is_dirty = True
+    _start_flusher()
+
+
+@contextlib.contextmanager
+def timer(stage: str):
+    """Record the time spent in a stage. Can also be used as a function decorator."""
+    start_ts = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_sec = time.perf_counter() - start_ts
+        observe(STAGE_SECONDS, elapsed_sec, stage=stage)
+        add_request_time(stage, elapsed_sec)
+
+
+def start_request_stages():
+    """Start totalling the stage durations for the request in this context"""
+    _request_stage_var.set({})
+
+
+def stop_request_stages() -> dict[str, float]:
+    """Stop totalling the stage durations, and return the totals"""
+    stage_dict = _request_stage_var.get()
+    _request_stage_var.set(None)
+    return stage_dict or {}
+
+
+def get_request_stages() -> dict[str, float]:
+    return dict(_request_stage_var.get() or {})
+
+
+def add_request_time(stage: str, elapsed_sec: float):
+    """Add to the total for a stage of the request in this context, without recording it
+    in the histograms"""
+    stage_dict = _request_stage_var.get()
+    if stage_dict is not None:
+        stage_dict[stage] = stage_dict.get(stage, 0) + elapsed_sec
+
+
+def count_cache(tier: str, env: str, is_hit: bool):
+    inc(CACHE_TOTAL, tier=tier, env=env, result='hit' if is_hit else 'miss')
+
+
+def init_app(app: flask.Flask):
+    """Record the duration of each request"""
+
+    @app.before_request
+    def start_request_timer():
+        flask.g.metrics_start_ts = time.perf_counter()
+
+    @app.after_request
+    def stop_request_timer(response: flask.Response) -> flask.Response:
+        start_ts = flask.g.pop('metrics_start_ts', None)
+        if start_ts is not None:
+            observe(
+                REQUEST_SECONDS,
+                time.perf_counter() - start_ts,
+                endpoint=flask.request.endpoint or 'none',
+                status=str(response.status_code),
+            )
+        return response
+
+
+def render() -> str:
+    """Return the metrics of all worker processes in the Prometheus text format"""
+    metrics_dir = webapp.config.Config.METRICS_DIR
+    if metrics_dir:
+        flush()
+        counter_dict, histogram_dict = _read_dir(pathlib.Path(metrics_dir))
+    else:
+        counter_dict, histogram_dict = _snapshot()
+    line_list = []
+    for name, (metric_type, help_str) in METRIC_DICT.items():
+        line_list.append(f'# HELP {name} {help_str}')
+        line_list.append(f'# TYPE {name} {metric_type}')
+        if metric_type == COUNTER:
+            for (key_name, labels), value in sorted(counter_dict.items()):
+                if key_name == name:
+                    line_list.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        else:
+            for (key_name, labels), bucket_list in sorted(histogram_dict.items()):
+                if key_name == name:
+                    line_list.extend(_format_histogram(name, labels, bucket_list))
+    return '\n'.join(line_list) + '\n'
+
+
+def flush():
+    """Write the metrics of this process to its file in METRICS_DIR, if they have changed"""
+    global _is_dirty
+    metrics_dir = webapp.config.Config.METRICS_DIR
+    if not metrics_dir:
+        return
+    with _lock:
+        if not _is_dirty:
+            return
+        _is_dirty = False
+    counter_dict, histogram_dict = _snapshot()
+    state_dict = {
+        COUNTER: [[name, labels, value] for (name, labels), value in counter_dict.items()],
+        HISTOGRAM: [
+            [name, labels, bucket_list] for (name, labels), bucket_list in histogram_dict.items()
+        ],
+    }
+    dir_path = pathlib.Path(metrics_dir)
+    dir_path.mkdir(parents=True, exist_ok=True)
+    webapp.cache_file.write_text(dir_path / _get_file_name(), json.dumps(state_dict))
+
+
+def clear():
+    """Reset the metrics of this process"""
+    global _is_dirty
+    with _lock:
+        _counter_dict.clear()
+        _histogram_dict.clear()
+        _is_dirty = True
+
+
+def _snapshot() -> tuple[dict, dict]:
+    with _lock:
+        return dict(_counter_dict), {k: list(v) for k, v in _histogram_dict.items()}
+
+
+def _read_dir(dir_path: pathlib.Path) -> tuple[dict, dict]:
+    """Return the sum of the metrics in the files of all worker processes"""
+    counter_dict = {}
+    histogram_dict = {}
+    for file_path in dir_path.glob(f'*{FILE_SUFFIX}'):
+        try:
+            state_dict = json.loads(file_path.read_bytes())
+        except (OSError, ValueError) as e:
+            log.warning(f'Skipping metrics file. path="{file_path}" error="{e}"')
+            continue
+        for name, labels, value in state_dict[COUNTER]:
+            key = (name, tuple(map(tuple, labels)))
+            counter_dict[key] = counter_dict.get(key, 0) + value
+        for name, labels, bucket_list in state_dict[HISTOGRAM]:
+            key = (name, tuple(map(tuple, labels)))
+            total_list = histogram_dict.setdefault(key, [0] * len(bucket_list))
+            for i, v in enumerate(bucket_list):
+                total_list[i] += v
+    return counter_dict, histogram_dict
+
+
+def _format_histogram(name: str, labels: tuple, bucket_list: list) -> list[str]:
+    line_list = []
+    count = 0
+    for bound, bucket_count in zip((*BUCKET_TUPLE, '+Inf'), bucket_list):
+        count += bucket_count
+        le_labels = (*labels, ('le', str(bound)))
+        line_list.append(f'{name}_bucket{_format_labels(le_labels)} {count}')
+    line_list.append(f'{name}_sum{_format_labels(labels)} {_format_value(bucket_list[-1])}')
+    line_list.append(f'{name}_count{_format_labels(labels)} {count}')
+    return line_list
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    label_str = ','.join(
+        '{}="{}"'.format(
+            k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        )
+        for k, v in labels
+    )
+    return f'{{{label_str}}}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _get_file_name() -> str:
+    """Return the name of the file for this process. The start time is included, so that a
+    new process with the same pid as an earlier one does not overwrite its totals."""
+    global _file_name
+    if _file_name is None:
+        _file_name = f'{os.getpid()}-{time.time_ns()}{FILE_SUFFIX}'
+    return _file_name
+
+
+def _start_flusher():
+    global _flusher_thread
+    if _flusher_thread is not None or not webapp.config.Config.METRICS_DIR:
+        return
+    with _lock:
+        if _flusher_thread is not None:
+            return
+        _flusher_thread = threading.Thread(target=_flush_loop, name='metrics', daemon=True)
+    _flusher_thread.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(webapp.config.Config.METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:  # pylint: disable=broad-except
+            log.error(f'Failed to write metrics: {e}')
+
+
+def _after_fork_in_child():
+    """Start over in a forked worker, as the totals of the parent are in its own file"""
+    global _lock, _is_dirty, _file_name, _flusher_thread
+    _lock = threading.Lock()
+    _counter_dict.clear()
+    _histogram_dict.clear()
+    _is_dirty = False
+    _file_name = None
+    _flusher_thread = None
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -1,13 +1,21 @@
 """Helper functions for handling multi-query requests in the webapp."""
 
+import collections
+import concurrent.futures
+import copy
+import itertools
 import logging
 import re
+import threading
+import time
 
 import flask
 from flask import request, jsonify
 import lxml.etree
-from webapp.utils import get_eml
+from webapp.eml_store import get_env_config, get_eml_tree
 import webapp.config
+import webapp.metrics
+import webapp.xpath_cache
 from webapp.exceptions import DataPackageError, PastaEnvironmentError
 
 
@@ -15,6 +23,13 @@ logger = logging.getLogger(__name__)
 
 # pylint: disable=c-extension-no-member
 
+RESULTSET_XML_DECLARATION = b"<?xml version='1.0' encoding='utf-8'?>\n"
+
+# One pool of fetch threads per PASTA environment, shared by all requests, so that the
+# concurrency cap also bounds the total load that a worker puts on each environment.
+_executor_dict: dict[str, concurrent.futures.ThreadPoolExecutor] = {}
+_executor_lock = threading.Lock()
+
 
 def validate_env(env: str) -> None:
     """Raise PastaEnvironmentError if env is not valid."""
@@ -58,20 +73,98 @@ def is_valid_xml_tag(tag: str) -> bool:
 
 
 def run_xpath_query(root: lxml.etree._Element, xpath: str) -> list:
-    """Run an XPath query on the XML root, logging and returning an empty list on error."""
+    """Run an XPath query on the XML root, logging and returning an empty list on error.
+
+    Compiled queries are cached (see webapp.xpath_cache). Invalid queries are logged when
+    first seen, and then return an empty list without further errors.
+    """
+    compiled_xpath = webapp.xpath_cache.get_or_none(xpath)
+    if compiled_xpath is None:
+        return []
     try:
-        return root.xpath(xpath)
+        with webapp.metrics.timer('xpath'):
+            return compiled_xpath(root)
     except Exception as e:  # pylint: disable=broad-except
         logger.exception("Failed to retrieve or parse XPath '%s': %s", xpath, str(e))
         return []
 
 
+def get_fetch_concurrency(env: str) -> int:
+    """Return the maximum number of EML documents to fetch in parallel from env."""
+    config = webapp.config.Config
+    return {
+        config.ENV_P: config.MULTI_FETCH_CONCURRENCY_P,
+        config.ENV_S: config.MULTI_FETCH_CONCURRENCY_S,
+        config.ENV_D: config.MULTI_FETCH_CONCURRENCY_D,
+    }[get_env_config(env).env]
+
+
+def _get_executor(env: str) -> concurrent.futures.ThreadPoolExecutor:
+    with _executor_lock:
+        executor = _executor_dict.get(env)
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=get_fetch_concurrency(env), thread_name_prefix=f'fetch-{env}'
+            )
+            _executor_dict[env] = executor
+        return executor
+
+
+def _get_eml_tree_or_none(pid: str, env: str) -> lxml.etree._Element | None:
+    """Return the EML tree for pid, or None if it could not be retrieved or parsed."""
+    try:
+        return get_eml_tree(pid, env)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception("Failed to retrieve or parse EML for PID %s: %s", pid, str(e))
+        return None
+
+
+def iter_eml_trees(pids: list[str], env: str):
+    """Yield (pid, EML tree or None) for each pid, in the order of pids.
+
+    The documents are fetched and parsed in parallel, up to the concurrency cap for env.
+    Fetching only runs a small window ahead of the caller, so that the number of trees
+    that are held for a request does not grow with the number of pids.
+    """
+    concurrency = get_fetch_concurrency(env)
+    if len(pids) < 2 or concurrency < 2:
+        for pid in pids:
+            yield pid, _get_eml_tree_or_none(pid, env)
+        return
+    executor = _get_executor(env)
+    pid_iter = iter(pids)
+    pending_deque = collections.deque(
+        (pid, executor.submit(_get_eml_tree_or_none, pid, env))
+        for pid in itertools.islice(pid_iter, 2 * concurrency)
+    )
+    try:
+        while pending_deque:
+            pid, future = pending_deque.popleft()
+            for next_pid in itertools.islice(pid_iter, 1):
+                pending_deque.append(
+                    (next_pid, executor.submit(_get_eml_tree_or_none, next_pid, env))
+                )
+            # The documents are fetched and parsed by the pool, so the time that the
+            # request waits for them is counted as fetching
+            start_ts = time.perf_counter()
+            root = future.result()
+            webapp.metrics.add_request_time("fetch", time.perf_counter() - start_ts)
+            yield pid, root
+    finally:
+        # Do not leave fetches queued if the caller stops early
+        for _, future in pending_deque:
+            future.cancel()
+
+
 def wrap_query_result(key: str, values: list) -> lxml.etree._Element:
-    """Wrap XPath results in an XML element with the given key as tag name."""
+    """Wrap XPath results in an XML element with the given key as tag name.
+
+    Elements are copied, so that the (shared) tree they were selected from is not modified.
+    """
     wrapper = lxml.etree.Element(key)
     for v in values:
         if isinstance(v, lxml.etree._Element):  # pylint: disable=protected-access
-            wrapper.append(v)
+            wrapper.append(copy.deepcopy(v))
         else:
             value_el = lxml.etree.Element("value")
             value_el.text = str(v)
@@ -79,6 +172,63 @@ def wrap_query_result(key: str, values: list) -> lxml.etree._Element:
     return wrapper
 
 
+def build_pid_results(
+    root: lxml.etree._Element, queries: list[str | dict[str, str]]
+) -> list[lxml.etree._Element | str]:
+    """Run XPath queries on one EML document and return the results.
+
+    The EML trees are shared through webapp.eml_store, so elements in the results are
+    copies, and can be added to the response without modifying the shared trees.
+    """
+    pid_results: list[lxml.etree._Element | str] = []
+    for item in queries:
+        if isinstance(item, str):
+            # Simple XPath string
+            values = run_xpath_query(root, item)
+            pid_results.extend(
+                copy.deepcopy(v)
+                if isinstance(v, lxml.etree._Element)  # pylint: disable=protected-access
+                else v
+                for v in values
+            )
+        elif isinstance(item, dict) and len(item) == 1:
+            key, xpath = next(iter(item.items()))
+            if not is_valid_xml_tag(key):
+                # Skip invalid tag names
+                continue
+            values = run_xpath_query(root, xpath)
+            if not values:
+                # Skip if no nodes found
+                continue
+            wrapper = wrap_query_result(key, values)
+            pid_results.append(wrapper)
+    return pid_results
+
+
+def iter_multi_results(
+    pids: list[str],
+    queries: list[str | dict[str, str]],
+    env: str,
+):
+    """Yield (pid, results) for each pid whose EML could be retrieved and parsed, and
+    queried, in the order of pids. Repeated pids are only processed once. See
+    build_multi_results().
+
+    A pid whose queries fail, e.g., because an XPath returns a number instead of a list of
+    nodes, is logged and left out, so that a streamed response is still a complete
+    document.
+    """
+    for pid, root in iter_eml_trees(list(dict.fromkeys(pids)), env):
+        if root is None:
+            continue
+        try:
+            pid_results = build_pid_results(root, queries)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception("Failed to run queries on EML for PID %s: %s", pid, str(e))
+            continue
+        yield pid, pid_results
+
+
 def build_multi_results(
     pids: list[str],
     queries: list[str | dict[str, str]],
@@ -89,32 +239,48 @@ def build_multi_results(
     Each PID is processed independently. For each query:
       - If a string, run as a simple XPath.
       - If a dict, use key as wrapper tag and value as XPath.
-    Results are collected per PID.
+    Results are collected per PID, in the order of pids. PIDs whose EML could not be
+    retrieved, parsed or queried are left out. The EML documents are fetched in parallel (see
+    iter_eml_trees()).
     """
-    results: dict[str, list[lxml.etree._Element | str]] = {}
-    for pid in pids:
-        try:
-            eml_bytes: bytes = get_eml(pid, env)
-            root: lxml.etree._Element = lxml.etree.fromstring(eml_bytes)
-        except Exception as e:  # pylint: disable=broad-except
-            logger.exception("Failed to retrieve or parse EML for PID %s: %s", pid, str(e))
-            continue
-        pid_results: list[lxml.etree._Element | str] = []
-        for item in queries:
-            if isinstance(item, str):
-                # Simple XPath string
-                values = run_xpath_query(root, item)
-                pid_results.extend(values)
-            elif isinstance(item, dict) and len(item) == 1:
-                key, xpath = next(iter(item.items()))
-                if not is_valid_xml_tag(key):
-                    # Skip invalid tag names
-                    continue
-                values = run_xpath_query(root, xpath)
-                if not values:
-                    # Skip if no nodes found
-                    continue
-                wrapper = wrap_query_result(key, values)
-                pid_results.append(wrapper)
-        results[pid] = pid_results
-    return results
+    return dict(iter_multi_results(pids, queries, env))
+
+
+def build_document_el(pid: str, pid_results: list) -> lxml.etree._Element:
+    """Return the <document> element for the results of one pid."""
+    document_el = lxml.etree.Element("document")
+    packageid_el = lxml.etree.SubElement(document_el, "packageid")
+    packageid_el.text = pid
+    for v in pid_results:
+        if isinstance(v, lxml.etree._Element):  # pylint: disable=protected-access
+            document_el.append(v)
+        else:
+            value_el = lxml.etree.SubElement(document_el, "value")
+            value_el.text = str(v)
+    return document_el
+
+
+def iter_resultset_xml(results):
+    """Serialize (pid, results) pairs to a pretty printed <resultset> document, one
+    <document> at a time.
+
+    Each <document> is serialized as the only child of a temporary <resultset>, and cut
+    out of it, so that the output is the same as when the complete <resultset> tree is
+    pretty printed, while only one <document> is held in memory at a time.
+    """
+    started = False
+    for pid, pid_results in results:
+        resultset_el = lxml.etree.Element("resultset")
+        resultset_el.append(build_document_el(pid, pid_results))
+        with webapp.metrics.timer("serialize"):
+            xml_bytes = lxml.etree.tostring(
+                resultset_el, pretty_print=True, encoding="utf-8", xml_declaration=False
+            )
+        if not started:
+            yield RESULTSET_XML_DECLARATION + b"<resultset>\n"
+            started = True
+        yield xml_bytes[len(b"<resultset>\n") : -len(b"</resultset>\n")]
+    if started:
+        yield b"</resultset>\n"
+    else:
+        yield RESULTSET_XML_DECLARATION + b"<resultset/>\n"
@@ -0,0 +1,215 @@
+"""Filling the cache ahead of the first requests
+
+After a deploy or a cache wipe, the first request for each element pays for downloading
+the EML document from PASTA and rendering the element. `flask cache-prewarm` does this
+work in advance for a list of data packages:
+
+    - The EML documents are downloaded through webapp.eml_store, with up to
+      MULTI_FETCH_CONCURRENCY_* downloads from PASTA at a time.
+    - The elements are rendered by a pool of processes, one per CPU by default, through
+      webapp.markdown_cache, so they are written to the same cache files that requests
+      read.
+    - Elements that are already in the cache are skipped, and documents are only
+      downloaded for packages that have elements left to render. So an interrupted run is
+      resumed by running it again.
+
+Elements that are not in a document, or that match more than one element in it, are not
+cached, as requests for them are errors. These are counted as not found, and are looked
+up again on each run, which only reads the EML document from the cache.
+"""
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+from typing import Callable
+
+import daiquiri
+
+import webapp.cache_key
+import webapp.compression
+import webapp.config
+import webapp.eml_store
+import webapp.exceptions
+import webapp.markdown_cache
+import webapp.multi_helpers
+import webapp.utils
+
+log = daiquiri.getLogger(__name__)
+
+DEFAULT_XPATH_TUPLE = (
+    '//dataset/abstract',
+    '//dataset/methods/methodStep/description',
+    '//dataset/project/relatedProject/abstract',
+    '//dataset/project/relatedProject/funding',
+)
+
+# Element counts
+CACHED = 'cached'
+RENDERED = 'rendered'
+NOT_FOUND = 'not_found'
+ERROR = 'error'
+# Package counts
+FETCH_ERROR = 'fetch_error'
+
+
+def prewarm(
+    pid_list: list[str],
+    xpath_list: list[str],
+    env: str,
+    fetch_concurrency: int | None = None,
+    process_count: int | None = None,
+    on_done: Callable[[str, collections.Counter], None] | None = None,
+) -> collections.Counter:
+    """Render the elements at xpath_list in the data packages in pid_list into the cache.
+
+    Returns the number of elements that were CACHED, RENDERED, NOT_FOUND or failed with an
+    ERROR, and the number of packages that could not be downloaded (FETCH_ERROR).
+    on_done is called with each pid, and its counts, as it is completed.
+    """
+    _, cache, env = webapp.eml_store.get_env_config(env)
+    fetch_concurrency = fetch_concurrency or webapp.multi_helpers.get_fetch_concurrency(env)
+    process_count = process_count or os.cpu_count() or 1
+    total_counter = collections.Counter()
+
+    def done(pid_, counter):
+        total_counter.update(counter)
+        if on_done is not None:
+            on_done(pid_, counter)
+
+    todo_list = []
+    for pid in dict.fromkeys(webapp.cache_key.normalize_pid(pid) for pid in pid_list):
+        missing_list = [x for x in xpath_list if not is_cached(pid, x, cache)]
+        if missing_list:
+            todo_list.append((pid, missing_list))
+        else:
+            done(pid, collections.Counter({CACHED: len(xpath_list)}))
+    if not todo_list:
+        return total_counter
+
+    # Processes are started with spawn, as forking a process that runs threads is not
+    # safe. The new processes get the configuration of this one.
+    fetch_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=fetch_concurrency, thread_name_prefix=f'prewarm-{env}'
+    )
+    render_executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=process_count,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(_get_config_dict(),),
+    )
+    # Only a window of packages is in progress at a time, so that downloads do not run
+    # far ahead of rendering
+    window_size = 2 * (fetch_concurrency + process_count)
+    todo_iter = iter(todo_list)
+    fetch_dict = {}
+    render_dict = {}
+    try:
+        while True:
+            for pid, missing_list in itertools.islice(
+                todo_iter, window_size - len(fetch_dict) - len(render_dict)
+            ):
+                future = fetch_executor.submit(webapp.eml_store.get_eml, pid, env)
+                fetch_dict[future] = pid, missing_list
+            if not (fetch_dict or render_dict):
+                break
+            done_set, _ = concurrent.futures.wait(
+                [*fetch_dict, *render_dict], return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done_set:
+                if future in fetch_dict:
+                    pid, missing_list = fetch_dict.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:  # pylint: disable=broad-except
+                        log.error('Failed to download EML for PID %s: %s', pid, str(e))
+                        done(pid, collections.Counter({FETCH_ERROR: 1}))
+                        continue
+                    future = render_executor.submit(_render, pid, missing_list, env)
+                    render_dict[future] = pid, missing_list
+                else:
+                    pid, missing_list = render_dict.pop(future)
+                    try:
+                        counter = future.result()
+                    except concurrent.futures.BrokenExecutor:
+                        raise
+                    except Exception as e:  # pylint: disable=broad-except
+                        log.error('Failed to render PID %s: %s', pid, str(e))
+                        counter = collections.Counter({ERROR: len(missing_list)})
+                    if len(missing_list) < len(xpath_list):
+                        counter[CACHED] += len(xpath_list) - len(missing_list)
+                    done(pid, counter)
+    finally:
+        fetch_executor.shutdown(cancel_futures=True)
+        render_executor.shutdown(cancel_futures=True)
+    return total_counter
+
+
+def is_cached(pid: str, text_xpath: str, cache: str) -> bool:
+    """Return True if the HTML for an element is in the cache, in either form"""
+    html_path = webapp.cache_key.get_html_path(pid, text_xpath, cache)
+    return html_path.is_file() or webapp.compression.get_gzip_path(html_path).is_file()
+
+
+def resolve_scope(
+    scope_prefix: str,
+    env: str,
+    all_revisions: bool = False,
+    fetch_concurrency: int | None = None,
+) -> list[str]:
+    """Return the pids of the data packages in PASTA scopes that start with scope_prefix.
+
+    Only the newest revision of each data package is included, unless all_revisions is set.
+    """
+    pasta, _, env = webapp.eml_store.get_env_config(env)
+    fetch_concurrency = fetch_concurrency or webapp.multi_helpers.get_fetch_concurrency(env)
+    scope_list = [s for s in _get_lines(f'{pasta}/eml') if s.startswith(scope_prefix)]
+    revision_filter = '' if all_revisions else '?filter=newest'
+    with concurrent.futures.ThreadPoolExecutor(max_workers=fetch_concurrency) as executor:
+        identifier_list = [
+            (scope, identifier)
+            for scope, scope_identifier_list in zip(
+                scope_list, executor.map(lambda s: _get_lines(f'{pasta}/eml/{s}'), scope_list)
+            )
+            for identifier in scope_identifier_list
+        ]
+        revision_list_iter = executor.map(
+            lambda t: _get_lines(f'{pasta}/eml/{t[0]}/{t[1]}{revision_filter}'),
+            identifier_list,
+        )
+        return [
+            f'{scope}.{identifier}.{revision}'
+            for (scope, identifier), revision_list in zip(identifier_list, revision_list_iter)
+            for revision in revision_list
+        ]
+
+
+def _get_lines(url: str) -> list[str]:
+    text = webapp.utils.requests_wrapper(url).decode('utf-8')
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def _get_config_dict() -> dict:
+    config = webapp.config.Config
+    return {k: getattr(config, k) for k in dir(config) if k.isupper()}
+
+
+def _init_worker(config_dict: dict):
+    for k, v in config_dict.items():
+        setattr(webapp.config.Config, k, v)
+
+
+def _render(pid: str, xpath_list: list[str], env: str) -> collections.Counter:
+    """Render the elements of a data package into the cache. Runs in a worker process."""
+    counter = collections.Counter()
+    for text_xpath in xpath_list:
+        try:
+            webapp.markdown_cache.get_html_data(pid, text_xpath, env)
+        except webapp.exceptions.DataPackageError:
+            counter[NOT_FOUND] += 1
+        except Exception as e:  # pylint: disable=broad-except
+            log.error('Failed to render "%s" in PID %s: %s', text_xpath, pid, str(e))
+            counter[ERROR] += 1
+        else:
+            counter[RENDERED] += 1
+    return counter
@@ -0,0 +1,148 @@
+"""Server-Timing headers and profiling of single requests
+
+Responses from the HTML, raw XML and /multi endpoints carry a Server-Timing header with
+the time spent in each stage of the request, in milliseconds:
+
+    Server-Timing: fetch;dur=12.1, parse;dur=3.4, xpath;dur=0.1, render;dur=40.2,
+        serialize;dur=0.8, total;dur=57.3
+
+The stages are those of webapp.metrics, totalled over the request. fetch is the time
+spent getting the EML document from memory, the cache or PASTA. For /multi, the
+documents are fetched and parsed in parallel, and fetch is the time that the request
+waited for them. render includes the serialization of the rendered HTML. Streamed
+/multi responses do the work after the headers are sent, so their header only covers
+the time before the response started.
+
+A request from one of the WHITE_LIST addresses in config.py can add ?profile=1 to get a
+profile of the request instead of the response. The request is run under cProfile, and
+the response is a text summary with the functions that took the most time, sorted by
+cumulative time, or by another pstats sort key given as the value of the parameter, and
+the peak memory allocated while handling the request, as traced by tracemalloc. Only
+the thread that handles the request is profiled. Tracing memory slows down the whole
+process, and one request is profiled at a time per process.
+
+The address of the client is taken from X-Real-IP, as set by nginx in
+deployment/ridare.nginx, if the request comes from the local host or a Unix socket.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+
+import flask
+
+import webapp.config
+import webapp.metrics
+
+SERVER_TIMING_ENDPOINT_SET = {'markdown', 'raw', 'multi'}
+SERVER_TIMING_STAGE_TUPLE = ('fetch', 'parse', 'xpath', 'render', 'serialize')
+PROFILE_PARAM = 'profile'
+PROFILE_SORT_SET = {'calls', 'cumulative', 'ncalls', 'pcalls', 'time', 'tottime'}
+LOCAL_ADDRESS_SET = {'127.0.0.1', '::1'}
+
+_profile_lock = threading.Lock()
+
+
+def init_app(app: flask.Flask):
+    @app.before_request
+    def start_request():
+        flask.g.profiling_start_ts = time.perf_counter()
+        webapp.metrics.start_request_stages()
+        if PROFILE_PARAM in flask.request.args:
+            _start_profile()
+
+    @app.after_request
+    def finish_request(response: flask.Response) -> flask.Response:
+        profile = flask.g.pop('profile', None)
+        if profile is not None:
+            response = _finish_profile(profile, response)
+        elif flask.request.endpoint in SERVER_TIMING_ENDPOINT_SET:
+            response.headers['Server-Timing'] = get_server_timing(
+                webapp.metrics.get_request_stages(), _get_elapsed_sec()
+            )
+        return response
+
+    @app.teardown_request
+    def stop_request(_exc):
+        webapp.metrics.stop_request_stages()
+        profile = flask.g.pop('profile', None)
+        if profile is not None:
+            _stop_profile(profile)
+
+
+def get_server_timing(stage_dict: dict[str, float], total_sec: float) -> str:
+    """Return a Server-Timing header value for stage durations given in seconds"""
+    timing_list = [
+        f'{stage};dur={stage_dict.get(stage, 0) * 1000:.1f}'
+        for stage in SERVER_TIMING_STAGE_TUPLE
+    ]
+    timing_list.append(f'total;dur={total_sec * 1000:.1f}')
+    return ', '.join(timing_list)
+
+
+def get_client_address() -> str | None:
+    remote_addr = flask.request.remote_addr
+    if not remote_addr or remote_addr in LOCAL_ADDRESS_SET:
+        return flask.request.headers.get('X-Real-IP', remote_addr)
+    return remote_addr
+
+
+def _start_profile():
+    config = webapp.config.Config
+    if not config.PROFILE_ENABLED or get_client_address() not in config.WHITE_LIST:
+        flask.abort(403, description='Profiling is not allowed from this address')
+    if not _profile_lock.acquire(blocking=False):
+        flask.abort(503, description='Another request is being profiled')
+    tracemalloc.start()
+    profile = cProfile.Profile()
+    flask.g.profile = profile
+    profile.enable()
+
+
+def _stop_profile(profile: cProfile.Profile) -> int:
+    """Stop profiling, and return the peak traced memory in bytes"""
+    profile.disable()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    _profile_lock.release()
+    return peak_bytes
+
+
+def _finish_profile(profile: cProfile.Profile, response: flask.Response) -> flask.Response:
+    # Profiling is always stopped here, so that a failure does not leave the lock held and
+    # memory traced
+    try:
+        if response.direct_passthrough:
+            # The body is a file that the server sends as is, e.g., with sendfile
+            size_str = f'{response.content_length:,}' if response.content_length else 'unknown'
+        else:
+            # Run streamed responses to completion, so that the work is included
+            size_str = f'{len(response.get_data()):,}'
+    finally:
+        peak_bytes = _stop_profile(profile)
+        response.close()
+    sort_key = flask.request.args.get(PROFILE_PARAM)
+    if sort_key not in PROFILE_SORT_SET:
+        sort_key = 'cumulative'
+    stats_file = io.StringIO()
+    stats = pstats.Stats(profile, stream=stats_file)
+    stats.sort_stats(sort_key).print_stats(webapp.config.Config.PROFILE_TOP_N)
+    server_timing = get_server_timing(webapp.metrics.get_request_stages(), _get_elapsed_sec())
+    text_str = (
+        f'Profile of {flask.request.method} {flask.request.full_path}\n'
+        f'Status: {response.status}\n'
+        f'Response size: {size_str} bytes\n'
+        f'Peak traced memory: {peak_bytes:,} bytes\n'
+        f'Server-Timing: {server_timing}\n'
+        f'{stats_file.getvalue()}'
+    )
+    profile_response = flask.Response(text_str, content_type='text/plain; charset=utf-8')
+    profile_response.headers['Server-Timing'] = server_timing
+    profile_response.cache_control.no_store = True
+    return profile_response
+
+
+def _get_elapsed_sec() -> float:
+    return time.perf_counter() - flask.g.get('profiling_start_ts', time.perf_counter())
@@ -0,0 +1,116 @@
+"""Content addressed cache of rendered HTML
+
+The HTML for a TextType element depends only on the content of the element, so renders
+are stored under a hash of the element instead of under the pid and XPath that it was
+found with. A new revision of a package that has the same abstract, or packages that
+share boilerplate funding or methods text, then reuse the same render.
+
+The hash is taken over the exclusive C14N serialization of the element, so it does not
+change with the formatting of the EML document, or with namespace declarations that are
+not used within the element. The renderer version and markdown renderer are included as
+well, so that renders are not reused after a change that affects the HTML.
+
+Renders are stored below <cache>/render, in the same sharded layout as the per pid cache
+files. See webapp.cache_layout.
+"""
+import collections
+import hashlib
+import os
+import pathlib
+
+import lxml.etree
+
+import webapp.cache_file
+import webapp.cache_layout
+import webapp.compression
+import webapp.config
+import webapp.eml_text_type
+import webapp.metrics
+
+RENDER_DIR_NAME = 'render'
+
+# Hit and miss counters for this process
+_stats = collections.Counter()
+
+
+def get_content_key(text_type_el: lxml.etree.Element) -> str:
+    """Return the hash of the content of a TextType element and the renderer version"""
+    hash_obj = hashlib.sha256()
+    hash_obj.update(f'{webapp.eml_text_type.get_renderer_id()}\n'.encode('utf-8'))
+    hash_obj.update(
+        lxml.etree.tostring(text_type_el, method='c14n', exclusive=True, with_comments=True)
+    )
+    return hash_obj.hexdigest()
+
+
+def get_render_path(cache: str, content_key: str) -> pathlib.Path:
+    return webapp.cache_layout.get_path(
+        pathlib.Path(cache, RENDER_DIR_NAME), content_key, f'{content_key}.html'
+    )
+
+
+def text_to_html(text_type_el: lxml.etree.Element, cache: str, env: str) -> str:
+    """Return the HTML for a TextType element, reusing the render of any earlier element
+    with the same content. env is the PASTA environment of the cache."""
+    render_path = get_render_path(cache, get_content_key(text_type_el))
+    if webapp.config.Config.USE_CACHE:
+        html_bytes = webapp.compression.read_decoded(
+            render_path, webapp.cache_file.is_valid_html
+        )
+        if html_bytes is not None:
+            _stats['hits'] += 1
+            webapp.metrics.count_cache('render', env, True)
+            return html_bytes.decode('utf-8')
+    _stats['misses'] += 1
+    webapp.metrics.count_cache('render', env, False)
+    with webapp.metrics.timer('render'):
+        html_str = webapp.eml_text_type.text_to_html(text_type_el)
+    render_path.parent.mkdir(parents=True, exist_ok=True)
+    webapp.compression.write(render_path, html_str.encode('utf-8'))
+    return html_str
+
+
+def get_stats() -> dict:
+    return {'hits': _stats['hits'], 'misses': _stats['misses']}
+
+
+def get_report(cache: str) -> dict:
+    """Return statistics on how much the content addressed layer deduplicates the per
+    pid HTML cache files in a cache directory.
+
+    The per pid files hold copies of the renders, so the number of distinct renders
+    needed to produce them is the number of distinct file contents.
+    """
+    cache_path = pathlib.Path(cache)
+    html_count = 0
+    html_bytes = 0
+    content_dict = {}
+    for html_path in _iter_html_paths(cache_path, skip_dir_name=RENDER_DIR_NAME):
+        stored_bytes = html_path.read_bytes()
+        content_bytes = stored_bytes
+        if html_path.name.endswith(webapp.compression.GZIP_SUFFIX):
+            content_bytes = webapp.compression.decode(stored_bytes, webapp.compression.GZIP)
+        html_count += 1
+        html_bytes += len(stored_bytes)
+        content_dict.setdefault(hashlib.sha256(content_bytes).digest(), len(stored_bytes))
+    render_path_list = list(_iter_html_paths(cache_path / RENDER_DIR_NAME))
+    return {
+        'html_count': html_count,
+        'html_bytes': html_bytes,
+        'distinct_count': len(content_dict),
+        'distinct_bytes': sum(content_dict.values()),
+        'saved_renders': html_count - len(content_dict),
+        'render_count': len(render_path_list),
+        'render_bytes': sum(p.stat().st_size for p in render_path_list),
+    }
+
+
+def _iter_html_paths(dir_path: pathlib.Path, skip_dir_name: str = None):
+    """Yield the HTML cache files in a directory, in both the sharded and legacy
+    layouts"""
+    for root_str, dir_list, file_list in os.walk(dir_path):
+        if pathlib.Path(root_str) == dir_path and skip_dir_name in dir_list:
+            dir_list.remove(skip_dir_name)
+        for file_name in file_list:
+            if file_name.endswith(('.html', '.html.gz')) and not file_name.startswith('.'):
+                yield pathlib.Path(root_str, file_name)
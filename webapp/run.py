@@ -6,15 +6,23 @@ import os
 
 import daiquiri
 import flask
-import lxml.etree
+import werkzeug.http
 
+import webapp.cache_sweeper
+import webapp.cli
+import webapp.compression
+import webapp.file_response
+import webapp.http_cache
 import webapp.markdown_cache
+import webapp.metrics
+import webapp.profiling
 import webapp.config
 import webapp.utils
 import webapp.exceptions
+import webapp.xslt
 from webapp.exceptions import DataPackageError, PastaEnvironmentError
 from webapp.multi_helpers import (
-    validate_env, parse_json_request, validate_payload, build_multi_results
+    validate_env, parse_json_request, validate_payload, iter_multi_results, iter_resultset_xml
 )
 
 cwd = os.path.dirname(os.path.realpath(__file__))
@@ -24,6 +32,15 @@ logger = daiquiri.getLogger("run.py: " + __name__)
 
 app = flask.Flask(__name__)
 app.config.from_object(webapp.config.Config)
+webapp.cli.init_app(app)
+webapp.metrics.init_app(app)
+webapp.profiling.init_app(app)
+
+if webapp.config.Config.XSLT_WARM_AT_BOOT:
+    webapp.xslt.warm()
+
+if webapp.config.Config.CACHE_SWEEP_INTERVAL:
+    webapp.cache_sweeper.start(webapp.config.Config.CACHE_SWEEP_INTERVAL)
 
 @app.route("/")
 @app.route("/help")
@@ -32,6 +49,13 @@ def help():
     return flask.redirect(redirect_url, 301)
 
 
+@app.route("/metrics")
+def metrics():
+    if not webapp.config.Config.METRICS_ENABLED:
+        flask.abort(404)
+    return flask.Response(webapp.metrics.render(), content_type=webapp.metrics.CONTENT_TYPE)
+
+
 @app.route("/raw/<path:pid_xpath>", strict_slashes=False, merge_slashes=False)
 def raw(pid_xpath):
     if '/' not in pid_xpath:
@@ -42,9 +66,14 @@ def raw(pid_xpath):
     env = flask.request.args.get("env") or webapp.config.Config.DEFAULT_ENV
 
     try:
+        etag = webapp.http_cache.get_raw_etag(pid_str, text_xpath, env)
+        matching_etag = webapp.http_cache.get_matching_etag(etag)
+        if matching_etag:
+            return webapp.http_cache.make_not_modified_response(matching_etag)
         xml_str = webapp.markdown_cache.get_raw(pid_str, text_xpath, env)
-        response = flask.make_response(xml_str)
+        response = webapp.compression.make_response(xml_str.encode("utf-8"))
         response.headers["Content-Type"] = f"application/xml; charset=utf-8"
+        webapp.http_cache.set_headers(response, etag)
         return response
     except Exception as e:
         logger.exception(
@@ -62,9 +91,16 @@ def markdown(pid_xpath):
     env = flask.request.args.get("env") or webapp.config.Config.DEFAULT_ENV
 
     try:
-        markdown_str = webapp.markdown_cache.get_html(pid_str, text_xpath, env)
-        response = flask.make_response(markdown_str)
+        etag = webapp.http_cache.get_html_etag(pid_str, text_xpath, env)
+        matching_etag = webapp.http_cache.get_matching_etag(etag)
+        if matching_etag:
+            return webapp.http_cache.make_not_modified_response(matching_etag)
+        response = webapp.file_response.make_html_response(pid_str, text_xpath, env)
+        if response is None:
+            html_bytes, encoding = webapp.markdown_cache.get_html_data(pid_str, text_xpath, env)
+            response = webapp.compression.make_response(html_bytes, encoding)
         response.headers["Content-Type"] = f"text/html; charset=utf-8"
+        webapp.http_cache.set_headers(response, etag)
         return response
     except Exception as e:
         logger.exception(
@@ -95,23 +131,15 @@ def multi() -> flask.Response:
         flask.abort(400, description=str(e))
     try:
         # Step 3: Build results and construct XML response
-        results = build_multi_results(pids, queries, env)
-        resultset_el = lxml.etree.Element("resultset")
-        for pid, pid_results in results.items():
-            document_el = lxml.etree.SubElement(resultset_el, "document")
-            packageid_el = lxml.etree.SubElement(document_el, "packageid")
-            packageid_el.text = pid
-            if isinstance(pid_results, list):
-                for v in pid_results:
-                    if isinstance(v, lxml.etree._Element):  # pylint: disable=protected-access
-                        document_el.append(v)
-                    else:
-                        value_el = lxml.etree.SubElement(document_el, "value")
-                        value_el.text = str(v)
-        xml_str = lxml.etree.tostring(
-            resultset_el, pretty_print=True, encoding="utf-8", xml_declaration=True
-        )
-        response = flask.make_response(xml_str)
+        xml_iter = iter_resultset_xml(iter_multi_results(pids, queries, env))
+        if len(pids) >= webapp.config.Config.MULTI_STREAM_MIN_PIDS:
+            # Send each <document> as soon as it is ready. Failures past this point are
+            # handled per pid, and leave the pid out of the response.
+            response = webapp.compression.make_streamed_response(xml_iter)
+        else:
+            xml_bytes = b"".join(xml_iter)
+            response = webapp.compression.make_response(xml_bytes)
+            webapp.http_cache.set_etag(response, werkzeug.http.generate_etag(xml_bytes))
         response.headers["Content-Type"] = "application/xml; charset=utf-8"
         return response
     except Exception as e:  # pylint: disable=broad-except
@@ -0,0 +1,133 @@
+"""Single-flight coalescing of concurrent cache misses
+
+When many requests for the same uncached entry arrive at once, only the first one should
+fetch and render it. The others wait for it to finish, and then read the result from the
+cache.
+
+lock() holds an exclusive lock for a key, both between the threads in a worker and
+between worker processes sharing a cache directory. Callers check the cache again after
+acquiring the lock, as the entry may have been written while they waited.
+
+Notes:
+    - Threads wait on a per key threading.Lock. Processes wait on a file lock, an
+      flock() on a lock file, polled every LOCK_POLL_SEC. Lock files are never removed,
+      as removing one on release would let a process that is still waiting on the
+      removed file and a process that creates a new one both hold the lock.
+    - Keys are hashed to a fixed number of lock files per namespace, so that lock files
+      do not accumulate in the cache directory. The rare keys that share a lock file are
+      serialized, which only delays them. The cache directory is not created here, and
+      only threads are coalesced until it exists.
+    - Locks in different namespaces must always be acquired in the same order, to avoid
+      deadlocks between processes. The HTML lock is taken before the EML lock.
+    - If a lock cannot be acquired within SINGLE_FLIGHT_TIMEOUT seconds, the work is done
+      without holding the lock.
+"""
+import contextlib
+import fcntl
+import hashlib
+import os
+import pathlib
+import threading
+import time
+
+import daiquiri
+
+import webapp.config
+
+log = daiquiri.getLogger(__name__)
+
+LOCK_DIR_NAME = 'lock'
+LOCK_STRIPE_COUNT = 1024
+LOCK_POLL_SEC = 0.05
+
+# (cache, namespace, key) -> [threading.Lock, number of threads holding or waiting]
+_key_lock_dict = {}
+_dict_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def lock(cache: str, namespace: str, key: str):
+    """Hold the lock for a key in a cache directory"""
+    timeout = webapp.config.Config.SINGLE_FLIGHT_TIMEOUT
+    lock_key = (cache, namespace, key)
+    with contextlib.ExitStack() as exit_stack:
+        thread_lock = _get_key_lock(lock_key)
+        exit_stack.callback(_put_key_lock, lock_key)
+        if not thread_lock.acquire(timeout=timeout):
+            log.warning(f'Timed out waiting for lock. key="{key}"')
+            yield
+            return
+        exit_stack.callback(thread_lock.release)
+        try:
+            is_locked = exit_stack.enter_context(
+                file_lock(_get_lock_path(cache, namespace, key), timeout)
+            )
+        except FileNotFoundError:
+            # The cache directory does not exist yet
+            is_locked = True
+        if not is_locked:
+            log.warning(f'Timed out waiting for lock file. key="{key}"')
+        yield
+
+
+@contextlib.contextmanager
+def file_lock(lock_path: pathlib.Path, timeout: float):
+    """Hold an exclusive lock on a lock file, between processes and between threads.
+    Yields True once the lock is held, or False if it could not be acquired within timeout
+    seconds.
+
+    The lock file and its directory are created if needed. Raises FileNotFoundError if the
+    parent of the directory does not exist. The lock is not reentrant.
+    """
+    try:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    except FileNotFoundError:
+        lock_path.parent.mkdir(exist_ok=True)
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    # The lock is held by the open file, and released when it is closed
+    try:
+        yield _flock(fd, timeout)
+    finally:
+        os.close(fd)
+
+
+def _get_key_lock(lock_key: tuple) -> threading.Lock:
+    with _dict_lock:
+        entry = _key_lock_dict.setdefault(lock_key, [threading.Lock(), 0])
+        entry[1] += 1
+        return entry[0]
+
+
+def _put_key_lock(lock_key: tuple):
+    with _dict_lock:
+        entry = _key_lock_dict[lock_key]
+        entry[1] -= 1
+        if not entry[1]:
+            del _key_lock_dict[lock_key]
+
+
+def _get_lock_path(cache: str, namespace: str, key: str) -> pathlib.Path:
+    stripe_idx = int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % LOCK_STRIPE_COUNT
+    return pathlib.Path(cache, LOCK_DIR_NAME, f'{namespace}-{stripe_idx:04d}.lock')
+
+
+def _flock(fd: int, timeout: float) -> bool:
+    deadline_ts = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline_ts:
+                return False
+        time.sleep(LOCK_POLL_SEC)
+
+
+def _reset_after_fork():
+    """Locks held by the parent process are not held by the child"""
+    global _dict_lock
+    _dict_lock = threading.Lock()
+    _key_lock_dict.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
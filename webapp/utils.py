@@ -1,29 +1,135 @@
 import pathlib
+import threading
+import urllib.parse
 
 import daiquiri
 import lxml.etree
 import lxml.objectify
 import requests
+import requests.adapters
+import urllib3.util.retry
 
 import webapp
+import webapp.cache_file
+import webapp.cache_key
+import webapp.compression
+import webapp.config
+import webapp.eml_store
 import webapp.markdown_cache
+import webapp.metrics
 import webapp.exceptions
 
 logger = daiquiri.getLogger(__name__)
 
 
+# One HTTP adapter, and so one pool of keep-alive connections, per PASTA server
+# (scheme and host). Each PASTA environment is on its own server.
+_adapter_dict: dict[str, requests.adapters.HTTPAdapter] = {}
+_adapter_lock = threading.Lock()
+# requests.Session is not guaranteed to be thread safe, so each thread has its own sessions,
+# which share the connection pools of the adapters.
+_session_local = threading.local()
+
+
 def requests_wrapper(url: str) -> bytes:
-    r = requests.get(url)
+    config = webapp.config.Config
+    server = _get_server(url)
+    try:
+        r = _get_session(url).get(
+            url, timeout=(config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT)
+        )
+    except requests.exceptions.RequestException:
+        webapp.metrics.inc(webapp.metrics.UPSTREAM_TOTAL, server=server, status='error')
+        raise
+    webapp.metrics.inc(webapp.metrics.UPSTREAM_TOTAL, server=server, status=str(r.status_code))
     if r.ok:
         return r.content
     else:
         raise requests.exceptions.ConnectionError(r.reason)
 
 
-def get_etree_as_pretty_printed_xml(el: lxml.etree.Element) -> str:
-    """etree to pretty printed XML"""
+def _get_server(url: str) -> str:
+    parsed = urllib.parse.urlsplit(url)
+    return f'{parsed.scheme}://{parsed.netloc}'
+
+
+def _get_adapter(server: str) -> requests.adapters.HTTPAdapter:
+    with _adapter_lock:
+        adapter = _adapter_dict.get(server)
+        if adapter is None:
+            config = webapp.config.Config
+            retry = urllib3.util.retry.Retry(
+                total=config.HTTP_MAX_RETRIES,
+                backoff_factor=config.HTTP_RETRY_BACKOFF,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=('GET', 'HEAD'),
+                # Return the last response when retries run out, instead of raising.
+                raise_on_status=False,
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=config.HTTP_POOL_SIZE,
+                max_retries=retry,
+                pool_block=False,
+            )
+            _adapter_dict[server] = adapter
+        return adapter
+
+
+def _get_session(url: str) -> requests.Session:
+    server = _get_server(url)
+    adapter = _get_adapter(server)
+    session_dict = getattr(_session_local, 'session_dict', None)
+    if session_dict is None:
+        session_dict = _session_local.session_dict = {}
+    session = session_dict.get(server)
+    if session is None:
+        session = session_dict[server] = requests.Session()
+    # The adapter is replaced after close_http_pools()
+    if session.adapters.get(server) is not adapter:
+        session.mount(server, adapter)
+    return session
+
+
+def get_http_pool_stats() -> dict[str, dict[str, int]]:
+    """Return the number of requests made to each PASTA server, and the number of new
+    connections that were opened for them. Requests that did not need a new connection
+    reused a keep-alive connection.
+    """
+    stats_dict = {}
+    with _adapter_lock:
+        adapter_list = list(_adapter_dict.items())
+    for server, adapter in adapter_list:
+        request_count = connection_count = 0
+        for pool_key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools.get(pool_key)
+            if pool is not None:
+                request_count += pool.num_requests
+                connection_count += pool.num_connections
+        stats_dict[server] = {
+            'requests': request_count,
+            'connections': connection_count,
+            'reused': request_count - connection_count,
+        }
+    return stats_dict
+
+
+def close_http_pools():
+    """Close all pooled connections, and reset the pool stats. Later requests open new
+    pools, set up from the current configuration."""
+    with _adapter_lock:
+        for adapter in _adapter_dict.values():
+            adapter.close()
+        _adapter_dict.clear()
+
+
+def get_etree_as_pretty_printed_xml(el: lxml.etree.Element, deannotate: bool = True) -> str:
+    """etree to pretty printed XML
+
+    By default, the tree that el belongs to is deannotated first, which modifies it.
+    """
     # assert isinstance(el, lxml.etree._Element), f'Expected Element. Received {type(el)}'
-    if hasattr(el, 'getroottree'):
+    if deannotate and hasattr(el, 'getroottree'):
         lxml.objectify.deannotate(el.getroottree(), cleanup_namespaces=True, xsi_nil=True)
     return lxml.etree.tostring(
         el, pretty_print=True, with_tail=False, xml_declaration=False
@@ -58,50 +164,35 @@ def first(el: lxml.etree.Element, xpath: str) -> str:
 
 def get_cache_path(pid: str, cache: str) -> str:
     """Return the cache file path for a given pid and cache directory."""
-    from webapp.markdown_cache import safe_filename
+    return str(webapp.cache_key.get_eml_path(pid, cache))
 
-    return str(pathlib.Path(cache, f"{safe_filename(pid)}.eml.xml"))
+
+def download_eml(pid: str, pasta_url: str, cache: str) -> bytes:
+    """Download the raw EML XML for the given pid from pasta_url, write it to the cache,
+    and return it. Raises ValueError, and leaves the cache as is, if the document is empty
+    or truncated."""
+    eml_url = f"{pasta_url}/metadata/eml/{'/'.join(pid.strip().split('.'))}"
+    with webapp.metrics.timer('download'):
+        eml_bytes = requests_wrapper(eml_url)
+    if not webapp.cache_file.is_valid_eml(eml_bytes):
+        raise ValueError(f'Received an empty or truncated EML document. pid="{pid}"')
+    eml_path = pathlib.Path(get_cache_path(pid, cache))
+    eml_path.parent.mkdir(parents=True, exist_ok=True)
+    webapp.compression.write(eml_path, eml_bytes)
+    return eml_bytes
 
 
 def download_eml_to_cache(pid: str, pasta_url: str, cache: str) -> str:
     """Download the raw EML XML for the given pid from pasta_url and write to cache_dir.
     Returns the path to the cached EML XML file as a string."""
-
-    eml_url = f"{pasta_url}/metadata/eml/{'/'.join(pid.strip().split('.'))}"
-    eml_bytes = requests_wrapper(eml_url)
-    eml_path = get_cache_path(pid, cache)
-    pathlib.Path(eml_path).parent.mkdir(parents=True, exist_ok=True)
-    pathlib.Path(eml_path).write_bytes(eml_bytes)
-    return eml_path
+    download_eml(pid, pasta_url, cache)
+    return get_cache_path(pid, cache)
 
 
 def get_eml(pid: str, env: str) -> bytes:
     """
     Retrieve the raw EML XML for a given pid and environment.
-    Checks cache first, fetches and caches if missing, then returns the XML bytes.
-    Handles both real and mocked download_eml_to_cache.
+    The EML is taken from webapp.eml_store, which only downloads it from PASTA if it is
+    not already held in memory or in the cache.
     """
-    # Determine pasta and cache from env
-    if env.lower() in ("d", "dev", "development"):
-        pasta = webapp.config.Config.PASTA_D
-        cache = webapp.config.Config.CACHE_D
-    elif env.lower() in ("s", "stage", "staging"):
-        pasta = webapp.config.Config.PASTA_S
-        cache = webapp.config.Config.CACHE_S
-    elif env.lower() in ("p", "prod", "production"):
-        pasta = webapp.config.Config.PASTA_P
-        cache = webapp.config.Config.CACHE_P
-    else:
-        msg = f"Requested PASTA environment not supported: {env}"
-        raise webapp.exceptions.PastaEnvironmentError(msg)
-
-    from webapp.markdown_cache import safe_filename
-
-    eml_path = pathlib.Path(cache, f"{safe_filename(pid)}.eml.xml")
-    if eml_path.is_file():
-        return eml_path.read_bytes()
-    # If not cached, fetch and cache
-    result = download_eml_to_cache(pid, pasta, cache)
-    if isinstance(result, bytes):
-        return result
-    return pathlib.Path(result).read_bytes()
+    return webapp.eml_store.get_eml(pid, env)
@@ -0,0 +1,101 @@
+"""LRU cache of compiled XPath expressions
+
+Calling xpath() on an element parses and compiles the expression on every call. /multi
+runs the same list of queries against every pid in a request, and the HTML and raw
+endpoints see the same expressions over and over, so compiled expressions are kept here,
+keyed by the expression text.
+
+Expressions that fail to compile are cached as well, so that an invalid query is only
+compiled, and logged, once.
+
+Notes:
+    - A compiled lxml.etree.XPath serializes evaluations with a lock of its own, so it
+      can be shared between threads.
+    - Namespace prefixes cannot be used in the expressions, as no prefixes are
+      registered. This is the same as when calling xpath() without a namespace map.
+"""
+import collections
+import copy
+import threading
+
+import daiquiri
+import lxml.etree
+
+import webapp.config
+
+log = daiquiri.getLogger(__name__)
+
+
+class XPathCache(object):
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # expr -> compiled XPath, or the exception raised when compiling it
+        self._cache_dict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, expr: str) -> lxml.etree.XPath:
+        """Return the compiled XPath for an expression.
+
+        Raises lxml.etree.XPathSyntaxError if the expression is invalid, also when the
+        failure is cached.
+        """
+        compiled = self._get(expr)
+        if isinstance(compiled, Exception):
+            # Raise a copy, so that the cached exception does not collect tracebacks
+            raise copy.copy(compiled)
+        return compiled
+
+    def get_or_none(self, expr: str) -> lxml.etree.XPath | None:
+        """Return the compiled XPath for an expression, or None if it is invalid"""
+        compiled = self._get(expr)
+        if isinstance(compiled, Exception):
+            return None
+        return compiled
+
+    def xpath(self, el: lxml.etree._Element, expr: str):
+        """Evaluate an expression with el as the context node. Equivalent to
+        el.xpath(expr)."""
+        return self.get(expr)(el)
+
+    def get_stats(self) -> dict:
+        return {
+            'count': len(self._cache_dict),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._cache_dict.clear()
+
+    def _get(self, expr: str) -> lxml.etree.XPath | Exception:
+        with self._lock:
+            try:
+                compiled = self._cache_dict[expr]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._cache_dict.move_to_end(expr)
+                self.hits += 1
+                return compiled
+        try:
+            compiled = lxml.etree.XPath(expr)
+        except lxml.etree.XPathSyntaxError as e:
+            log.error(f'Invalid XPath expression. expr="{expr}" error="{e}"')
+            compiled = e
+        with self._lock:
+            self._cache_dict[expr] = compiled
+            while len(self._cache_dict) > self.max_size:
+                self._cache_dict.popitem(last=False)
+        return compiled
+
+
+CACHE = XPathCache(webapp.config.Config.XPATH_CACHE_SIZE)
+
+get = CACHE.get
+get_or_none = CACHE.get_or_none
+xpath = CACHE.xpath
+get_stats = CACHE.get_stats
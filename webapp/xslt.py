@@ -0,0 +1,107 @@
+"""Registry of precompiled XSLT stylesheets
+
+Parsing and compiling a stylesheet is far more expensive than applying it. This is
+especially true for the DocBook stylesheet, which pulls in the complete docbook-xsl
+tree through xsl:import and xsl:include. The registry compiles each stylesheet once and
+hands out the compiled transform on every later call.
+
+Notes:
+    - libxslt is most efficient when a stylesheet is applied in the same thread that
+      compiled it. lxml handles a stylesheet that is shared between threads by copying
+      it on every call, which would bring back much of the cost we are trying to avoid.
+      So compiled transforms are kept per thread. With the default gunicorn sync
+      workers, there is one thread per worker, so each stylesheet is compiled once per
+      worker.
+    - Calling warm() before gunicorn forks its workers (--preload) compiles the
+      stylesheets in the master process, and the workers inherit them.
+"""
+import io
+import pathlib
+import threading
+
+import daiquiri
+import lxml.etree
+
+log = daiquiri.getLogger(__name__)
+
+
+class XsltRegistry(object):
+    def __init__(self):
+        # name -> (path, xsl_str, generation). Registrations are shared by all threads.
+        self._source_dict = {}
+        # Bumped on every registration, so that threads holding a transform compiled
+        # from an earlier registration of the same name will recompile it.
+        self._generation = 0
+        self._lock = threading.Lock()
+        # Compiled transforms, one dict per thread.
+        self._local = threading.local()
+
+    def register(self, name: str, path: pathlib.Path = None, xsl_str: str = None):
+        """Register a stylesheet, given either as a path or as an XSL string.
+
+        Registering is cheap. The stylesheet is not parsed until it is first used, or
+        until warm() is called.
+        """
+        if (path is None) == (xsl_str is None):
+            raise ValueError('Register a stylesheet with either a path or an XSL string')
+        with self._lock:
+            self._generation += 1
+            self._source_dict[name] = (path, xsl_str, self._generation)
+
+    def get(self, name: str) -> lxml.etree.XSLT:
+        """Return the compiled transform for a registered stylesheet"""
+        try:
+            path, xsl_str, generation = self._source_dict[name]
+        except KeyError:
+            raise KeyError(f'XSLT stylesheet has not been registered: {name}')
+        compiled_dict = self._get_compiled_dict()
+        try:
+            compiled_generation, transform_func = compiled_dict[name]
+            if compiled_generation == generation:
+                return transform_func
+        except KeyError:
+            pass
+        transform_func = self._compile(path, xsl_str)
+        compiled_dict[name] = (generation, transform_func)
+        return transform_func
+
+    def get_path(self, path: pathlib.Path) -> lxml.etree.XSLT:
+        """Return the compiled transform for a stylesheet file, registering it by path
+        if it has not been seen before.
+        """
+        name = pathlib.Path(path).as_posix()
+        if name not in self._source_dict:
+            self.register(name, path=pathlib.Path(path))
+        return self.get(name)
+
+    def warm(self, name_list: list[str] = None):
+        """Compile registered stylesheets ahead of the first request"""
+        for name in name_list or list(self._source_dict):
+            log.info(f'Compiling XSLT stylesheet: {name}')
+            self.get(name)
+
+    def clear(self):
+        """Drop the compiled transforms held for the calling thread"""
+        self._get_compiled_dict().clear()
+
+    def _get_compiled_dict(self) -> dict:
+        try:
+            return self._local.compiled_dict
+        except AttributeError:
+            self._local.compiled_dict = {}
+            return self._local.compiled_dict
+
+    def _compile(self, path: pathlib.Path, xsl_str: str) -> lxml.etree.XSLT:
+        if path is not None:
+            xslt_el = lxml.etree.parse(pathlib.Path(path).as_posix())
+        else:
+            xslt_el = lxml.etree.parse(io.StringIO(xsl_str))
+        return lxml.etree.XSLT(xslt_el)
+
+
+REGISTRY = XsltRegistry()
+
+register = REGISTRY.register
+get = REGISTRY.get
+get_path = REGISTRY.get_path
+warm = REGISTRY.warm